@@ -0,0 +1,81 @@
+"""Script that benchmarks the highpass filter applied by
+``songdkl.audio.filtersong``, that designs the filter once
+for each cutoff and sampling rate and applies it as second-order sections
+with ``scipy.signal.sosfiltfilt``, against designing the filter
+for every .wav file and applying it with ``scipy.signal.filtfilt``,
+as ``songdkl`` did previously.
+
+Uses .wav files from the song_data directory
+of the Plos Comp. Bio. paper dataset.
+For each directory, records the time taken by each method,
+the maximum difference between the filtered audio,
+and the number of .wav files where the syllables segmented
+from the filtered audio are different.
+
+This script assumes that the nox session
+`download-pcb-dataset` has already been run."""
+import pathlib
+import time
+
+import numpy as np
+import scipy.signal
+
+import songdkl
+
+DATA_ROOT = pathlib.Path('./data')
+SONG_DATA_ROOT = DATA_ROOT / 'pcb_data/song_data'
+SONG_DATA_SUBDIRS = sorted(
+    dir_ for dir_ in SONG_DATA_ROOT.iterdir() if dir_.is_dir()
+)
+MAX_WAVS = 20
+
+
+def filtersong_ba(audio_arr):
+    b, a = scipy.signal.iirdesign(wp=0.04, ws=0.02, gpass=1, gstop=60, ftype='ellip')
+    return scipy.signal.filtfilt(b, a, audio_arr)
+
+
+def main():
+    total_ba, total_sos, total_wavs, total_slices_diff = 0., 0., 0, 0
+    for song_data_subdir in SONG_DATA_SUBDIRS:
+        wav_paths = sorted(song_data_subdir.glob('*.wav'))[:MAX_WAVS]
+        seconds_ba, seconds_sos, max_rel_diff, n_slices_diff = 0., 0., 0., 0
+        for wav_path in wav_paths:
+            rate, data = songdkl.audio.load_wav(wav_path)
+
+            tic = time.perf_counter()
+            expected = filtersong_ba(data)
+            seconds_ba += time.perf_counter() - tic
+
+            tic = time.perf_counter()
+            filtered = songdkl.audio.filtersong(data, rate)
+            seconds_sos += time.perf_counter() - tic
+
+            max_rel_diff = max(max_rel_diff, np.max(np.abs(filtered - expected)) / np.max(np.abs(expected)))
+            expected_slices = songdkl.audio.segment_audio(
+                songdkl.audio.apply_threshold(songdkl.audio.smoothrect(expected, 10, rate))
+            )
+            slices = songdkl.audio.segment_audio(
+                songdkl.audio.apply_threshold(songdkl.audio.smoothrect(filtered, 10, rate))
+            )
+            n_slices_diff += slices != expected_slices
+
+        print(
+            f'{song_data_subdir.name}: {len(wav_paths)} .wav files, iirdesign + filtfilt: {seconds_ba:.2f} s, '
+            f'cached sos + sosfiltfilt: {seconds_sos:.2f} s, max. relative difference: {max_rel_diff:.2e}, '
+            f'.wav files with different segments: {n_slices_diff}'
+        )
+        total_ba += seconds_ba
+        total_sos += seconds_sos
+        total_wavs += len(wav_paths)
+        total_slices_diff += n_slices_diff
+
+    print(
+        f'Total for {total_wavs} .wav files, iirdesign + filtfilt: {total_ba:.2f} s, '
+        f'cached sos + sosfiltfilt: {total_sos:.2f} s (speedup: {total_ba / total_sos:.2f}x), '
+        f'.wav files with different segments: {total_slices_diff}.'
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Script that benchmarks ``songdkl.numsyls.numsyls``
+with and without warm-started model fits,
+on all .zarr files prepared from the song_data
+directory of the Plos Comp Bio. paper dataset.
+
+For each bird, records the wall time
+and the number of syllables that is chosen,
+and saves these in a .csv file.
+
+This script assumes that ``prep_song_data.py``
+has already been run."""
+import csv
+import pathlib
+import time
+
+import songdkl
+
+RESULTS_ROOT = pathlib.Path('./results')
+PREPD_SONG_DATA_ROOT = RESULTS_ROOT / 'pcb_data/song_data'
+CSV_PATH = RESULTS_ROOT / 'benchmark_numsyls_warm_start.csv'
+
+FIELDNAMES = ['zarr_path', 'warm_start', 'seconds', 'n_syls']
+
+
+def main():
+    zarr_paths = sorted(PREPD_SONG_DATA_ROOT.glob('*.songdkl.zarr'))
+    rows = []
+    for zarr_path in zarr_paths:
+        print(
+            f'Benchmarking numsyls on: {zarr_path}'
+        )
+        psds = songdkl.load.load(zarr_path)
+        for warm_start in (False, True):
+            tic = time.perf_counter()
+            n_syls = songdkl.numsyls.numsyls(psds, warm_start=warm_start)
+            seconds = time.perf_counter() - tic
+            rows.append(
+                dict(zarr_path=str(zarr_path), warm_start=warm_start, seconds=seconds, n_syls=n_syls)
+            )
+
+    with CSV_PATH.open('w', newline='') as fp:
+        writer = csv.DictWriter(fp, fieldnames=FIELDNAMES)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    cold = [row for row in rows if not row['warm_start']]
+    warm = [row for row in rows if row['warm_start']]
+    total_cold = sum(row['seconds'] for row in cold)
+    total_warm = sum(row['seconds'] for row in warm)
+    n_same = sum(cold_row['n_syls'] == warm_row['n_syls'] for cold_row, warm_row in zip(cold, warm))
+    print(
+        f'Total time without warm start: {total_cold:.2f} s, with warm start: {total_warm:.2f} s '
+        f'(speedup: {total_cold / total_warm:.2f}x).\n'
+        f'Chose the same number of syllables for {n_same} of {len(cold)} birds.\n'
+        f'Saved results in: {CSV_PATH}'
+    )
+
+
+if __name__ == '__main__':
+    # name == main required here to avoid multiprocess error with dask,
+    # see https://github.com/dask/distributed/issues/2520
+    main()
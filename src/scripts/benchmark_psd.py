@@ -0,0 +1,80 @@
+"""Script that benchmarks computing PSDs of syllables
+with ``songdkl.psd.welch_psd``, that computes PSDs for all syllables
+from a .wav file at once, against calling ``matplotlib.mlab.psd``
+one syllable at a time, as ``songdkl`` did previously.
+
+Uses .wav files from the song_data directory
+of the Plos Comp Bio. paper dataset.
+For each directory, records the time taken by each method,
+and the maximum difference between the PSDs they compute.
+
+This script assumes that the nox session
+`download-pcb-dataset` has already been run."""
+import pathlib
+import time
+
+import matplotlib.mlab
+import numpy as np
+
+import songdkl
+
+DATA_ROOT = pathlib.Path('./data')
+SONG_DATA_ROOT = DATA_ROOT / 'pcb_data/song_data'
+SONG_DATA_SUBDIRS = sorted(
+    dir_ for dir_ in SONG_DATA_ROOT.iterdir() if dir_.is_dir()
+)
+MAX_WAVS = 20
+
+
+def mlab_psds(syls_from_wav):
+    fs = syls_from_wav.rate
+    nfft = int(round(2 ** 14 / 32000.0 * fs))
+    return np.array([
+        matplotlib.mlab.psd(songdkl.syllables.norm(syl), NFFT=nfft, Fs=fs)[0]
+        for syl in syls_from_wav.syls
+    ])
+
+
+def welch_psds(syls_from_wav):
+    fs = syls_from_wav.rate
+    nfft = int(round(2 ** 14 / 32000.0 * fs))
+    return songdkl.psd.welch_psd([songdkl.syllables.norm(syl) for syl in syls_from_wav.syls], nfft=nfft, fs=fs)
+
+
+def main():
+    total_mlab, total_welch, total_syls = 0., 0., 0
+    for song_data_subdir in SONG_DATA_SUBDIRS:
+        wav_paths = sorted(song_data_subdir.glob('*.wav'))[:MAX_WAVS]
+        syls_from_wavs = songdkl.syllables.get_all_syls(wav_paths)
+        n_syls = sum(len(syls_from_wav.syls) for syls_from_wav in syls_from_wavs)
+
+        tic = time.perf_counter()
+        expected = [mlab_psds(syls_from_wav) for syls_from_wav in syls_from_wavs]
+        seconds_mlab = time.perf_counter() - tic
+
+        tic = time.perf_counter()
+        psds = [welch_psds(syls_from_wav) for syls_from_wav in syls_from_wavs]
+        seconds_welch = time.perf_counter() - tic
+
+        max_rel_diff = max(
+            np.max(np.abs(psds_ - expected_)) / np.max(np.abs(expected_))
+            for psds_, expected_ in zip(psds, expected) if len(expected_) > 0
+        )
+        print(
+            f'{song_data_subdir.name}: {n_syls} syllables, mlab.psd: {seconds_mlab:.2f} s, '
+            f'welch_psd: {seconds_welch:.2f} s, max. relative difference: {max_rel_diff:.2e}'
+        )
+        total_mlab += seconds_mlab
+        total_welch += seconds_welch
+        total_syls += n_syls
+
+    print(
+        f'Total for {total_syls} syllables, mlab.psd: {total_mlab:.2f} s, welch_psd: {total_welch:.2f} s '
+        f'(speedup: {total_mlab / total_welch:.2f}x).'
+    )
+
+
+if __name__ == '__main__':
+    # name == main required here to avoid multiprocess error with dask,
+    # see https://github.com/dask/distributed/issues/2520
+    main()
@@ -0,0 +1,99 @@
+"""Script that compares results computed with
+``dtype='float32'`` against results computed with ``dtype='float64'``,
+on all .zarr files prepared from the song_data
+directory of the Plos Comp Bio. paper dataset.
+
+For each bird, records the number of syllables
+estimated by ``songdkl.numsyls.numsyls`` with each dtype.
+Then computes the matrix of song divergences between all birds
+with ``songdkl.songdkl.calculate_matrix`` with each dtype,
+using the number of syllables estimated with float64.
+Saves results for each bird and each pair of birds in .csv files,
+and prints the largest absolute and relative differences in song divergence,
+and the number of birds where the estimated number of syllables differs.
+
+This script assumes that ``prep_song_data.py``
+has already been run."""
+import csv
+import pathlib
+import time
+
+import numpy as np
+
+import songdkl
+
+RESULTS_ROOT = pathlib.Path('./results')
+PREPD_SONG_DATA_ROOT = RESULTS_ROOT / 'pcb_data/song_data'
+NUMSYLS_CSV_PATH = RESULTS_ROOT / 'compare_float32_numsyls.csv'
+DKL_CSV_PATH = RESULTS_ROOT / 'compare_float32_dkl.csv'
+
+DTYPES = ('float64', 'float32')
+
+
+def main():
+    zarr_paths = sorted(PREPD_SONG_DATA_ROOT.glob('*.songdkl.zarr'))
+
+    numsyls_rows = []
+    n_syls = {dtype: [] for dtype in DTYPES}
+    for zarr_path in zarr_paths:
+        print(
+            f'Estimating number of syllables for: {zarr_path}'
+        )
+        row = dict(zarr_path=str(zarr_path))
+        for dtype in DTYPES:
+            psds = songdkl.load.load(zarr_path).astype(dtype)
+            tic = time.perf_counter()
+            n_syls_dtype = songdkl.numsyls.numsyls(psds, dtype=dtype)
+            row[f'n_syls_{dtype}'] = n_syls_dtype
+            row[f'seconds_{dtype}'] = time.perf_counter() - tic
+            n_syls[dtype].append(n_syls_dtype)
+        numsyls_rows.append(row)
+
+    with NUMSYLS_CSV_PATH.open('w', newline='') as fp:
+        writer = csv.DictWriter(fp, fieldnames=list(numsyls_rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(numsyls_rows)
+
+    DKL_PQ = {}
+    for dtype in DTYPES:
+        print(
+            f'Calculating songdkl matrix with dtype={dtype}'
+        )
+        psds = [songdkl.load.load(zarr_path).astype(dtype) for zarr_path in zarr_paths]
+        tic = time.perf_counter()
+        DKL_PQ[dtype], _, _ = songdkl.songdkl.calculate_matrix(psds, n_syls['float64'], dtype=dtype)
+        print(
+            f'Took {time.perf_counter() - tic:.2f} s'
+        )
+
+    dkl_rows = []
+    for ref_ind, ref_path in enumerate(zarr_paths):
+        for compare_ind, compare_path in enumerate(zarr_paths):
+            if ref_ind == compare_ind:
+                continue
+            dkl_rows.append(
+                dict(ref_path=str(ref_path), compare_path=str(compare_path),
+                     **{f'DKL_PQ_{dtype}': DKL_PQ[dtype][ref_ind, compare_ind] for dtype in DTYPES})
+            )
+    with DKL_CSV_PATH.open('w', newline='') as fp:
+        writer = csv.DictWriter(fp, fieldnames=list(dkl_rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(dkl_rows)
+
+    abs_diff = np.abs(DKL_PQ['float32'] - DKL_PQ['float64'])
+    off_diagonal = ~np.eye(len(zarr_paths), dtype=bool)
+    rel_diff = abs_diff[off_diagonal] / np.abs(DKL_PQ['float64'][off_diagonal])
+    n_numsyls_diff = sum(n_64 != n_32 for n_64, n_32 in zip(n_syls['float64'], n_syls['float32']))
+    print(
+        f'Largest absolute difference in song divergence: {abs_diff.max():.6g}, '
+        f'largest relative difference: {rel_diff.max():.6g}, '
+        f'median relative difference: {np.median(rel_diff):.6g}.\n'
+        f'Estimated number of syllables differed for {n_numsyls_diff} of {len(zarr_paths)} birds.\n'
+        f'Saved results in: {NUMSYLS_CSV_PATH} and {DKL_CSV_PATH}'
+    )
+
+
+if __name__ == '__main__':
+    # name == main required here to avoid multiprocess error with dask,
+    # see https://github.com/dask/distributed/issues/2520
+    main()
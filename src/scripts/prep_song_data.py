@@ -19,14 +19,17 @@ PREPD_SONG_DATA_ROOT = RESULTS_ROOT / 'pcb_data/song_data'
 
 
 def main():
-    for song_data_subdir in SONG_DATA_SUBDIRS:
-        print(
-            f'Preparing dataset from: {song_data_subdir}'
-        )
-        songdkl.prep.prep_and_save(
-            dir_path=song_data_subdir,
-            output_dir_path=PREPD_SONG_DATA_ROOT,
-        )
+    print(
+        f'Preparing datasets from {len(SONG_DATA_SUBDIRS)} directories in: {SONG_DATA_ROOT}'
+    )
+    # prepare directories in parallel, using all CPUs
+    results = songdkl.prep.prep_and_save(
+        dir_path=SONG_DATA_SUBDIRS,
+        output_dir_path=PREPD_SONG_DATA_ROOT,
+        n_jobs=-1,
+    )
+    for result in results:
+        print(result.throughput())
 
 
 if __name__ == '__main__':
@@ -12,11 +12,16 @@ from .__about__ import (
 
 from . import (
     audio,
+    batch,
+    cache,
     constants,
+    distance,
     load,
     logging,
+    model,
     numsyls,
     prep,
+    psd,
     songdkl,
     syllables,
     timenow,
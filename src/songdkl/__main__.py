@@ -1,13 +1,19 @@
 """run when songdkl is called from the command-line, e.g. '$ songdkl --help'"""
 from __future__ import annotations
+import contextlib
 import dataclasses
 import logging
+import pathlib
+import sys
 
 from . import argparser
+from .batch import calculate_batch
 from .constants import DefaultGaussianMixtureKwargs
+from .model import calculate_from_model_path, fit_model_from_path, load_model_attrs, save_model
 from .numsyls import numsyls_from_path
 from .prep import prep_and_save
-from .songdkl import calculate_from_path
+from .songdkl import calculate_from_path, calculate_many_from_path, calculate_matrix_from_path
+from .syllables import dask_scheduler
 
 
 from .logging import config_logging_for_cli, log_version
@@ -23,6 +29,24 @@ def main(argv=None):
     config_logging_for_cli()
     log_version(logger)
 
+    if args.command == 'calculate' and args.manifest is not None:
+        # jobs run in worker processes, and ``calculate_batch`` sets the scheduler inside each one
+        if args.scheduler == 'distributed' and args.jobs > 1:
+            parser.error(
+                "--scheduler distributed cannot be used with --jobs greater than 1"
+            )
+        scheduler_context = contextlib.nullcontext()
+    elif args.command in ('calculate', 'calculate-many', 'calculate-from-model', 'calculate-matrix', 'numsyls'):
+        # used when datasets are prepared from directories of .wav files
+        scheduler_context = dask_scheduler(args.scheduler, args.n_workers)
+    else:
+        scheduler_context = contextlib.nullcontext()
+    with scheduler_context:
+        _run(parser, args)
+
+
+def _run(parser, args):
+    """Helper function that runs the command specified by ``args``"""
     if args.command == 'prep':
         # handle edge case where user passes only one output dir,
         # but argparse wraps in list because nargs='+'.
@@ -35,23 +59,96 @@ def main(argv=None):
         else:
             output_dir_path = None
         prep_and_save(dir_path=args.dir_path, output_dir_path=output_dir_path,
-                      max_wavs=args.max_wavs, max_num_psds=args.max_num_psds)
+                      max_wavs=args.max_wavs, max_num_psds=args.max_num_psds,
+                      incremental=args.incremental,
+                      freq_range=tuple(args.freq_range),
+                      dtype=args.dtype,
+                      n_jobs=args.jobs,
+                      scheduler=args.scheduler,
+                      partition_size=args.partition_size,
+                      threshold=args.threshold)
 
-    if args.command in ('calculate', 'numsyls'):
+    if args.command in ('calculate', 'calculate-many', 'calculate-matrix', 'numsyls'):
         gmm_kwargs = dataclasses.asdict(DefaultGaussianMixtureKwargs())
         for arg in ('max_iter', 'n_init', 'covariance_type', 'random_state', 'reg_covar'):
             gmm_kwargs.update({arg: getattr(args, arg)})
+    if args.command in ('calculate', 'calculate-many', 'calculate-from-model', 'calculate-matrix', 'numsyls'):
+        if args.cache_max_size is not None:
+            # convert from gigabytes to bytes
+            cache_max_size = int(args.cache_max_size * 1024 ** 3)
+        else:
+            cache_max_size = None
+
+    if args.command == 'calculate' and args.manifest is not None:
+        if args.save_ref_model is not None:
+            parser.error('--save-ref-model cannot be used with --manifest')
+        calculate_batch(jobs=args.manifest,
+                        n_jobs=args.jobs,
+                        output=sys.stdout,
+                        max_wavs=args.max_wavs,
+                        max_num_psds=args.max_num_psds,
+                        n_basis=args.n_basis,
+                        basis=args.basis,
+                        gmm_kwargs=gmm_kwargs,
+                        cache_dir=args.cache_dir,
+                        cache_max_size=cache_max_size,
+                        freq_range=tuple(args.freq_range),
+                        dtype=args.dtype,
+                        threshold=args.threshold,
+                        scheduler=args.scheduler,
+                        n_workers=args.n_workers)
 
-    if args.command == 'calculate':
-        score1, score2, n_psds_ref, n_psds_compare = calculate_from_path(ref_path=args.ref_path,
-                                                                         compare_path=args.compare_path,
-                                                                         k_ref=args.k_ref,
-                                                                         k_compare=args.k_compare,
-                                                                         max_wavs=args.max_wavs,
-                                                                         max_num_psds=args.max_num_psds,
-                                                                         n_basis=args.n_basis,
-                                                                         basis=args.basis,
-                                                                         gmm_kwargs=gmm_kwargs)
+    elif args.command == 'calculate':
+        if any(getattr(args, arg) is None for arg in ('ref_path', 'compare_path', 'k_ref', 'k_compare')):
+            parser.error(
+                'calculate requires either the arguments ref-path, compare-path, k-ref and k-compare, '
+                'or the --manifest option'
+            )
+        if args.save_ref_model is not None:
+            if pathlib.Path(args.ref_path).suffix != '.zarr':
+                parser.error(
+                    '--save-ref-model requires ref-path to be a .songdkl.zarr file prepared by songdkl prep'
+                )
+            model = fit_model_from_path(args.ref_path, args.k_ref,
+                                        max_wavs=args.max_wavs,
+                                        max_num_psds=args.max_num_psds,
+                                        n_basis=args.n_basis,
+                                        basis=args.basis,
+                                        gmm_kwargs=gmm_kwargs,
+                                        cache_dir=args.cache_dir,
+                                        cache_max_size=cache_max_size,
+                                        freq_range=tuple(args.freq_range),
+                                        dtype=args.dtype,
+                                        threshold=args.threshold)
+            save_model(model, args.ref_path, args.save_ref_model)
+            # score with the normalization the model was fit with, so the model of the reference is not fit again
+            scores1, scores2, n_psds_ref, n_psds_compares = calculate_from_model_path(model_path=args.ref_path,
+                                                                                      compare_paths=[args.compare_path],
+                                                                                      k_compares=[args.k_compare],
+                                                                                      name=args.save_ref_model,
+                                                                                      max_wavs=args.max_wavs,
+                                                                                      max_num_psds=args.max_num_psds,
+                                                                                      cache_dir=args.cache_dir,
+                                                                                      cache_max_size=cache_max_size,
+                                                                                      freq_range=tuple(args.freq_range),
+                                                                                      normalize='ref',
+                                                                                      threshold=args.threshold)
+            score1, score2, n_psds_compare = scores1[0], scores2[0], n_psds_compares[0]
+        else:
+            score1, score2, n_psds_ref, n_psds_compare = calculate_from_path(ref_path=args.ref_path,
+                                                                             compare_path=args.compare_path,
+                                                                             k_ref=args.k_ref,
+                                                                             k_compare=args.k_compare,
+                                                                             max_wavs=args.max_wavs,
+                                                                             max_num_psds=args.max_num_psds,
+                                                                             n_basis=args.n_basis,
+                                                                             basis=args.basis,
+                                                                             gmm_kwargs=gmm_kwargs,
+                                                                             cache_dir=args.cache_dir,
+                                                                             cache_max_size=cache_max_size,
+                                                                             freq_range=tuple(args.freq_range),
+                                                                             dtype=args.dtype,
+                                                                             threshold=args.threshold)
         print(
             f'{args.ref_path}\t{args.compare_path}\t'
             f'{args.k_ref}\t{args.k_compare}\t'
@@ -59,6 +156,75 @@ def main(argv=None):
             f'{n_psds_ref}\t{n_psds_compare}'
         )
 
+    elif args.command in ('calculate-many', 'calculate-from-model'):
+        if len(args.k_compares) == 1:
+            k_compares = args.k_compares * len(args.compare_paths)
+        elif len(args.k_compares) == len(args.compare_paths):
+            k_compares = args.k_compares
+        else:
+            parser.error(
+                f'Number of values for --k-compare ({len(args.k_compares)}) must be one, '
+                f'or match number of compare paths ({len(args.compare_paths)})'
+            )
+        if args.command == 'calculate-from-model':
+            model_path, model_name = args.model
+            model_attrs = load_model_attrs(model_path, model_name)
+            ref_path, k_ref, n_basis = model_path, model_attrs['k'], model_attrs['n_basis']
+            scores1, scores2, n_psds_ref, n_psds_compare = calculate_from_model_path(model_path=model_path,
+                                                                                     compare_paths=args.compare_paths,
+                                                                                     k_compares=k_compares,
+                                                                                     name=model_name,
+                                                                                     max_wavs=args.max_wavs,
+                                                                                     max_num_psds=args.max_num_psds,
+                                                                                     cache_dir=args.cache_dir,
+                                                                                     cache_max_size=cache_max_size,
+                                                                                     freq_range=tuple(args.freq_range),
+                                                                                     normalize=args.normalize,
+                                                                                     threshold=args.threshold)
+        else:
+            ref_path, k_ref, n_basis = args.ref_path, args.k_ref, args.n_basis
+            scores1, scores2, n_psds_ref, n_psds_compare = calculate_many_from_path(ref_path=args.ref_path,
+                                                                                    compare_paths=args.compare_paths,
+                                                                                    k_ref=args.k_ref,
+                                                                                    k_compares=k_compares,
+                                                                                    max_wavs=args.max_wavs,
+                                                                                    max_num_psds=args.max_num_psds,
+                                                                                    n_basis=args.n_basis,
+                                                                                    basis=args.basis,
+                                                                                    gmm_kwargs=gmm_kwargs,
+                                                                                    cache_dir=args.cache_dir,
+                                                                                    cache_max_size=cache_max_size,
+                                                                                    freq_range=tuple(args.freq_range),
+                                                                                    dtype=args.dtype,
+                                                                                    threshold=args.threshold,
+                                                                                    normalize=args.normalize)
+        for compare_ind, compare_path in enumerate(args.compare_paths):
+            print(
+                f'{ref_path}\t{compare_path}\t'
+                f'{k_ref}\t{k_compares[compare_ind]}\t'
+                f'{n_basis}\t{scores1[compare_ind]}\t{scores2[compare_ind]}\t'
+                f'{n_psds_ref}\t{n_psds_compare[compare_ind]}'
+            )
+
+    elif args.command == 'calculate-matrix':
+        if len(args.ks) != len(args.paths):
+            parser.error(
+                f'Number of values for --k ({len(args.ks)}) must match number of paths ({len(args.paths)})'
+            )
+        calculate_matrix_from_path(paths=args.paths,
+                                   ks=args.ks,
+                                   output_path=args.output_path,
+                                   max_wavs=args.max_wavs,
+                                   max_num_psds=args.max_num_psds,
+                                   n_basis=args.n_basis,
+                                   basis=args.basis,
+                                   gmm_kwargs=gmm_kwargs,
+                                   cache_dir=args.cache_dir,
+                                   cache_max_size=cache_max_size,
+                                   freq_range=tuple(args.freq_range),
+                                   dtype=args.dtype,
+                                   threshold=args.threshold)
+
     elif args.command == 'numsyls':
         n_syls = numsyls_from_path(ref_path=args.ref_path,
                                    max_wavs=args.max_wavs,
@@ -69,6 +235,16 @@ def main(argv=None):
                                    max_components=args.max_components,
                                    n_splits=args.n_splits,
                                    gmm_kwargs=gmm_kwargs,
+                                   n_jobs=args.jobs,
+                                   backend=args.backend,
+                                   search=args.search,
+                                   patience=args.patience,
+                                   warm_start=args.warm_start,
+                                   cache_dir=args.cache_dir,
+                                   cache_max_size=cache_max_size,
+                                   freq_range=tuple(args.freq_range),
+                                   dtype=args.dtype,
+                                   threshold=args.threshold,
                                    )
         print(
             f'{args.ref_path}\t{n_syls}'
@@ -1,6 +1,31 @@
 import argparse
 
-from .epilogs import PARSER_EPILOG, CALCULATE_EPILOG, NUMSYLS_EPILOG
+from ..constants import DEFAULT_FREQ_RANGE, THRESHOLDS
+from .epilogs import (
+    PARSER_EPILOG, CALCULATE_EPILOG, CALCULATE_MANY_EPILOG, CALCULATE_FROM_MODEL_EPILOG, CALCULATE_MATRIX_EPILOG,
+    NUMSYLS_EPILOG
+)
+
+
+def _threshold(value):
+    """type for --threshold option: either the name of a method, or a number"""
+    try:
+        return float(value)
+    except ValueError:
+        if value not in THRESHOLDS:
+            raise argparse.ArgumentTypeError(
+                f"invalid threshold: '{value}', must be a number or one of: {', '.join(THRESHOLDS)}"
+            )
+        return value
+
+
+def _model_path(value):
+    """type for model-path argument of calculate-from-model: path to a .zarr file,
+    optionally followed by a colon and the name of a model"""
+    zarr_path, sep, name = value.rpartition(':')
+    if sep and zarr_path.endswith('.zarr') and name:
+        return zarr_path, name
+    return value, 'model'
 
 
 def get():
@@ -30,41 +55,177 @@ def get():
                                 )
     prep_subparser.add_argument('--max-wavs', type=int, default=120,
                                 help='Maximum number of .wav files to use per directory. Default  is 120.')
-    prep_subparser.add_argument('--max-num-psds', type=str, default=10000,
+    prep_subparser.add_argument('--max-num-psds', type=int, default=10000,
                                 help=('Maximum number of power spectral densities (PSDs) to use per directory. '
                                       'Default is 10000.')
                                 )
+    prep_subparser.add_argument('--incremental', action='store_true',
+                                help=('Update datasets that were already prepared, instead of preparing them '
+                                      'again from scratch: remove data from .wav files that were deleted or changed, '
+                                      'and only prepare .wav files that are new or changed.')
+                                )
+    prep_subparser.add_argument('--dtype', type=str, choices=('float64', 'float32'), default='float64',
+                                help=('Data type that PSDs are saved as. '
+                                      'Saving as float32 halves the size of the dataset. '
+                                      'Default is float64.')
+                                )
+    prep_subparser.add_argument('--jobs', type=int,
+                                help=('Total number of worker processes to use. If more than one directory '
+                                      'is specified, directories are prepared at the same time, '
+                                      'and workers are split between them. If -1, use all CPUs. '
+                                      'Default is to prepare one directory at a time, '
+                                      'with one worker per CPU.')
+                                )
+    prep_subparser.add_argument('--partition-size', type=int,
+                                help=('Number of .wav files processed by each task. '
+                                      'Default is to let dask choose.')
+                                )
 
     # ---- calculate command ----
     calculate_subparser = subparser.add_parser('calculate',
                                                help='calculate the song divergence between two birds',
                                                epilog=CALCULATE_EPILOG)
-    calculate_subparser.add_argument('ref_path', metavar='ref-path', type=str,
+    calculate_subparser.add_argument('ref_path', metavar='ref-path', type=str, nargs='?',
                                      help=('Path to data from bird that should be used as reference. '
                                            'Either a path to a directory with .wav files of songs, '
                                            'or a path to a .songdkl.zarr file generated by songdkl prep'))
-    calculate_subparser.add_argument('compare_path', metavar='compare-path', type=str,
+    calculate_subparser.add_argument('compare_path', metavar='compare-path', type=str, nargs='?',
                                      help=('Path to data from bird that should be compared with reference.'
                                            'Either a path to a directory with .wav files of songs, '
                                            'or a path to a .songdkl.zarr file generated by songdkl prep'
                                            ))
-    calculate_subparser.add_argument('k_ref', metavar='k-ref', type=int,
+    calculate_subparser.add_argument('k_ref', metavar='k-ref', type=int, nargs='?',
                                      help=('Number of syllable classes in song of bird used as reference.'
                                            'Also the number of components $k_{ref}$ used for Gaussian Mixture '
                                            'Model fit to the reference distances.'))
-    calculate_subparser.add_argument('k_compare', metavar='k-compare', type=int,
+    calculate_subparser.add_argument('k_compare', metavar='k-compare', type=int, nargs='?',
                                      help=('Number of syllable classes in song of bird compared with reference.'
                                            'Also the number of components $k_{compare}$ used for Gaussian Mixture '
                                            'Model fit to the comparison distances.'))
+    calculate_subparser.add_argument('--manifest', type=str,
+                                     help=('Path to a tab-delimited manifest file, where each row specifies '
+                                           'one pair of birds as: ref-path, compare-path, k-ref, k-compare. '
+                                           'Use instead of specifying a single pair with positional arguments.'))
+    calculate_subparser.add_argument('--jobs', type=int, default=1,
+                                     help=('Number of worker processes to use when running the jobs '
+                                           'in a manifest. Default is 1. If greater than 1, '
+                                           'the default --scheduler is synchronous, and it cannot be distributed.'))
+    calculate_subparser.add_argument('--save-ref-model', type=str, metavar='NAME',
+                                     help=('Save the model fit to the reference bird with this name, '
+                                           'in the .songdkl.zarr file specified as ref-path, '
+                                           'so that other birds can be compared with it using '
+                                           '"songdkl calculate-from-model", without fitting it again. '
+                                           'The bird compared with the reference is scored with the saved model, '
+                                           "as with calculate-from-model --normalize ref."))
     calculate_subparser.add_argument('--max-wavs', type=int, default=120,
                                      help='Maximum number of .wav files to use. Default  is 120.')
-    calculate_subparser.add_argument('--max-num-psds', type=str, default=10000,
+    calculate_subparser.add_argument('--max-num-psds', type=int, default=10000,
                                      help='Maximum number of power spectral densities (PSDs) to use. Default is 10000.')
     calculate_subparser.add_argument('--n-basis', type=int, default=50,
                                      help='Number of PSDs to use for the basis set. Default is 50.')
     calculate_subparser.add_argument('--basis', type=str, default='first', choices={'first', 'random'},
                                      help="How to select PSDs for basis set. Either 'first' (default) or 'random'")
 
+    # ---- calculate-many command ----
+    calculate_many_subparser = subparser.add_parser('calculate-many',
+                                                    help=('calculate the song divergence between one reference bird '
+                                                          'and many birds compared with it'),
+                                                    epilog=CALCULATE_MANY_EPILOG)
+    calculate_many_subparser.add_argument('ref_path', metavar='ref-path', type=str,
+                                          help=('Path to data from bird that should be used as reference. '
+                                                'Either a path to a directory with .wav files of songs, '
+                                                'or a path to a .songdkl.zarr file generated by songdkl prep'))
+    calculate_many_subparser.add_argument('compare_paths', metavar='compare-path', type=str, nargs='+',
+                                          help=('Paths to data from birds that should be compared with reference. '
+                                                'Each is either a path to a directory with .wav files of songs, '
+                                                'or a path to a .songdkl.zarr file generated by songdkl prep. '
+                                                'If more than one path, should be a space separated list.'))
+    calculate_many_subparser.add_argument('--k-ref', type=int, required=True,
+                                          help=('Number of syllable classes in song of bird used as reference. '
+                                                'Also the number of components used for Gaussian Mixture '
+                                                'Model fit to the reference distances.'))
+    calculate_many_subparser.add_argument('--k-compare', dest='k_compares', type=int, nargs='+', required=True,
+                                          help=('Number of syllable classes in song of each bird compared with '
+                                                'reference, in the same order as the paths. '
+                                                'If only one value is specified, it is used for all birds.'))
+    calculate_many_subparser.add_argument('--normalize', type=str, default='pair', choices=('pair', 'ref', 'all'),
+                                          help=("Which birds the maximum distance used to normalize distances "
+                                                "is taken across: 'pair' (default), the reference and each bird "
+                                                "compared with it, as 'songdkl calculate' does; 'ref', "
+                                                "only the reference; or 'all', the reference and all birds."))
+    calculate_many_subparser.add_argument('--max-wavs', type=int, default=120,
+                                          help='Maximum number of .wav files to use. Default  is 120.')
+    calculate_many_subparser.add_argument('--max-num-psds', type=int, default=10000,
+                                          help=('Maximum number of power spectral densities (PSDs) to use. '
+                                                'Default is 10000.'))
+    calculate_many_subparser.add_argument('--n-basis', type=int, default=50,
+                                          help='Number of PSDs to use for the basis set. Default is 50.')
+    calculate_many_subparser.add_argument('--basis', type=str, default='first', choices={'first', 'random'},
+                                          help="How to select PSDs for basis set. Either 'first' (default) or 'random'")
+
+    # ---- calculate-from-model command ----
+    calculate_from_model_subparser = subparser.add_parser('calculate-from-model',
+                                                          help=('calculate the song divergence between a reference '
+                                                                'bird whose model was saved and birds compared '
+                                                                'with it, without fitting the model again'),
+                                                          epilog=CALCULATE_FROM_MODEL_EPILOG)
+    calculate_from_model_subparser.add_argument('model', metavar='model-path', type=_model_path,
+                                                help=('Path to a .zarr file with a model of the reference bird, '
+                                                      'saved with "songdkl calculate --save-ref-model", '
+                                                      'optionally followed by a colon and the name of the model, '
+                                                      'e.g. tutor.songdkl.zarr:k9. Default name is "model".'))
+    calculate_from_model_subparser.add_argument('compare_paths', metavar='compare-path', type=str, nargs='+',
+                                                help=('Paths to data from birds that should be compared with '
+                                                      'reference. Each is either a path to a directory with .wav '
+                                                      'files of songs, or a path to a .songdkl.zarr file '
+                                                      'generated by songdkl prep. If more than one path, '
+                                                      'should be a space separated list.'))
+    calculate_from_model_subparser.add_argument('--k-compare', dest='k_compares', type=int, nargs='+',
+                                                required=True,
+                                                help=('Number of syllable classes in song of each bird compared '
+                                                      'with reference, in the same order as the paths. '
+                                                      'If only one value is specified, it is used for all birds.'))
+    calculate_from_model_subparser.add_argument('--normalize', type=str, default='ref',
+                                                choices=('pair', 'ref', 'all'),
+                                                help=("Which birds the maximum distance used to normalize "
+                                                      "distances is taken across: 'ref' (default), only the "
+                                                      "reference, so the saved model is used without fitting it "
+                                                      "again; 'pair', the reference and each bird compared with it; "
+                                                      "or 'all'. With 'pair' or 'all', the model of the reference "
+                                                      "is fit again whenever the maximum changes."))
+    calculate_from_model_subparser.add_argument('--max-wavs', type=int, default=120,
+                                                help='Maximum number of .wav files to use. Default  is 120.')
+    calculate_from_model_subparser.add_argument('--max-num-psds', type=int, default=10000,
+                                                help=('Maximum number of power spectral densities (PSDs) to use. '
+                                                      'Default is 10000.'))
+
+    # ---- calculate-matrix command ----
+    calculate_matrix_subparser = subparser.add_parser('calculate-matrix',
+                                                      help='calculate the song divergence between all pairs of birds',
+                                                      epilog=CALCULATE_MATRIX_EPILOG)
+    calculate_matrix_subparser.add_argument('paths', metavar='path', type=str, nargs='+',
+                                            help=('Paths to data from birds. '
+                                                  'Each is either a path to a directory with .wav files of songs, '
+                                                  'or a path to a .songdkl.zarr file generated by songdkl prep. '
+                                                  'If more than one path, should be a space separated list.'))
+    calculate_matrix_subparser.add_argument('--k', dest='ks', type=int, nargs='+', required=True,
+                                            help=('Number of syllable classes in song of each bird, '
+                                                  'in the same order as the paths. '
+                                                  'Also the number of components used for the Gaussian Mixture '
+                                                  'Model fit to the distances for that bird.'))
+    calculate_matrix_subparser.add_argument('--output-path', type=str, default='songdkl-matrix.zarr',
+                                            help=('Path where matrices should be saved, in a .zarr file. '
+                                                  'Default is "songdkl-matrix.zarr".'))
+    calculate_matrix_subparser.add_argument('--max-wavs', type=int, default=120,
+                                            help='Maximum number of .wav files to use. Default  is 120.')
+    calculate_matrix_subparser.add_argument('--max-num-psds', type=int, default=10000,
+                                            help=('Maximum number of power spectral densities (PSDs) to use. '
+                                                  'Default is 10000.'))
+    calculate_matrix_subparser.add_argument('--n-basis', type=int, default=50,
+                                            help='Number of PSDs to use for the basis set. Default is 50.')
+    calculate_matrix_subparser.add_argument('--basis', type=str, default='first', choices={'first', 'random'},
+                                            help="How to select PSDs for basis set. Either 'first' (default) or 'random'")
+
     # ---- numsyls command ----
     numsyls_subparser = subparser.add_parser('numsyls',
                                              help="estimate the number of syllable types in a song.",
@@ -76,7 +237,7 @@ def get():
                                            'or a path to a .songdkl.zarr file generated by songdkl prep'))
     numsyls_subparser.add_argument('--max-wavs', type=int, default=120,
                                    help='Maximum number of .wav files to use. Default  is 120.')
-    numsyls_subparser.add_argument('--max-num-psds', type=str, default=10000,
+    numsyls_subparser.add_argument('--max-num-psds', type=int, default=10000,
                                    help='Maximum number of power spectral densities (PSDs) to use. Default is 10000.')
     numsyls_subparser.add_argument('--n-basis', type=int, default=50,
                                    help='Number of PSDs to use for the basis set. Default is 50.')
@@ -92,8 +253,79 @@ def get():
                                          "If sufficient data are available,"
                                          "a good rule of thumb is to use 3 splits.")
                                    )
+    numsyls_subparser.add_argument('--jobs', type=int, default=1,
+                                   help=('Number of workers used to fit models in parallel. '
+                                         'Default is 1. If -1, use all CPUs.'))
+    numsyls_subparser.add_argument('--backend', type=str, default='processes', choices={'threads', 'processes'},
+                                   help=("Whether to fit models in parallel on a pool of 'threads' or "
+                                         "'processes' (default)."))
+    numsyls_subparser.add_argument('--search', type=str, default='exhaustive', choices={'exhaustive', 'early-stop'},
+                                   help=("How to search over the number of components. "
+                                         "If 'exhaustive' (default), fit models with every number of components. "
+                                         "If 'early-stop', stop once the BIC has risen for --patience "
+                                         "consecutive numbers of components."))
+    numsyls_subparser.add_argument('--patience', type=int, default=3,
+                                   help=("Number of consecutive numbers of components for which the BIC "
+                                         "must rise before stopping, when --search is 'early-stop'. Default is 3."))
+    numsyls_subparser.add_argument('--warm-start', action='store_true',
+                                   help=("Initialize each model from the model with one fewer component, "
+                                         "by splitting the component that accounts for the most variance, "
+                                         "instead of from scratch. Requires fewer iterations to fit models."))
+
+    for subparser in (prep_subparser, calculate_subparser, calculate_many_subparser,
+                      calculate_from_model_subparser, calculate_matrix_subparser, numsyls_subparser):
+        subparser.add_argument('--freq-range', type=float, nargs=2, default=DEFAULT_FREQ_RANGE,
+                               metavar=('LOW', 'HIGH'),
+                               help=('Lowest and highest frequency in Hz of the power spectral densities (PSDs) '
+                                     'computed from syllables. Only frequencies in this range are computed. '
+                                     f'Default is {DEFAULT_FREQ_RANGE[0]} {DEFAULT_FREQ_RANGE[1]}.'))
+
+    for subparser in (prep_subparser, calculate_subparser, calculate_many_subparser,
+                      calculate_from_model_subparser, calculate_matrix_subparser, numsyls_subparser):
+        subparser.add_argument('--threshold', type=_threshold, default='half-otsu',
+                               help=('Method used to find the threshold that segments syllables from .wav files, '
+                                     'or a number to use as the threshold for all files. '
+                                     "'half-otsu' and 'half-average' find a threshold for each file; "
+                                     "'pooled-half-otsu' and 'pooled-half-average' find one threshold "
+                                     "for all the files from a bird. Default is 'half-otsu'."))
+
+    for subparser in (prep_subparser, calculate_subparser, calculate_many_subparser,
+                      calculate_from_model_subparser, calculate_matrix_subparser, numsyls_subparser):
+        subparser.add_argument('--scheduler', type=str,
+                               choices=('threads', 'processes', 'synchronous', 'distributed'),
+                               help=('Scheduler used by dask to segment .wav files and compute PSDs. '
+                                     "'distributed' starts a local cluster, and requires the distributed package. "
+                                     'Default is processes.'))
+
+    for subparser in (calculate_subparser, calculate_many_subparser, calculate_from_model_subparser,
+                      calculate_matrix_subparser, numsyls_subparser):
+        subparser.add_argument('--n-workers', type=int,
+                               help=('Number of workers used by dask to segment .wav files and compute PSDs, '
+                                     'when preparing datasets from directories. If -1, use all CPUs. '
+                                     'Default is one worker per CPU.'))
+
+    for subparser in (calculate_subparser, calculate_many_subparser, calculate_from_model_subparser,
+                      calculate_matrix_subparser, numsyls_subparser):
+        # add args for cache of PSDs prepared from .wav files
+        subparser.add_argument('--cache-dir', type=str,
+                               help=('Directory where PSDs prepared from .wav files are cached, '
+                                     'so that preparing the same .wav files again loads them from the cache. '
+                                     'If not specified, the environment variable SONGDKL_CACHE_DIR is used. '
+                                     'If that is not set, no cache is used.'))
+        subparser.add_argument('--cache-max-size', type=float,
+                               help=('Maximum size of the cache in gigabytes. Least recently used PSDs '
+                                     'are removed when the cache is larger than this. Default is 20.'))
+
+    for subparser in (calculate_subparser, calculate_many_subparser, calculate_matrix_subparser,
+                      numsyls_subparser):
+        # calculate-from-model uses the dtype and GaussianMixture kwargs saved with the model
+        subparser.add_argument('--dtype', type=str, choices=('float64', 'float32'), default='float64',
+                               help=('Data type of PSDs, distances and similarities. '
+                                     'Using float32 halves the memory used, but results can differ slightly '
+                                     'from those computed with float64. Default is float64.'))
 
-    for subparser in (calculate_subparser, numsyls_subparser):
+    for subparser in (calculate_subparser, calculate_many_subparser, calculate_matrix_subparser,
+                      numsyls_subparser):
         # add args for GaussianMixture that both subparsers use
         subparser.add_argument('--max-iter', type=int, default=100000,
                                help=('The number of EM iterations to perform when fitting GaussianMixture. '
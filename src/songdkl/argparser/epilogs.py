@@ -15,6 +15,24 @@ e.g.
 
 y25 y32br6 9 10 50 0.039854682578 0.0340690226514 3000 3000
 
+To run many pairs in parallel, specify them in a tab-delimited manifest file instead,
+with one row per pair: ref-path, compare-path, k-ref, k-compare.
+
+$ songdkl calculate --manifest pairs.tsv --jobs 16
+
+The longest jobs are run first, and one line of output is printed as each job finishes.
+
+To compare other birds with the reference without fitting its model again,
+save the model in the reference .songdkl.zarr file, then use the saved model
+with "songdkl calculate-from-model":
+
+$ songdkl calculate ~/data/bird_data/y25/y25.songdkl.zarr ~/data/bird_data/y34br6/ 9 10 --save-ref-model k9
+
+When the model is saved, the bird compared with the reference is scored with it,
+normalizing distances by the maximum distance of the reference only,
+as "songdkl calculate-from-model" does by default,
+so values can differ slightly from those computed without --save-ref-model.
+
 Notes
 -----
 Throughout the paper we calculated PSDs for the raw wave forms of syllables. 
@@ -35,6 +53,71 @@ Empirically, changing these numbers doesn't have much impact on the divergence c
 (see the paper)
 """
 
+CALCULATE_MATRIX_EPILOG = """
+Example
+-------
+$ songdkl calculate-matrix ~/data/bird_data/y25/ ~/data/bird_data/y34br6/ ~/data/bird_data/y41/ --k 9 10 8
+
+Each bird's data is loaded or prepared only once, and for each bird used as the reference,
+a Gaussian Mixture Model is fit only once to the data from each bird.
+
+The output is a .zarr file with two arrays, "DKL_PQ" and "DKL_QP",
+where element [i, j] is the song divergence with bird i used as the reference
+and bird j compared with the reference. The paths and number of syllables
+for each bird are saved as attributes of the .zarr file.
+
+Notes
+-----
+Distances are normalized by the maximum distance to the basis set across all birds,
+so values can differ slightly from those computed by "songdkl calculate".
+"""
+
+CALCULATE_MANY_EPILOG = """
+Example
+-------
+$ songdkl calculate-many ~/data/bird_data/tutor/ ~/data/bird_data/pupil1/ ~/data/bird_data/pupil2/ --k-ref 9 --k-compare 9
+
+The data from the reference bird is loaded or prepared only once,
+distances from the reference to the basis set are computed only once,
+and the Gaussian Mixture Model for the reference is only fit again
+when the normalization changes, so this is faster than running
+"songdkl calculate" once for each bird compared with the reference.
+
+The output is one line for each bird compared with the reference,
+in the same tab delimited format as "songdkl calculate".
+
+Notes
+-----
+Distances are converted to similarities by normalizing with the maximum distance to the basis set.
+The --normalize option controls which birds that maximum is taken across:
+'pair' (default) uses the reference and the bird compared with it,
+giving the same values as "songdkl calculate";
+'ref' uses only the reference, so the model for the reference is fit once
+and the value for each bird does not depend on which other birds are compared;
+'all' uses the reference and all birds compared with it, as "songdkl calculate-matrix" does.
+"""
+
+CALCULATE_FROM_MODEL_EPILOG = """
+Example
+-------
+$ songdkl calculate ~/data/bird_data/tutor/tutor.songdkl.zarr ~/data/bird_data/pupil1/ 9 9 --save-ref-model k9
+$ songdkl calculate-from-model ~/data/bird_data/tutor/tutor.songdkl.zarr:k9 ~/data/bird_data/pupil2/ --k-compare 9
+
+The model of the reference saved by "songdkl calculate --save-ref-model" is loaded,
+with its basis set and the distances from the reference to it,
+so the data from the reference is not needed and its model is not fit again.
+A model is still fit to the data from each bird compared with the reference.
+
+The output is one line for each bird compared with the reference,
+in the same tab delimited format as "songdkl calculate".
+
+Notes
+-----
+The default, --normalize ref, normalizes distances by the maximum distance
+from the reference to the basis set, that the saved model was fit with.
+With 'pair' or 'all', the maximum can change, and then the model of the reference is fit again.
+"""
+
 NUMSYLS_EPILOG = """
 fits a series of gaussian mixture models with an 
 increasing number of mixtures, and identifies the best number 
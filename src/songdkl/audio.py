@@ -1,4 +1,5 @@
 from __future__ import annotations
+import functools
 import pathlib
 
 import numpy as np
@@ -9,13 +10,21 @@ from scipy import ndimage
 from skimage.filters import threshold_otsu
 
 
-def load_wav(wav_path: str | pathlib.Path) -> tuple[int, np.array]:
+def load_wav(wav_path: str | pathlib.Path, mmap: bool = False) -> tuple[int, np.array]:
     """Load .wav file from path.
 
     Parameters
     ----------
     wav_path : str, pathlib.Path
         Path to a .wav file.
+    mmap : bool
+        If True, memory-map the data instead of reading it into memory.
+        The data is then a read-only view of the samples in the file,
+        e.g. 16-bit integers, that are only read from disk when accessed,
+        and the pages read are shared by all processes
+        that memory-map the same file.
+        Not supported for 24-bit .wav files.
+        Default is False.
 
     Returns
     -------
@@ -23,15 +32,82 @@ def load_wav(wav_path: str | pathlib.Path) -> tuple[int, np.array]:
         Sampling rate in Hz.
     data : np.ndarray
         Data from .wav file.
+        A ``numpy.memmap`` if ``mmap`` is True.
     """
-    return wavfile.read(wav_path)
+    return wavfile.read(wav_path, mmap=mmap)
 
 
-def filtersong(audio_arr: np.ndarray) -> np.ndarray:
+# default cutoff of the highpass filter applied by ``filtersong``, as a fraction of the Nyquist frequency,
+# i.e. 640 Hz for audio sampled at 32 kHz
+HIGHPASS_CUTOFF_NYQUIST = 0.04
+
+
+@functools.lru_cache(maxsize=32)
+def highpass_sos(cutoff: float, rate: float) -> np.ndarray:
+    """Design the elliptic highpass filter used by ``filtersong``,
+    as second-order sections.
+
+    The filter has its passband edge at ``cutoff`` and its stopband edge
+    at ``cutoff / 2``, with at most 1 dB of ripple in the passband,
+    and at least 60 dB of attenuation in the stopband.
+    The design only depends on its arguments, so it is cached,
+    and is only computed once for each cutoff and sampling rate.
+
+    Parameters
+    ----------
+    cutoff : float
+        Passband edge of the filter, in Hz.
+    rate : float
+        Sampling rate, in Hz.
+
+    Returns
+    -------
+    sos : numpy.ndarray
+        Second-order sections of the filter, with shape (n_sections, 6),
+        as returned by ``scipy.signal.iirdesign``.
+        The same array is returned by every call with the same arguments,
+        so it should not be modified.
+    """
+    if not 0 < cutoff < rate / 2:
+        raise ValueError(
+            f'`cutoff` must be greater than zero and less than the Nyquist frequency, {rate / 2}, '
+            f'but was: {cutoff}'
+        )
+    return scipy.signal.iirdesign(wp=cutoff, ws=cutoff / 2, gpass=1, gstop=60, ftype='ellip', output='sos', fs=rate)
+
+
+def filtersong(audio_arr: np.ndarray,
+               rate: int | float | None = None,
+               cutoff: float | None = None) -> np.ndarray:
     """Apply highpass iir filter to ``audio_arr`` to remove low-frequency noise.
+
+    The filter is an elliptic filter designed by ``highpass_sos``,
+    applied forward and backward with ``scipy.signal.sosfiltfilt``
+    so there is no phase shift.
+
+    Parameters
+    ----------
+    audio_arr : np.ndarray
+        Audio data.
+    rate : int, float
+        Sampling rate, in Hz. Default is None, in which case
+        ``cutoff`` is a fraction of the Nyquist frequency.
+    cutoff : float
+        Cutoff of the filter in Hz, the edge of its passband.
+        Default is None, in which case it is 0.04 times the Nyquist frequency,
+        i.e. 640 Hz for audio sampled at 32 kHz.
+
+    Returns
+    -------
+    filtered : np.ndarray
+        Filtered audio.
     """
-    b, a = scipy.signal.iirdesign(wp=0.04, ws=0.02, gpass=1, gstop=60, ftype='ellip')
-    return scipy.signal.filtfilt(b, a, audio_arr)
+    if rate is None:
+        # normalized frequencies, where the Nyquist frequency is 1
+        rate = 2.
+    if cutoff is None:
+        cutoff = HIGHPASS_CUTOFF_NYQUIST * rate / 2
+    return scipy.signal.sosfiltfilt(highpass_sos(float(cutoff), float(rate)), audio_arr)
 
 
 def smoothrect(audio_arr: np.ndarray,
@@ -55,10 +131,25 @@ def smoothrect(audio_arr: np.ndarray,
         Smoothed rectified audio.
     """
     le = int(round(rate * window / 1000))  # calculate boxcar kernel length
-    h = np.ones(le) / le  # make boxcar
-    smooth = np.convolve(h, abs(audio_arr))  # convolve boxcar with signal
-    offset = int(round((len(smooth) - len(audio_arr)) / 2))  # calculate offset imposed by convolution
-    smooth = smooth[(1 + offset):(len(audio_arr) + offset)]  # correct for offset
+    n = len(audio_arr)
+    # Gives the same result as convolving a boxcar of length ``le`` with the rectified signal,
+    # then removing the offset imposed by convolution, i.e. ``np.convolve(np.ones(le) / le, abs(audio_arr))``
+    # sliced with ``[1 + offset:n + offset]``, but in linear time, by taking differences of a cumulative sum:
+    # sample ``k`` of the full convolution is ``(csum[min(k + 1, n)] - csum[max(k + 1 - le, 0)]) / le``
+    offset = int(round((le - 1) / 2))  # offset imposed by convolution
+    csum = np.empty(n + 1)
+    csum[0] = 0.
+    np.abs(audio_arr, out=csum[1:])
+    np.cumsum(csum[1:], out=csum[1:])
+    smooth = np.empty(max(n - 1, 0))
+    # end of each window, until it runs past the end of the signal
+    n_in = max(0, min(n - 1, n - 2 - offset))
+    smooth[:n_in] = csum[2 + offset:2 + offset + n_in]
+    smooth[n_in:] = csum[n]
+    # start of each window, once it is past the start of the signal
+    start = min(max(le - 2 - offset, 0), n - 1) if n > 0 else 0
+    smooth[start:] -= csum[start + 2 + offset - le:n + 1 + offset - le]
+    smooth /= le
     return smooth
 
 
@@ -69,19 +160,166 @@ def apply_threshold(audio_arr: np.ndarray, thresh: int | float | None = None) ->
     By default, threshold is sigma."""
     if thresh is None:
         thresh = audio_arr.std()
-    return np.where(abs(audio_arr) > thresh, audio_arr, np.zeros(audio_arr.shape))
+    return np.where(np.abs(audio_arr) > thresh, audio_arr, np.float64(0.))
+
+
+def pad_mask(mask: np.ndarray, size: int = 512) -> np.ndarray:
+    """Widen the segments of a boolean mask,
+    so that each sample is True if any sample
+    in a window of ``size`` samples around it is True.
+
+    Gives the same result as convolving the mask with ``np.ones(size)``
+    using ``scipy.ndimage.convolve``, and thresholding at 0.5,
+    but in linear time, with a running maximum.
+
+    Parameters
+    ----------
+    mask : numpy.ndarray
+        Boolean mask, e.g. of samples where the amplitude envelope
+        is above a threshold.
+    size : int
+        Size of window. Default is 512.
+
+    Returns
+    -------
+    padded : numpy.ndarray
+        Boolean mask, same shape as ``mask``.
+    """
+    # origin makes the window the same as the one used by ``ndimage.convolve`` for a kernel of this size
+    return ndimage.maximum_filter1d(mask, size, origin=-1 if size % 2 == 0 else 0)
+
+
+def find_segments(mask: np.ndarray, min_length: int | float = 0) -> tuple[np.ndarray, np.ndarray]:
+    """Find the onsets and offsets of segments
+    where a boolean mask is True.
+
+    Segments are found from the edges of the mask, where it changes value,
+    so no array of labels is made as with ``scipy.ndimage.label``.
+
+    Parameters
+    ----------
+    mask : numpy.ndarray
+        One-dimensional boolean mask, e.g. of samples where
+        the amplitude envelope is above a threshold.
+    min_length : int, float
+        Only segments with more than this many samples are returned.
+        Default is 0, in which case all segments are returned.
+
+    Returns
+    -------
+    onsets : numpy.ndarray
+        Index of the first sample of each segment.
+    offsets : numpy.ndarray
+        Index after the last sample of each segment,
+        so that ``mask[onset:offset]`` is a segment.
+    """
+    mask = np.asarray(mask, dtype=bool)
+    if mask.size == 0:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+    edges = np.flatnonzero(mask[1:] != mask[:-1]) + 1
+    if mask[0]:
+        edges = np.concatenate(([0], edges))
+    if mask[-1]:
+        edges = np.concatenate((edges, [mask.size]))
+    onsets, offsets = edges[0::2], edges[1::2]
+    if min_length:
+        keep = offsets - onsets > min_length
+        onsets, offsets = onsets[keep], offsets[keep]
+    return onsets, offsets
+
+
+class SegmentDetector:
+    """Find segments where a boolean mask is True,
+    when the mask is computed one chunk at a time,
+    e.g. from a recording that is too long to segment at once.
+
+    Segments that cross the boundaries between chunks are joined,
+    and each segment is returned from ``update`` once the chunk
+    where it ends is passed in, or from ``close`` if it
+    continues to the end of the mask.
+    Onsets and offsets are indices into the whole mask,
+    i.e., all of the chunks concatenated.
+
+    Attributes
+    ----------
+    min_length : int, float
+        Only segments with more than this many samples are returned.
+    n_samples : int
+        Number of samples of the mask that have been passed in so far.
+    """
+    def __init__(self, min_length: int | float = 0):
+        self.min_length = min_length
+        self.n_samples = 0
+        # onset of segment that was still True at the end of the last chunk
+        self._onset = None
+
+    def _filter(self, onsets: np.ndarray, offsets: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        if self.min_length:
+            keep = offsets - onsets > self.min_length
+            onsets, offsets = onsets[keep], offsets[keep]
+        return onsets, offsets
+
+    def update(self, mask: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Find segments in the next chunk of the mask.
+
+        Parameters
+        ----------
+        mask : numpy.ndarray
+            Next chunk of a one-dimensional boolean mask.
+
+        Returns
+        -------
+        onsets : numpy.ndarray
+            Index of the first sample of each segment that ended in this chunk.
+        offsets : numpy.ndarray
+            Index after the last sample of each segment that ended in this chunk.
+        """
+        mask = np.asarray(mask, dtype=bool)
+        if mask.size == 0:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+        onsets, offsets = find_segments(mask)
+        onsets += self.n_samples
+        offsets += self.n_samples
+        if self._onset is not None:
+            if mask[0]:
+                # first segment in this chunk continues the one from the last chunk
+                onsets[0] = self._onset
+            else:
+                onsets = np.concatenate(([self._onset], onsets))
+                offsets = np.concatenate(([self.n_samples], offsets))
+            self._onset = None
+        if mask[-1]:
+            # last segment may continue in the next chunk
+            self._onset = onsets[-1]
+            onsets, offsets = onsets[:-1], offsets[:-1]
+        self.n_samples += mask.size
+        return self._filter(onsets, offsets)
+
+    def close(self) -> tuple[np.ndarray, np.ndarray]:
+        """Return the segment that continues to the end of the mask, if any.
+
+        Returns
+        -------
+        onsets : numpy.ndarray
+        offsets : numpy.ndarray
+        """
+        if self._onset is None:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+        onsets, offsets = np.array([self._onset]), np.array([self.n_samples])
+        self._onset = None
+        return self._filter(onsets, offsets)
 
 
 def segment_audio(audio_arr: np.ndarray) -> list[slice]:
-    """Segment audio into clips containing syllables,
-    using ``scipy.ndimage.find_objects``.
+    """Segment audio into clips containing syllables.
     Expects ``audio_arr`` to have zero elements, e.g.,
-    because ``apply_threshold`` has been applied to it.
+    because ``apply_threshold`` has been applied to it,
+    or to be a boolean mask.
 
     Continuous non-zero segments in ``audio_arr``
-    are applied labels with ``scipy.ndimage.label``,
-    and the indices of these segments are returned,
-    as produced by ``scipy.ndimage.find_objects``.
+    are found with ``find_segments``, and the indices of these segments
+    are returned, the same as those produced by
+    ``scipy.ndimage.label`` and ``scipy.ndimage.find_objects``.
 
     Parameters
     ----------
@@ -92,16 +330,135 @@ def segment_audio(audio_arr: np.ndarray) -> list[slice]:
     Returns
     -------
     slices : list
-        Of slices; the segments identified by
-        ``scipy.ndimage.find_objects``.
+        Of slices; the segments identified.
+    """
+    audio_arr = np.asarray(audio_arr)
+    mask = audio_arr if audio_arr.dtype == bool else audio_arr != 0
+    onsets, offsets = find_segments(mask)
+    return [slice(int(onset), int(offset), None) for onset, offset in zip(onsets, offsets)]
+
+
+# number of samples that segments are padded by, in ``_threshold_and_pad``
+PAD_SIZE = 512
+
+
+def _threshold_and_pad(envelope: np.ndarray, threshold_val: float | int) -> np.ndarray:
+    """Helper function that thresholds an amplitude envelope,
+    and pads the segments above the threshold by ``PAD_SIZE`` samples,
+    returning a boolean mask"""
+    if threshold_val >= 0.5:
+        # The envelope is non-negative, so every value above the threshold is also above 0.5,
+        # and padding the thresholded envelope by convolving with a window of ones, then thresholding at 0.5,
+        # is the same as padding the mask of samples above the threshold.
+        # Use boolean masks, to avoid making temporary copies of the envelope
+        return pad_mask(envelope > threshold_val, PAD_SIZE)
+    else:
+        # Values above the threshold can be less than 0.5, e.g. for floating point audio,
+        # so we need the sum of the thresholded envelope in each window.
+        # Gives the same result as ``ndimage.convolve(thresholded, np.ones(PAD_SIZE)) > 0.5``,
+        # but in linear time, with a running sum over the same window, computed in place
+        thresholded = np.where(envelope > threshold_val, envelope, 0.)
+        ndimage.uniform_filter1d(thresholded, PAD_SIZE, output=thresholded,
+                                 origin=-1 if PAD_SIZE % 2 == 0 else 0)
+        # ``uniform_filter1d`` returns the mean of each window, not the sum
+        return thresholded > 0.5 / PAD_SIZE
+
+
+def _segment_syllables(audio_arr: np.ndarray,
+                       rate: int,
+                       min_syl_dur=10,
+                       threshold: str | float | int = 'half-otsu',
+                       ) -> tuple[list[slice], float | int, np.ndarray]:
+    """Helper function that segments syllables out of audio,
+    returning slices, threshold value, and the filtered audio"""
+    if isinstance(threshold, str):
+        if threshold not in {'half-otsu', 'half-average'}:
+            raise ValueError(
+                "If 'threshold` is a string, it must be one of {'half-otsu', 'half-average'},"
+                f"but was: {threshold}"
+
+            )
+
+    audio_filtered = filtersong(audio_arr, rate)
+    audio_smoothrect = smoothrect(audio_filtered, 10, rate)
+
+    if threshold == 'half-otsu':
+        # Dividing by two here is heuristic.
+        # Value returned by Otsu would be too high otherwise.
+        threshold_val = threshold_otsu(audio_smoothrect) / 2
+    elif threshold == 'half-average':
+        # dividing by two here is heuristic, as is just taking the average
+        threshold_val = np.average(audio_smoothrect) / 2
+    elif isinstance(threshold, float) or isinstance(threshold, int):
+        threshold_val = threshold
+    else:
+        raise ValueError(
+            "'thresh` must be {'half-otsu', 'half-average'} or a float or int value,"
+            f"but was: {threshold}"
+        )
+
+    audio_thresholded = _threshold_and_pad(audio_smoothrect, threshold_val)
+
+    # get objects of sufficient duration
+    frqs = rate / 1000  # calculate length of a ms in samples
+    onsets, offsets = find_segments(audio_thresholded, min_length=min_syl_dur * frqs)
+    slices = [slice(int(onset), int(offset), None) for onset, offset in zip(onsets, offsets)]
+    return slices, threshold_val, audio_filtered
+
+
+def get_syllable_slices_from_audio(audio_arr: np.ndarray,
+                                   rate: int,
+                                   min_syl_dur=10,
+                                   threshold: str | float | int = 'half-otsu',
+                                   block_size: int | None = None,
+                                   ) -> tuple[list[slice], float | int]:
+    """Return slices that segment syllables out of an array of audio,
+    without copying out the audio of each syllable.
+
+    Gives the same slices and threshold as ``get_syllable_clips_from_audio``.
+    Use the slices to index ``audio_arr`` to get views of the syllables.
+
+    If ``block_size`` is specified, audio with more samples than that
+    is segmented one block at a time, as by ``iter_syllable_slices_from_wav``,
+    so that only one block of the audio is converted to float at once.
+    Use this with audio memory-mapped by ``load_wav(wav_path, mmap=True)``
+    to segment a file without ever loading the whole file into memory.
+    Note this costs more time: the audio is filtered and its envelope computed
+    three times for 'half-otsu', twice to find the threshold (see ``threshold_from_wav``)
+    and once to segment, or twice for 'half-average', instead of once.
+
+    Parameters
+    ----------
+    audio_arr : np.ndarray
+        Audio data.
+    rate : int
+        Sampling rate, in Hz.
+    min_syl_dur : int
+        Minimum syllable duration, in milliseconds.
+    threshold : str, float, int
+        Thresholding method. See ``get_syllable_clips_from_audio``.
+        Default is 'half-otsu'.
+    block_size : int
+        Maximum number of samples to process at once.
+        Default is None, in which case all the audio is processed at once.
+
+    Returns
+    -------
+    slices : list
+        Of slices.
+    threshold_val : float or int
+        Threshold value obtained
+        using the method specified by
+        ``threshold`` argument.
     """
-    label, _ = ndimage.label(audio_arr)  # label objects in the threshold
-    objs = ndimage.find_objects(label)  # recover object positions
-    # find_objects returns a list of tuples with eacht uple containing N slices,
-    # N being the dimension of the input array.
-    # We assume audio is one dimensional so we just take the slices from the length-1 tuples
-    slices = [slice_tup[0] for slice_tup in objs]
-    return slices
+    if block_size is not None:
+        _validate_block_size(block_size)
+        if len(audio_arr) > block_size:
+            threshold_val = _threshold_from_blocks(audio_arr, rate, threshold, block_size)
+            slices = list(_iter_syllable_slices(audio_arr, rate, min_syl_dur, threshold_val, block_size))
+            return slices, threshold_val
+    slices, threshold_val, _ = _segment_syllables(audio_arr, rate, min_syl_dur, threshold)
+    return slices, threshold_val
 
 
 def get_syllable_clips_from_audio(audio_arr: np.ndarray,
@@ -147,47 +504,529 @@ def get_syllable_clips_from_audio(audio_arr: np.ndarray,
         using the method specified by
         ``threshold`` argument.
     """
-    if isinstance(threshold, str):
-        if threshold not in {'half-otsu', 'half-average'}:
+    slices, threshold_val, audio_filtered = _segment_syllables(audio_arr, rate, min_syl_dur, threshold)
+
+    if syls_filtered:
+        syllable_clips = [x for x in [audio_filtered[slice_] for slice_ in slices]]
+    else:
+        syllable_clips = [x for x in [audio_arr[slice_] for slice_ in slices]]
+
+    return syllable_clips, slices, threshold_val
+
+
+# default number of samples in each block of audio segmented by ``iter_syllable_slices_from_wav``,
+# about 33 seconds of audio sampled at 32 kHz
+SEGMENT_BLOCK_SIZE = 2 ** 20
+# files with more samples than this are segmented one block at a time when computing PSDs,
+# see ``songdkl.syllables``; about 17 minutes of audio sampled at 32 kHz, that uses about 1 GB of memory
+# when segmented all at once. Segmenting in blocks bounds memory, but filters the audio
+# three times for 'half-otsu' (twice to find the threshold, once to segment), instead of once
+SEGMENT_BLOCKED_MIN_SAMPLES = 2 ** 25
+# number of samples read on either side of each block, and filtered with it.
+# The impulse response of the highpass filter decays to less than 1e-15 of its peak within about 3400 samples,
+# so the filtered block is the same as the corresponding samples of the whole filtered file, to within rounding error
+FILTER_MARGIN = 2 ** 13
+
+
+def _iter_envelope_blocks(data: np.ndarray,
+                          rate: int,
+                          block_size: int = SEGMENT_BLOCK_SIZE,
+                          margin: int = 0,
+                          block_inds: list[int] | None = None,
+                          ):
+    """Helper function that computes the amplitude envelope of audio one block at a time,
+    the same as ``smoothrect(filtersong(data, rate), 10, rate)`` would.
+
+    Yields tuples ``(start, stop, margin_start, envelope)``, where ``start`` and ``stop``
+    are the indices of the block in the whole envelope, and ``envelope`` is the envelope
+    from ``margin_start`` up to ``margin`` samples after ``stop``,
+    i.e., it includes ``margin`` samples on either side of the block, where there are any.
+    Only the audio needed to compute each block is converted to float and filtered,
+    so ``data`` can be a memory-mapped array."""
+    n_envelope = max(len(data) - 1, 0)
+    n_blocks = -(-n_envelope // block_size)
+    le = int(round(rate * 10 / 1000))  # length of boxcar used by ``smoothrect``
+    offset = int(round((le - 1) / 2))
+    if block_inds is None:
+        block_inds = range(n_blocks)
+    for block_ind in block_inds:
+        start = block_ind * block_size
+        stop = min(start + block_size, n_envelope)
+        envelope_start, envelope_stop = max(start - margin, 0), min(stop + margin, n_envelope)
+        # samples of the filtered audio in the boxcars that are summed to compute this part of the envelope
+        filtered_start = max(envelope_start + min(2 + offset - le, 0), 0)
+        filtered_stop = min(envelope_stop + 2 + offset, len(data))
+        data_start, data_stop = max(filtered_start - FILTER_MARGIN, 0), min(filtered_stop + FILTER_MARGIN, len(data))
+        filtered = filtersong(data[data_start:data_stop], rate)[
+            filtered_start - data_start:filtered_stop - data_start
+        ]
+        envelope = smoothrect(filtered, 10, rate)[envelope_start - filtered_start:envelope_stop - filtered_start]
+        yield start, stop, envelope_start, envelope
+
+
+def _validate_block_size(block_size: int) -> None:
+    if not isinstance(block_size, (int, np.integer)) or block_size < 1:
+        raise ValueError(
+            f'`block_size` must be a positive integer but was: {block_size}'
+        )
+
+
+# default number of bins in an ``EnvelopeHistogram``
+ENVELOPE_HIST_N_BINS = 2 ** 14
+
+
+def envelope_max(dtype: np.dtype | str) -> float:
+    """Upper edge of the bins of an ``EnvelopeHistogram``
+    of the amplitude envelope of audio with data type ``dtype``.
+
+    This is twice the full scale of the data type, e.g. 65536 for 16-bit integers,
+    or 2.0 for floating point audio in the range [-1.0, 1.0],
+    to leave room for the highpass filter to overshoot the full scale.
+
+    Parameters
+    ----------
+    dtype : numpy.dtype, str
+        Data type of the audio, e.g. as read by ``load_wav``.
+
+    Returns
+    -------
+    max_value : float
+    """
+    dtype = np.dtype(dtype)
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        return 2. * max(-int(info.min), int(info.max) + 1)
+    return 2.
+
+
+class EnvelopeHistogram:
+    """Histogram of the amplitude envelope of audio,
+    with fixed bins, that is accumulated one chunk at a time,
+    and used to compute the threshold that segments syllables.
+
+    Because the bins are fixed, the histogram can be updated
+    with each block of a long recording, with each file
+    recorded from one bird, or merged with histograms computed
+    by other workers, in linear time and with constant memory,
+    and then one threshold computed from all of them.
+    Values are binned with ``numpy.histogram``, the same as
+    ``skimage.filters.threshold_otsu`` does,
+    so with 256 bins from the smallest to the largest value of an envelope,
+    the threshold for ``threshold='half-otsu'`` is the same as
+    the one found by ``threshold_otsu`` for the whole envelope.
+    With the default bins, from 0 to ``envelope_max``, it is within one bin of that value.
+    The threshold for ``threshold='half-average'`` is exact.
+
+    Attributes
+    ----------
+    max_value : float
+        Upper edge of the last bin.
+        Values of the envelope above this value
+        are counted in the last bin. See ``envelope_max``.
+    n_bins : int
+        Number of bins, of equal width, from ``min_value`` to ``max_value``.
+    min_value : float
+        Lower edge of the first bin.
+        Values of the envelope below this value
+        are counted in the first bin. Default is 0.
+    counts : numpy.ndarray
+        Number of values in each bin.
+    total : float
+        Sum of all values.
+    n_values : int
+        Number of values.
+    min_seen : float
+        Smallest value.
+    max_seen : float
+        Largest value.
+    """
+    def __init__(self, max_value: float, n_bins: int = ENVELOPE_HIST_N_BINS, min_value: float = 0.):
+        if not max_value > min_value:
             raise ValueError(
-                "If 'threshold` is a string, it must be one of {'half-otsu', 'half-average'},"
-                f"but was: {threshold}"
+                f'`max_value` must be greater than `min_value` ({min_value}) but was: {max_value}'
+            )
+        if not isinstance(n_bins, (int, np.integer)) or n_bins < 2:
+            raise ValueError(
+                f'`n_bins` must be an integer greater than 1 but was: {n_bins}'
+            )
+        self.max_value = float(max_value)
+        self.n_bins = int(n_bins)
+        self.min_value = float(min_value)
+        self.counts = np.zeros(self.n_bins, dtype=np.int64)
+        self.total = 0.
+        self.n_values = 0
+        self.min_seen = np.inf
+        self.max_seen = -np.inf
+
+    @property
+    def bin_centers(self) -> np.ndarray:
+        """Center of each bin, computed as ``threshold_otsu`` computes them."""
+        bin_edges = np.linspace(self.min_value, self.max_value, self.n_bins + 1)
+        return (bin_edges[:-1] + bin_edges[1:]) / 2
+
+    def update(self, envelope: np.ndarray) -> None:
+        """Add the values in the next chunk of an amplitude envelope to the histogram.
+
+        Parameters
+        ----------
+        envelope : numpy.ndarray
+            Chunk of the amplitude envelope, e.g. as computed by ``smoothrect``.
+        """
+        envelope = np.asarray(envelope).ravel()
+        if envelope.size == 0:
+            return
+        # bins of equal width given by ``range`` are found in linear time, without sorting
+        self.counts += np.histogram(envelope, bins=self.n_bins, range=(self.min_value, self.max_value))[0]
+        # ``numpy.histogram`` ignores values outside the range, so count them in the first and last bins
+        self.counts[0] += np.count_nonzero(envelope < self.min_value)
+        self.counts[-1] += np.count_nonzero(envelope > self.max_value)
+        self.total += float(envelope.sum())
+        self.n_values += envelope.size
+        self.min_seen = min(self.min_seen, float(envelope.min()))
+        self.max_seen = max(self.max_seen, float(envelope.max()))
+
+    def merge(self, other: EnvelopeHistogram) -> None:
+        """Add the counts from another histogram with the same bins to this one.
 
+        Parameters
+        ----------
+        other : EnvelopeHistogram
+        """
+        if (other.n_bins, other.min_value, other.max_value) != (self.n_bins, self.min_value, self.max_value):
+            raise ValueError(
+                f'Cannot merge histograms with different bins: '
+                f'{self.n_bins} bins from {self.min_value} to {self.max_value}, '
+                f'and {other.n_bins} bins from {other.min_value} to {other.max_value}'
             )
+        self.counts += other.counts
+        self.total += other.total
+        self.n_values += other.n_values
+        self.min_seen = min(self.min_seen, other.min_seen)
+        self.max_seen = max(self.max_seen, other.max_seen)
 
-    audio_filtered = filtersong(audio_arr)
-    audio_smoothrect = smoothrect(audio_filtered, 10, rate)
+    def threshold(self, threshold: str = 'half-otsu') -> float:
+        """Compute the threshold used to segment syllables from the histogram.
 
-    if threshold == 'half-otsu':
+        Parameters
+        ----------
+        threshold : str
+            Thresholding method, one of {'half-otsu', 'half-average'}.
+            See ``get_syllable_clips_from_audio``.
+            Default is 'half-otsu'.
+
+        Returns
+        -------
+        threshold_val : float
+        """
+        if threshold not in {'half-otsu', 'half-average'}:
+            raise ValueError(
+                "`threshold` must be one of {'half-otsu', 'half-average'},"
+                f"but was: {threshold}"
+            )
+        if self.n_values == 0:
+            raise ValueError(
+                'Cannot compute a threshold from a histogram with no values'
+            )
+        if threshold == 'half-average':
+            # dividing by two here is heuristic, as is just taking the average
+            return float(self.total / self.n_values / 2)
+
+        occupied = np.flatnonzero(self.counts)
+        first, last = occupied[0], occupied[-1] + 1
+        if last - first < 2:
+            # all values are in one bin, so there is nothing to separate;
+            # same as ``threshold_otsu`` when all values are equal
+            return float((self.min_seen + self.max_seen) / 2 / 2)
+        # only use the bins between the smallest and largest values, as ``threshold_otsu`` would
+        hist = (self.counts[first:last], self.bin_centers[first:last])
         # Dividing by two here is heuristic.
         # Value returned by Otsu would be too high otherwise.
-        threshold_val = threshold_otsu(audio_smoothrect) / 2
-    elif threshold == 'half-average':
-        # dividing by two here is heuristic, as is just taking the average
-        threshold_val = np.average(audio_smoothrect) / 2
-    elif isinstance(threshold, float) or isinstance(threshold, int):
-        threshold_val = threshold
+        return float(threshold_otsu(hist=hist)) / 2
+
+
+def _select_blocks(n_samples: int,
+                   block_size: int,
+                   max_blocks: int | None = None,
+                   ) -> tuple[int, list[int] | None]:
+    """Helper function that finds the number of blocks of the envelope of audio with ``n_samples`` samples,
+    and the indices of at most ``max_blocks`` blocks spaced evenly throughout the audio,
+    or None if all blocks are used"""
+    _validate_block_size(block_size)
+    if max_blocks is not None and max_blocks < 1:
+        raise ValueError(
+            f'`max_blocks` must be a positive integer or None but was: {max_blocks}'
+        )
+    n_blocks = -(-max(n_samples - 1, 0) // block_size)
+    if max_blocks is not None and max_blocks < n_blocks:
+        block_inds = np.unique(np.linspace(0, n_blocks - 1, max_blocks).round().astype(int)).tolist()
     else:
+        block_inds = None
+    return n_blocks, block_inds
+
+
+def _threshold_from_blocks(data: np.ndarray,
+                           rate: int,
+                           threshold: str | float | int = 'half-otsu',
+                           block_size: int = SEGMENT_BLOCK_SIZE,
+                           max_blocks: int | None = None,
+                           ) -> float | int:
+    """Helper function that computes the threshold used to segment syllables out of audio,
+    from the amplitude envelope computed one block at a time.
+    See ``threshold_from_wav``"""
+    if isinstance(threshold, str):
+        if threshold not in {'half-otsu', 'half-average'}:
+            raise ValueError(
+                "If 'threshold` is a string, it must be one of {'half-otsu', 'half-average'},"
+                f"but was: {threshold}"
+            )
+    elif not (isinstance(threshold, float) or isinstance(threshold, int)):
         raise ValueError(
             "'thresh` must be {'half-otsu', 'half-average'} or a float or int value,"
             f"but was: {threshold}"
         )
+    n_blocks, block_inds = _select_blocks(len(data), block_size, max_blocks)
+    if not isinstance(threshold, str):
+        return threshold
+    if n_blocks == 0:
+        raise ValueError(
+            f'audio has too few samples to compute a threshold: {len(data)}'
+        )
+
+    if threshold == 'half-average':
+        histogram = EnvelopeHistogram(envelope_max(data.dtype))
+    else:
+        envelope_min, envelope_max_ = np.inf, -np.inf
+        for _, _, _, envelope in _iter_envelope_blocks(data, rate, block_size, block_inds=block_inds):
+            envelope_min = min(envelope_min, envelope.min())
+            envelope_max_ = max(envelope_max_, envelope.max())
+        if envelope_min == envelope_max_:
+            # same as ``threshold_otsu`` when all values are equal
+            return envelope_min / 2
+        # the same 256 bins that ``threshold_otsu`` would use for the whole envelope
+        histogram = EnvelopeHistogram(envelope_max_, n_bins=256, min_value=envelope_min)
+    for _, _, _, envelope in _iter_envelope_blocks(data, rate, block_size, block_inds=block_inds):
+        histogram.update(envelope)
+    return histogram.threshold(threshold)
 
-    audio_thresholded = apply_threshold(audio_smoothrect, threshold_val)  # threshold the envelope data
-    audio_thresholded = apply_threshold(
-        ndimage.convolve(audio_thresholded, np.ones(512)), 0.5
-    )  # pad the threshold
 
-    slices = segment_audio(audio_thresholded)
+def _iter_syllable_slices(data: np.ndarray,
+                          rate: int,
+                          min_syl_dur: int | float,
+                          threshold_val: float | int,
+                          block_size: int = SEGMENT_BLOCK_SIZE,
+                          ):
+    """Helper function that segments syllables out of audio one block at a time,
+    with a threshold that has already been computed, yielding a slice for each syllable.
+    See ``iter_syllable_slices_from_wav``"""
+    # calculate length of a ms in samples
+    detector = SegmentDetector(min_length=min_syl_dur * rate / 1000)
+    # pad each block with enough of the envelope on either side that padding the mask gives the same result
+    for start, stop, envelope_start, envelope in _iter_envelope_blocks(data, rate, block_size, margin=PAD_SIZE):
+        mask = _threshold_and_pad(envelope, threshold_val)[start - envelope_start:stop - envelope_start]
+        for onset, offset in zip(*detector.update(mask)):
+            yield slice(int(onset), int(offset), None)
+    for onset, offset in zip(*detector.close()):
+        yield slice(int(onset), int(offset), None)
 
-    # get objects of sufficient duration
-    frqs = rate / 1000  # calculate length of a ms in samples
-    # use name ``slice_`` to not clobber ``slice`` function
-    slices = [slice_ for slice_ in slices if audio_arr[slice_].shape[0] > min_syl_dur * frqs]
 
-    if syls_filtered:
-        syllable_clips = [x for x in [audio_filtered[slice_] for slice_ in slices]]
-    else:
-        syllable_clips = [x for x in [audio_arr[slice_] for slice_ in slices]]
+def threshold_from_wav(wav_path: str | pathlib.Path,
+                       threshold: str | float | int = 'half-otsu',
+                       block_size: int = SEGMENT_BLOCK_SIZE,
+                       max_blocks: int | None = None,
+                       ) -> float | int:
+    """Compute the threshold used to segment syllables
+    out of the audio in a .wav file, without loading the whole file into memory.
 
-    return syllable_clips, slices, threshold_val
+    The file is memory-mapped and its amplitude envelope is computed
+    one block at a time, as in ``iter_syllable_slices_from_wav``.
+    For ``threshold='half-average'`` the envelope is computed once.
+    For ``threshold='half-otsu'``, the envelope is computed twice:
+    once to find its range, and once to accumulate a histogram of it
+    with the same 256 bins that ``skimage.filters.threshold_otsu`` would use,
+    so that the threshold is the same as the one found
+    by ``get_syllable_slices_from_audio`` for the whole file.
+
+    Parameters
+    ----------
+    wav_path : str, pathlib.Path
+        Path to a .wav file.
+    threshold : str, float, int
+        Thresholding method. See ``get_syllable_clips_from_audio``.
+        Default is 'half-otsu'.
+    block_size : int
+        Number of samples of the envelope to compute at once.
+        Default is ``SEGMENT_BLOCK_SIZE``.
+    max_blocks : int
+        Maximum number of blocks used to estimate the threshold.
+        If the file has more blocks than this, the threshold is
+        estimated from this many blocks spaced evenly throughout the file.
+        Default is None, in which case all blocks are used.
+
+    Returns
+    -------
+    threshold_val : float or int
+        Threshold value obtained
+        using the method specified by
+        ``threshold`` argument.
+    """
+    rate, data = load_wav(wav_path, mmap=True)
+    return _threshold_from_blocks(data, rate, threshold, block_size, max_blocks)
+
+
+def iter_syllable_slices_from_wav(wav_path: str | pathlib.Path,
+                                  min_syl_dur=10,
+                                  threshold: str | float | int = 'half-otsu',
+                                  block_size: int = SEGMENT_BLOCK_SIZE,
+                                  max_threshold_blocks: int | None = None,
+                                  ):
+    """Segment syllables out of the audio in a .wav file,
+    reading and processing it one block at a time,
+    and yield a slice for each syllable as it is found.
+
+    Use this instead of ``get_syllable_slices_from_audio``
+    for recordings that are too long to load into memory.
+    The file is memory-mapped, and each block is filtered
+    and smoothed together with enough of the audio on either side
+    that the result is the same as filtering and smoothing the whole file.
+    Segments that cross the boundaries between blocks are joined
+    by a ``SegmentDetector``, so the slices are the same
+    as those returned by ``get_syllable_slices_from_audio``
+    for the audio in the whole file.
+
+    Parameters
+    ----------
+    wav_path : str, pathlib.Path
+        Path to a .wav file.
+    min_syl_dur : int
+        Minimum syllable duration, in milliseconds.
+    threshold : str, float, int
+        Thresholding method. See ``get_syllable_clips_from_audio``.
+        If a string, the threshold is first computed
+        with ``threshold_from_wav``, which reads the file once or twice more.
+        To segment with a threshold that has already been computed,
+        pass in its value.
+        Default is 'half-otsu'.
+    block_size : int
+        Number of samples to process at once.
+        Default is ``SEGMENT_BLOCK_SIZE``.
+    max_threshold_blocks : int
+        Maximum number of blocks used to estimate the threshold.
+        See ``threshold_from_wav``. Default is None,
+        in which case all blocks are used.
+
+    Yields
+    ------
+    slice_ : slice
+        Slice of the audio in the .wav file that contains a syllable.
+    """
+    rate, data = load_wav(wav_path, mmap=True)
+    threshold_val = _threshold_from_blocks(data, rate, threshold, block_size, max_threshold_blocks)
+    yield from _iter_syllable_slices(data, rate, min_syl_dur, threshold_val, block_size)
+
+
+def envelope_histogram_from_wav(wav_path: str | pathlib.Path,
+                                block_size: int = SEGMENT_BLOCK_SIZE,
+                                max_blocks: int | None = None,
+                                n_bins: int = ENVELOPE_HIST_N_BINS,
+                                max_value: float | None = None,
+                                ) -> EnvelopeHistogram:
+    """Compute an ``EnvelopeHistogram`` of the amplitude envelope
+    of the audio in a .wav file, in one pass over the file.
+
+    The file is memory-mapped and its amplitude envelope is computed
+    one block at a time, as in ``iter_syllable_slices_from_wav``,
+    and each block is added to the histogram, so memory does not grow
+    with the length of the file.
+
+    Parameters
+    ----------
+    wav_path : str, pathlib.Path
+        Path to a .wav file.
+    block_size : int
+        Number of samples of the envelope to compute at once.
+        Default is ``SEGMENT_BLOCK_SIZE``.
+    max_blocks : int
+        Maximum number of blocks added to the histogram.
+        If the file has more blocks than this, only this many blocks
+        spaced evenly throughout the file are used.
+        Default is None, in which case all blocks are used.
+    n_bins : int
+        Number of bins. Default is ``ENVELOPE_HIST_N_BINS``.
+    max_value : float
+        Upper edge of the last bin.
+        Default is None, in which case it is found from the data type
+        of the .wav file with ``envelope_max``.
+
+    Returns
+    -------
+    histogram : EnvelopeHistogram
+    """
+    rate, data = load_wav(wav_path, mmap=True)
+    _, block_inds = _select_blocks(len(data), block_size, max_blocks)
+    if max_value is None:
+        max_value = envelope_max(data.dtype)
+    histogram = EnvelopeHistogram(max_value, n_bins)
+    for _, _, _, envelope in _iter_envelope_blocks(data, rate, block_size, block_inds=block_inds):
+        histogram.update(envelope)
+    return histogram
+
+
+def threshold_from_wavs(wav_paths: list[str] | list[pathlib.Path],
+                        threshold: str = 'half-otsu',
+                        block_size: int = SEGMENT_BLOCK_SIZE,
+                        max_blocks: int | None = None,
+                        n_bins: int = ENVELOPE_HIST_N_BINS,
+                        ) -> float:
+    """Compute one threshold used to segment syllables
+    out of the audio in all of a list of .wav files,
+    e.g. all the songs recorded from one bird.
+
+    An ``EnvelopeHistogram`` is computed for each file
+    with ``envelope_histogram_from_wav``, and the histograms are pooled,
+    so the threshold is computed from the envelopes of all files
+    in one pass over each, with constant memory.
+    Pass the threshold to ``songdkl.syllables.iter_syls_and_psds``
+    to segment every file with it, instead of computing a threshold
+    for each file. To save the threshold so it is not computed again,
+    see ``songdkl.cache.threshold_with_cache``.
+
+    Parameters
+    ----------
+    wav_paths : list
+        Of str or pathlib.Path, paths to .wav files.
+        All files should have the same data type.
+    threshold : str
+        Thresholding method, one of {'half-otsu', 'half-average'}.
+        See ``get_syllable_clips_from_audio``.
+        Default is 'half-otsu'.
+    block_size : int
+        Number of samples of the envelope to compute at once.
+        Default is ``SEGMENT_BLOCK_SIZE``.
+    max_blocks : int
+        Maximum number of blocks used from each file.
+        See ``envelope_histogram_from_wav``.
+        Default is None, in which case all blocks are used.
+    n_bins : int
+        Number of bins in the histogram. Default is ``ENVELOPE_HIST_N_BINS``.
+
+    Returns
+    -------
+    threshold_val : float
+    """
+    if threshold not in {'half-otsu', 'half-average'}:
+        raise ValueError(
+            "`threshold` must be one of {'half-otsu', 'half-average'},"
+            f"but was: {threshold}"
+        )
+    if len(wav_paths) == 0:
+        raise ValueError(
+            'Cannot compute a threshold from an empty list of .wav files'
+        )
+    histogram = None
+    for wav_path in wav_paths:
+        histogram_this_wav = envelope_histogram_from_wav(wav_path, block_size, max_blocks, n_bins)
+        if histogram is None:
+            histogram = histogram_this_wav
+        else:
+            histogram.merge(histogram_this_wav)
+    return histogram.threshold(threshold)
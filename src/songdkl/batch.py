@@ -0,0 +1,380 @@
+"""functions to compute song divergence for a batch of pairs of birds,
+in parallel, using a pool of processes"""
+from __future__ import annotations
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+import csv
+import dataclasses
+import logging
+import multiprocessing
+import pathlib
+from typing import TextIO
+
+import numpy as np
+
+from .constants import DEFAULT_FREQ_RANGE, DEFAULT_GMM_KWARGS
+from .load import n_psds
+from .songdkl import calculate_from_path
+from .syllables import dask_scheduler, SCHEDULERS
+
+
+logger = logging.getLogger(__name__)
+
+
+MANIFEST_COLUMNS = ('ref_path', 'compare_path', 'k_ref', 'k_compare')
+
+
+@dataclasses.dataclass
+class CalculateJob:
+    """Dataclass representing one pair of birds
+    for which song divergence should be calculated.
+
+    Attributes
+    ----------
+    ref_path : str
+        Path to data from bird that should be used as reference.
+    compare_path : str
+        Path to data from bird that should be compared with reference.
+    k_ref : int
+        Number of syllable classes in song of bird used as reference.
+    k_compare : int
+        Number of syllable classes in song of bird compared with reference.
+    """
+    ref_path: str
+    compare_path: str
+    k_ref: int
+    k_compare: int
+
+
+@dataclasses.dataclass
+class CalculateResult:
+    """Dataclass representing the result of a ``CalculateJob``.
+
+    Attributes
+    ----------
+    job : CalculateJob
+        The job that produced this result.
+    DKL_PQ : float
+        Value returned by ``songdkl.songdkl.calculate``.
+        NaN if the job failed.
+    DKL_QP : float
+        Value returned by ``songdkl.songdkl.calculate``.
+        NaN if the job failed.
+    n_psds_ref : int
+        Number of PSDs used from reference data set.
+        -1 if the job failed.
+    n_psds_compare : int
+        Number of PSDs used from comparison data set.
+        -1 if the job failed.
+    error : str, None
+        If the job failed, a string describing the error.
+        None if the job succeeded.
+    """
+    job: CalculateJob
+    DKL_PQ: float = np.nan
+    DKL_QP: float = np.nan
+    n_psds_ref: int = -1
+    n_psds_compare: int = -1
+    error: str | None = None
+
+    def to_tsv_row(self, n_basis: int) -> str:
+        """Format result as a tab-delimited string,
+        the same format as output by ``songdkl calculate``"""
+        return (
+            f'{self.job.ref_path}\t{self.job.compare_path}\t'
+            f'{self.job.k_ref}\t{self.job.k_compare}\t'
+            f'{n_basis}\t{self.DKL_PQ}\t{self.DKL_QP}\t'
+            f'{self.n_psds_ref}\t{self.n_psds_compare}'
+        )
+
+
+def read_manifest(manifest_path: str | pathlib.Path) -> list[CalculateJob]:
+    """Read a manifest of jobs from a tab-delimited text file.
+
+    Each row in the file specifies one job, with four columns:
+    ``ref_path``, ``compare_path``, ``k_ref``, and ``k_compare``.
+    The first row can optionally be a header with those column names.
+    Empty lines and lines that start with "#" are ignored.
+
+    Parameters
+    ----------
+    manifest_path : str, pathlib.Path
+        Path to manifest file.
+
+    Returns
+    -------
+    jobs : list
+        Of ``CalculateJob`` instances.
+    """
+    jobs = []
+    with pathlib.Path(manifest_path).open(newline='') as fp:
+        reader = csv.reader(fp, delimiter='\t')
+        for row_num, row in enumerate(reader):
+            if not row or row[0].startswith('#'):
+                continue
+            if tuple(row) == MANIFEST_COLUMNS:
+                continue
+            if len(row) != len(MANIFEST_COLUMNS):
+                raise ValueError(
+                    f'Row {row_num} in manifest has {len(row)} columns, but expected {len(MANIFEST_COLUMNS)}: '
+                    f'{MANIFEST_COLUMNS}. Row was: {row}'
+                )
+            ref_path, compare_path, k_ref, k_compare = row
+            jobs.append(
+                CalculateJob(ref_path=ref_path, compare_path=compare_path, k_ref=int(k_ref), k_compare=int(k_compare))
+            )
+    return jobs
+
+
+def estimate_n_psds(data_path: str | pathlib.Path, max_num_psds: int | None = None) -> float:
+    """Estimate number of PSDs that will be used from a data path,
+    to schedule the most expensive jobs first.
+
+    For a .zarr or .npy file, this is the number of rows in the saved array,
+    found without loading the array.
+    For a directory of .wav files, the number of PSDs is not known
+    without preparing the dataset,
+    so ``max_num_psds`` is used as the estimate,
+    and if that is None, the estimate is infinite.
+    Jobs that need to prepare datasets are then scheduled first,
+    since they are typically the most expensive.
+    """
+    data_path = pathlib.Path(data_path)
+    if data_path.suffix in ('.zarr', '.npy'):
+        return n_psds(data_path)
+    if max_num_psds:
+        return max_num_psds
+    return float('inf')
+
+
+# set in each worker process by ``_init_worker``, used to report which job a worker started
+_STARTED_QUEUE = None
+
+
+def _init_worker(started_queue):
+    global _STARTED_QUEUE
+    _STARTED_QUEUE = started_queue
+
+
+def _run_job(job_ind: int, job: CalculateJob, calculate_kwargs: dict,
+             scheduler: str | None = None, n_workers: int | None = None) -> tuple:
+    if _STARTED_QUEUE is not None:
+        _STARTED_QUEUE.put(job_ind)
+    # the scheduler is set in the worker process, so each job segments .wav files with its own dask workers
+    with dask_scheduler(scheduler, n_workers):
+        return calculate_from_path(job.ref_path, job.compare_path, job.k_ref, job.k_compare, **calculate_kwargs)
+
+
+def _drain(started_queue) -> set[int]:
+    started = set()
+    while not started_queue.empty():
+        started.add(started_queue.get())
+    return started
+
+
+def calculate_batch(jobs: list[CalculateJob] | str | pathlib.Path,
+                    n_jobs: int = 1,
+                    output: TextIO | None = None,
+                    max_wavs: int = 120,
+                    max_num_psds: int = 10000,
+                    n_basis: int = 50,
+                    basis: str = 'first',
+                    gmm_kwargs: DEFAULT_GMM_KWARGS | dict = DEFAULT_GMM_KWARGS,
+                    cache_dir: str | pathlib.Path | None = None,
+                    cache_max_size: int | None = None,
+                    freq_range: tuple[float, float] = DEFAULT_FREQ_RANGE,
+                    dtype: str = 'float64',
+                    threshold: str | float | int = 'half-otsu',
+                    scheduler: str | None = None,
+                    n_workers: int | None = None,
+                    ) -> list[CalculateResult]:
+    """Calculate :math:`\text{Song }D_{KL}` metric for a batch of pairs of birds,
+    using a pool of processes.
+
+    Jobs are scheduled with the longest jobs first,
+    as estimated by the number of PSDs in the data for each job
+    (see ``estimate_n_psds``).
+    Results are written to ``output`` as each job finishes.
+
+    If a worker process crashes, the pool is restarted and
+    the jobs that did not finish are run again. The jobs that were running
+    when the crash happened are run again one at a time in a separate process,
+    so that a job which always crashes its worker
+    is reported as failed without losing the results of any other jobs.
+
+    When data for a job is prepared from a directory of .wav files,
+    ``dask`` is used to segment the files and compute PSDs
+    inside the worker process running that job, with ``scheduler`` and ``n_workers``.
+    If ``n_jobs`` is more than 1, the default scheduler is 'synchronous',
+    so that each worker process does not start its own pool of processes.
+
+    Parameters
+    ----------
+    jobs : list, str, pathlib.Path
+        Either a list of ``CalculateJob`` instances,
+        or a path to a manifest file that can be read by ``read_manifest``.
+    n_jobs : int
+        Number of worker processes to use. Default is 1.
+    output : file-like, None
+        Where rows of results are written as tab-delimited text,
+        as each job finishes, e.g. ``sys.stdout``.
+        Default is None, in which case results are only returned.
+    max_wavs : int
+        Maximum number of wav files to use. Default is 120.
+    max_num_psds : int
+        Maximum number of power spectral densities (PSDs) to calculate.
+        Default is 10000.
+    n_basis : int
+        Number of syllables to use as basis set. Default is 50.
+    basis : str
+        One of {'first', 'random'}.
+        Controls which syllables are used as the basis set.
+        Default is 'first'.
+    gmm_kwargs : dict, DefaultGaussianMixtureKwargs
+        Optional dict with keyword argument to pass into
+        ``sklearn.GaussianMixtureModel`` when instantiating.
+        If not supplied, the defaults are used,
+        that are represented by a dataclass,
+        ``songdkl.constants.DefaultGaussianMixtureKwargs``.
+    cache_dir : str, pathlib.Path
+        Directory where PSDs prepared from .wav files are cached.
+        Shared by all worker processes.
+        Default is None, in which case the environment variable
+        ``SONGDKL_CACHE_DIR`` is used if set, and otherwise no cache is used.
+        See ``songdkl.load.load_or_prep``.
+    cache_max_size : int
+        Maximum size of the cache in bytes.
+        Default is None, in which case
+        ``songdkl.cache.DEFAULT_CACHE_MAX_SIZE`` is used.
+    freq_range : tuple
+        Of two numbers, the lowest and highest frequency in Hz
+        of PSDs computed from syllables, when preparing
+        PSDs from .wav files. Default is (600, 16000).
+    dtype : str
+        Data type of PSDs, distances and similarities,
+        one of {'float64', 'float32'}.
+        See ``songdkl.songdkl.calculate``. Default is 'float64'.
+    threshold : str, float
+        Method used to find the threshold that segments syllables,
+        when preparing PSDs from .wav files, or a number to use as the threshold.
+        Default is 'half-otsu'. See ``songdkl.load.load_or_prep``.
+    scheduler : str
+        Scheduler used by ``dask`` in each worker process to segment .wav files and compute PSDs,
+        one of {'threads', 'processes', 'synchronous', 'distributed'}.
+        Default is None, in which case 'synchronous' is used if ``n_jobs`` is more than 1,
+        and otherwise the scheduler already configured for ``dask`` is used.
+        'distributed' can only be used when ``n_jobs`` is 1,
+        since it starts a local cluster. See ``songdkl.syllables.dask_scheduler``.
+    n_workers : int
+        Number of workers used by ``dask`` in each worker process.
+        Default is None. See ``songdkl.syllables.dask_scheduler``.
+
+    Returns
+    -------
+    results : list
+        Of ``CalculateResult`` instances,
+        in the same order as ``jobs``.
+    """
+    if isinstance(jobs, (str, pathlib.Path)):
+        jobs = read_manifest(jobs)
+    if n_jobs < 1:
+        raise ValueError(
+            f'`n_jobs` must be a positive integer but was: {n_jobs}'
+        )
+    if scheduler is not None and scheduler not in SCHEDULERS:
+        raise ValueError(
+            f'`scheduler` must be one of {SCHEDULERS}, but was: {scheduler}'
+        )
+    if scheduler == 'distributed' and n_jobs > 1:
+        raise ValueError(
+            "`scheduler` cannot be 'distributed' when `n_jobs` is more than 1, "
+            f'since each of the {n_jobs} worker processes would start its own cluster'
+        )
+    if scheduler is None and n_jobs > 1:
+        # don't start a pool of dask workers inside each of the worker processes
+        scheduler = 'synchronous'
+
+    calculate_kwargs = dict(max_wavs=max_wavs, max_num_psds=max_num_psds, n_basis=n_basis, basis=basis,
+                            gmm_kwargs=gmm_kwargs, cache_dir=cache_dir, cache_max_size=cache_max_size,
+                            freq_range=freq_range, dtype=dtype, threshold=threshold)
+
+    costs = [
+        estimate_n_psds(job.ref_path, max_num_psds) + estimate_n_psds(job.compare_path, max_num_psds)
+        for job in jobs
+    ]
+    # longest jobs first
+    pending = sorted(range(len(jobs)), key=lambda ind: costs[ind], reverse=True)
+
+    logger.log(
+        msg=f'Running {len(jobs)} jobs with {n_jobs} worker processes.',
+        level=logging.INFO
+    )
+
+    results: list[CalculateResult | None] = [None] * len(jobs)
+
+    def _record(job_ind, result):
+        results[job_ind] = result
+        if output is not None:
+            print(result.to_tsv_row(n_basis), file=output, flush=True)
+
+    def _result_from_future(job_ind, future):
+        """get result from future; raises BrokenProcessPool if the worker crashed"""
+        try:
+            DKL_PQ, DKL_QP, n_psds_ref, n_psds_compare = future.result()
+        except BrokenProcessPool:
+            raise
+        except Exception as e:
+            logger.error(f'Job failed: {jobs[job_ind]}. Error was: {e!r}')
+            return CalculateResult(job=jobs[job_ind], error=repr(e))
+        return CalculateResult(job=jobs[job_ind], DKL_PQ=DKL_PQ, DKL_QP=DKL_QP,
+                               n_psds_ref=n_psds_ref, n_psds_compare=n_psds_compare)
+
+    mp_context = multiprocessing.get_context()
+    suspects = []
+    while pending:
+        # use SimpleQueue so a worker's message is written before it starts the job
+        started_queue = mp_context.SimpleQueue()
+        crashed = []
+        with concurrent.futures.ProcessPoolExecutor(max_workers=n_jobs, mp_context=mp_context,
+                                                    initializer=_init_worker,
+                                                    initargs=(started_queue,)) as executor:
+            future_to_ind = {
+                executor.submit(_run_job, job_ind, jobs[job_ind], calculate_kwargs, scheduler, n_workers): job_ind
+                for job_ind in pending
+            }
+            for future in concurrent.futures.as_completed(future_to_ind):
+                job_ind = future_to_ind[future]
+                try:
+                    _record(job_ind, _result_from_future(job_ind, future))
+                except BrokenProcessPool:
+                    crashed.append(job_ind)
+
+        pending = []
+        if crashed:
+            started = _drain(started_queue)
+            # jobs that had started when the pool broke might have caused the crash,
+            # so we run those in isolation below. The rest we just try again.
+            new_suspects = [job_ind for job_ind in crashed if job_ind in started]
+            if not new_suspects:
+                # should not happen, but make sure we can't loop forever
+                new_suspects = crashed
+            logger.warning(
+                f'A worker process crashed. Re-running {len(crashed) - len(new_suspects)} jobs '
+                f'that had not started, and running {len(new_suspects)} jobs '
+                f'that were running at the time of the crash one at a time.'
+            )
+            suspects.extend(new_suspects)
+            pending = [job_ind for job_ind in crashed if job_ind not in new_suspects]
+        started_queue.close()
+
+    for job_ind in suspects:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=mp_context) as executor:
+            future = executor.submit(_run_job, job_ind, jobs[job_ind], calculate_kwargs, scheduler, n_workers)
+            try:
+                result = _result_from_future(job_ind, future)
+            except BrokenProcessPool:
+                logger.error(f'Job failed: {jobs[job_ind]}. Worker process crashed.')
+                result = CalculateResult(job=jobs[job_ind], error='worker process crashed')
+        _record(job_ind, result)
+
+    return results
@@ -0,0 +1,388 @@
+"""A persistent on-disk cache of power spectral densities (PSDs)
+computed from .wav files, so that repeatedly preparing the same
+datasets from .wav files does not repeat the work of
+segmenting audio and computing PSDs.
+
+Each entry in the cache holds the PSDs from all syllables segmented
+out of one .wav file. Entries are keyed by a hash of the contents
+of the .wav file, combined with the parameters used to compute the PSDs,
+so that only new or changed files need to be processed again.
+When the total size of the cache is larger than its maximum size,
+the least recently used entries are removed.
+The cache can also hold the threshold used to segment
+all the .wav files from one bird, see ``threshold_with_cache``.
+"""
+from __future__ import annotations
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import tempfile
+
+import numpy as np
+
+from . import audio
+from .__about__ import __version__
+from .constants import DEFAULT_FREQ_RANGE
+from .syllables import _pooled_method, iter_syls_and_psds
+
+
+logger = logging.getLogger(__name__)
+
+
+# name of environment variable that specifies the cache directory, if not passed in directly
+CACHE_DIR_ENV_VAR = 'SONGDKL_CACHE_DIR'
+
+# default maximum size of the cache, in bytes
+DEFAULT_CACHE_MAX_SIZE = 20 * 1024 ** 3
+
+# increment when a change to songdkl changes the PSDs computed from a .wav file,
+# so that entries computed by earlier versions are not used
+CACHE_FORMAT_VERSION = 3
+
+# parameters used to segment audio and compute PSDs, that are part of the key for each entry,
+# along with parameters that can be specified by the user, e.g. ``freq_range``.
+# ``threshold`` is replaced by the value used when a pooled threshold is specified
+PREP_PARAMS = dict(
+    min_syl_dur=10,
+    threshold='half-otsu',
+    syls_filtered=False,
+    nfft_at_32khz=2 ** 14,
+)
+
+
+def get_cache_dir(cache_dir: str | pathlib.Path | None = None) -> pathlib.Path | None:
+    """Get the directory used for the cache.
+
+    Parameters
+    ----------
+    cache_dir : str, pathlib.Path, None
+        Path to cache directory. If None, the default,
+        the value of the environment variable ``SONGDKL_CACHE_DIR`` is used.
+        If that variable is not set, then None is returned,
+        meaning that no cache is used.
+
+    Returns
+    -------
+    cache_dir : pathlib.Path, None
+    """
+    if cache_dir is None:
+        cache_dir = os.environ.get(CACHE_DIR_ENV_VAR)
+        if not cache_dir:
+            return None
+    return pathlib.Path(cache_dir).expanduser()
+
+
+def hash_file(path: str | pathlib.Path, chunk_size: int = 2 ** 20) -> str:
+    """Get hex digest of a hash of a file's contents."""
+    hasher = hashlib.blake2b(digest_size=20)
+    with pathlib.Path(path).open('rb') as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class PSDCache:
+    """A persistent cache of PSDs computed from .wav files.
+
+    Entries are saved in ``cache_dir`` as .npy files,
+    named by a hash of the .wav file contents and the parameters
+    used to compute PSDs. The modification time of an entry
+    is updated whenever it is used, and when the total size of entries
+    is larger than ``max_size``, the least recently used
+    entries are removed.
+    The total size is tracked as entries are added,
+    so the cache directory is only scanned the first time
+    an entry is added, and when the total is larger than ``max_size``.
+
+    Attributes
+    ----------
+    cache_dir : pathlib.Path
+        Directory where cached PSDs are saved.
+    max_size : int
+        Maximum total size of cached PSDs, in bytes.
+    """
+    def __init__(self,
+                 cache_dir: str | pathlib.Path,
+                 max_size: int | None = None):
+        if max_size is None:
+            max_size = DEFAULT_CACHE_MAX_SIZE
+        if max_size < 0:
+            raise ValueError(
+                f'`max_size` for cache must be a non-negative number of bytes but was: {max_size}'
+            )
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        # total size of entries, in bytes, found by scanning the cache directory the first time it is needed
+        self._size = None
+
+    @staticmethod
+    def key(wav_path: str | pathlib.Path, params: dict) -> str:
+        """Get key for PSDs computed from a .wav file
+        with parameters ``params``."""
+        hasher = hashlib.blake2b(digest_size=20)
+        hasher.update(hash_file(wav_path).encode())
+        hasher.update(
+            json.dumps(
+                dict(params, songdkl_version=__version__, cache_format_version=CACHE_FORMAT_VERSION),
+                sort_keys=True,
+            ).encode()
+        )
+        return hasher.hexdigest()
+
+    def _entry_path(self, key: str) -> pathlib.Path:
+        return self.cache_dir / f'{key}.npy'
+
+    def get(self, key: str) -> np.ndarray | None:
+        """Get cached PSDs with ``key``, or None if there is no entry."""
+        entry_path = self._entry_path(key)
+        try:
+            psds = np.load(entry_path)
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+        # update modification time, which is used to find least recently used entries
+        try:
+            os.utime(entry_path)
+        except FileNotFoundError:
+            pass
+        return psds
+
+    def put(self, key: str, psds: np.ndarray) -> None:
+        """Add PSDs to cache with ``key``,
+        then remove least recently used entries if the cache is too large."""
+        # write to a temporary file then rename, so that other processes never read a partial entry
+        entry_path = self._entry_path(key)
+        try:
+            old_size = entry_path.stat().st_size
+        except FileNotFoundError:
+            old_size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.npy.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                np.save(fp, psds)
+            os.replace(tmp_path, entry_path)
+        except BaseException:
+            pathlib.Path(tmp_path).unlink(missing_ok=True)
+            raise
+        if self._size is None:
+            self._size = self.size()
+        else:
+            self._size += entry_path.stat().st_size - old_size
+        if self._size > self.max_size:
+            self.evict()
+
+    def size(self) -> int:
+        """Total size of cached entries, in bytes."""
+        return sum(entry_path.stat().st_size for entry_path in self.cache_dir.glob('*.npy'))
+
+    def evict(self) -> None:
+        """Remove least recently used entries until
+        total size of cache is not larger than ``max_size``."""
+        entries = []
+        for entry_path in self.cache_dir.glob('*.npy'):
+            try:
+                stat = entry_path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry_path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry_path in sorted(entries):
+            if total <= self.max_size:
+                break
+            entry_path.unlink(missing_ok=True)
+            total -= size
+        self._size = total
+
+    @staticmethod
+    def threshold_key(wav_paths: list[str] | list[pathlib.Path], params: dict) -> str:
+        """Get key for a threshold computed from a list of .wav files
+        with parameters ``params``. The key does not depend on the order of the files."""
+        hasher = hashlib.blake2b(digest_size=20)
+        for file_hash in sorted(hash_file(wav_path) for wav_path in wav_paths):
+            hasher.update(file_hash.encode())
+        hasher.update(
+            json.dumps(
+                dict(params, songdkl_version=__version__, cache_format_version=CACHE_FORMAT_VERSION),
+                sort_keys=True,
+            ).encode()
+        )
+        return hasher.hexdigest()
+
+    def _threshold_path(self, key: str) -> pathlib.Path:
+        return self.cache_dir / f'{key}.threshold.json'
+
+    def get_threshold(self, key: str) -> float | None:
+        """Get cached threshold with ``key``, or None if there is no entry."""
+        try:
+            with self._threshold_path(key).open() as fp:
+                return float(json.load(fp)['threshold'])
+        except (FileNotFoundError, ValueError, KeyError, TypeError, OSError):
+            return None
+
+    def put_threshold(self, key: str, threshold: float) -> None:
+        """Add threshold to cache with ``key``."""
+        # write to a temporary file then rename, so that other processes never read a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.threshold.json.tmp')
+        try:
+            with os.fdopen(fd, 'w') as fp:
+                json.dump({'threshold': float(threshold)}, fp)
+            os.replace(tmp_path, self._threshold_path(key))
+        except BaseException:
+            pathlib.Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+    def clear(self) -> None:
+        """Remove all entries from the cache, including thresholds."""
+        for entry_path in self.cache_dir.glob('*.npy'):
+            entry_path.unlink(missing_ok=True)
+        for threshold_path in self.cache_dir.glob('*.threshold.json'):
+            threshold_path.unlink(missing_ok=True)
+        self._size = 0
+
+
+def threshold_with_cache(wav_paths: list[str] | list[pathlib.Path],
+                         cache: PSDCache | None = None,
+                         threshold: str = 'half-otsu',
+                         max_blocks: int | None = None) -> float:
+    """Get one threshold used to segment syllables
+    out of all the .wav files from one bird,
+    using the threshold from the cache if it was already computed
+    from the same files.
+
+    The threshold is computed with ``songdkl.audio.threshold_from_wavs``,
+    from a histogram of the amplitude envelope pooled across all files.
+    Pass it as ``threshold`` to ``songdkl.syllables.iter_syls_and_psds``
+    to segment every file with it. Used by ``prep_with_cache``
+    when a pooled threshold is specified, e.g. 'pooled-half-otsu'.
+
+    Parameters
+    ----------
+    wav_paths : list
+        Of str or pathlib.Path, paths to .wav files.
+    cache : PSDCache
+        The cache to use. Default is None,
+        in which case the threshold is computed and not cached.
+    threshold : str
+        Thresholding method, one of {'half-otsu', 'half-average'}.
+        Default is 'half-otsu'.
+    max_blocks : int
+        Maximum number of blocks of the envelope used from each file.
+        See ``songdkl.audio.envelope_histogram_from_wav``.
+        Default is None, in which case all blocks are used.
+
+    Returns
+    -------
+    threshold_val : float
+    """
+    if cache is None:
+        return audio.threshold_from_wavs(wav_paths, threshold, max_blocks=max_blocks)
+
+    params = dict(threshold=threshold, max_blocks=max_blocks, n_bins=audio.ENVELOPE_HIST_N_BINS)
+    key = cache.threshold_key(wav_paths, params)
+    threshold_val = cache.get_threshold(key)
+    if threshold_val is not None:
+        logger.log(
+            msg=f'Found threshold for {len(wav_paths)} .wav files in cache: {cache.cache_dir}',
+            level=logging.INFO
+        )
+        return threshold_val
+    threshold_val = audio.threshold_from_wavs(wav_paths, threshold, max_blocks=max_blocks)
+    cache.put_threshold(key, threshold_val)
+    return threshold_val
+
+
+def prep_with_cache(dir_path: str | pathlib.Path,
+                    cache: PSDCache,
+                    max_wavs: int | None = 120,
+                    max_num_psds: int | None = 10000,
+                    freq_range: tuple[float, float] = DEFAULT_FREQ_RANGE,
+                    threshold: str | float | int = 'half-otsu') -> np.ndarray:
+    """Prepare PSDs from a directory of .wav files,
+    using PSDs from the cache for any .wav file that is already in it.
+
+    Returns the same PSDs as ``songdkl.prep.prep``,
+    but only segments and computes PSDs for .wav files
+    that are not in the cache, then adds those to the cache.
+    If ``threshold`` is pooled, e.g. 'pooled-half-otsu', the threshold
+    for all the .wav files is also cached, with ``threshold_with_cache``,
+    and the value is part of the key for the PSDs from each file.
+
+    Parameters
+    ----------
+    dir_path : str, pathlib.Path
+        Path to a directory with .wav files of songs.
+    cache : PSDCache
+        The cache to use.
+    max_wavs : int
+        Maximum number of .wav files to use. Default is 120.
+    max_num_psds : int
+        Maximum number of PSDs to compute. Default is 10k.
+    freq_range : tuple
+        Of two numbers, the lowest and highest frequency in Hz
+        of PSDs computed from syllables. Default is (600, 16000).
+    threshold : str, float, int
+        Thresholding method used to segment .wav files.
+        See ``songdkl.syllables.iter_syls_and_psds``. Default is 'half-otsu'.
+
+    Returns
+    -------
+    segedpsds : numpy.ndarray
+        Array with PSDs from syllable segments.
+    """
+    wav_paths = sorted(pathlib.Path(dir_path).glob('*.wav'))
+    if max_wavs:
+        wav_paths = wav_paths[:max_wavs]
+
+    method = _pooled_method(threshold)
+    if method is not None and wav_paths:
+        threshold = threshold_with_cache(wav_paths, cache, method)
+    params = dict(PREP_PARAMS, freq_range=[float(freq) for freq in freq_range], threshold=threshold)
+    keys = []
+    psds_per_wav = []
+    n_psds_cached, all_cached = 0, True
+    for wav_path in wav_paths:
+        if max_num_psds and all_cached and n_psds_cached >= max_num_psds:
+            # we already have enough PSDs from the .wav files before this one
+            break
+        key = cache.key(wav_path, params)
+        psds = cache.get(key)
+        keys.append(key)
+        psds_per_wav.append(psds)
+        if psds is None:
+            all_cached = False
+        else:
+            n_psds_cached += len(psds)
+
+    missing = [ind for ind, psds in enumerate(psds_per_wav) if psds is None]
+    logger.log(
+        msg=f'Found PSDs for {len(psds_per_wav) - len(missing)} of {len(psds_per_wav)} .wav files '
+            f'in cache: {cache.cache_dir}',
+        level=logging.INFO
+    )
+    # prepare missing .wav files lazily, in order, so we can stop once we have ``max_num_psds``.
+    # We don't pass ``max_num_psds`` to the generator, so the cache gets all PSDs from each file
+    if missing:
+        missing_syls_and_psds = iter_syls_and_psds([wav_paths[ind] for ind in missing], freq_range=freq_range,
+                                                   keep_syls=False, threshold=threshold)
+    n_psds = 0
+    for ind in range(len(psds_per_wav)):
+        if psds_per_wav[ind] is None:
+            _, psds = next(missing_syls_and_psds)
+            cache.put(keys[ind], psds)
+            psds_per_wav[ind] = psds
+        n_psds += len(psds_per_wav[ind])
+        if max_num_psds and n_psds >= max_num_psds:
+            psds_per_wav = psds_per_wav[:ind + 1]
+            break
+    if missing:
+        missing_syls_and_psds.close()
+
+    psds_per_wav = [psds for psds in psds_per_wav if len(psds) > 0]
+    if not psds_per_wav:
+        return np.array([])
+    segedpsds = np.concatenate(psds_per_wav)
+    if max_num_psds:
+        segedpsds = segedpsds[:max_num_psds]
+    return segedpsds
@@ -4,6 +4,21 @@ import dataclasses
 # format for timestamps
 STRFTIME_TIMESTAMP = "%y%m%d_%H%M%S"
 
+# range of frequencies in Hz kept from power spectral densities of syllables
+DEFAULT_FREQ_RANGE = (600, 16000)
+
+# methods used to find the threshold that segments syllables out of audio.
+# 'half-otsu' and 'half-average' find a threshold for each .wav file;
+# the 'pooled-' methods find one threshold for all the .wav files from a bird,
+# see ``songdkl.syllables.resolve_threshold``
+THRESHOLDS = ('half-otsu', 'half-average', 'pooled-half-otsu', 'pooled-half-average')
+
+# dtypes that PSDs can be saved as, and that distances and similarities can be computed with
+DTYPES = ('float64', 'float32')
+
+# name of group in a .zarr file where models fit to a bird's song are saved, see ``songdkl.model``
+MODELS_GROUP = 'models'
+
 
 @dataclasses.dataclass
 class DefaultGaussianMixtureKwargs:
@@ -0,0 +1,118 @@
+"""Functions to compute squared Euclidean distances
+between PSDs and a basis set.
+
+Distances are computed with the expansion
+:math:`||x - b||^2 = ||x||^2 + ||b||^2 - 2 x \\cdot b`,
+so that the cross terms for many PSDs are computed
+with a single matrix product, that uses BLAS,
+instead of computing the difference between each pair of vectors
+as ``scipy.spatial.distance.cdist`` does.
+The squared norms of the basis set are computed once,
+and can be reused for every array of PSDs compared with it.
+"""
+from __future__ import annotations
+
+import numpy as np
+import zarr
+
+
+# number of rows of PSDs read at a time when computing distances to the basis set
+DISTANCE_CHUNK_ROWS = 1024
+
+
+def sq_norms(X: np.ndarray) -> np.ndarray:
+    """Compute squared Euclidean norm of each row of ``X``."""
+    return np.einsum('ij,ij->i', X, X)
+
+
+def sqeuclidean(X: np.ndarray,
+                basis_set: np.ndarray,
+                basis_sq_norms: np.ndarray | None = None,
+                out: np.ndarray | None = None) -> np.ndarray:
+    """Compute squared Euclidean distances between rows of ``X``
+    and rows of ``basis_set``.
+
+    Equivalent to ``scipy.spatial.distance.cdist(X, basis_set, 'sqeuclidean')``,
+    but computes the cross terms with one matrix product.
+    Because of rounding error, distances computed this way
+    between vectors that are very close can be slightly negative,
+    so distances are clamped at zero.
+
+    Parameters
+    ----------
+    X : numpy.ndarray
+        With shape (n, n_freqs).
+    basis_set : numpy.ndarray
+        With shape (n_basis, n_freqs).
+    basis_sq_norms : numpy.ndarray
+        Squared norms of rows of ``basis_set``, returned by ``sq_norms``.
+        Default is None, in which case they are computed.
+    out : numpy.ndarray
+        Array with shape (n, n_basis) where distances are written.
+        Default is None, in which case a new array is returned.
+
+    Returns
+    -------
+    D : numpy.ndarray
+        Distances with shape (n, n_basis).
+    """
+    if basis_sq_norms is None:
+        basis_sq_norms = sq_norms(basis_set)
+    D = np.matmul(X, basis_set.T, out=out)
+    D *= -2
+    D += sq_norms(X)[:, np.newaxis]
+    D += basis_sq_norms[np.newaxis, :]
+    np.maximum(D, 0, out=D)
+    return D
+
+
+def distances_to_basis(psds: np.ndarray | zarr.Array,
+                       basis_set: np.ndarray,
+                       start: int = 0,
+                       stop: int | None = None,
+                       chunk_rows: int = DISTANCE_CHUNK_ROWS,
+                       basis_sq_norms: np.ndarray | None = None) -> np.ndarray:
+    """Compute squared Euclidean distances from PSDs to a basis set.
+
+    Rows of PSDs are read and compared with the basis set
+    ``chunk_rows`` at a time, with ``sqeuclidean``,
+    so that if ``psds`` is an array that is read lazily from disk,
+    at most that many rows are in memory at once.
+    Rows are converted to the data type of ``basis_set`` as they are read,
+    and distances are computed and returned with that data type.
+
+    Parameters
+    ----------
+    psds : numpy.ndarray, zarr.Array
+        Array of PSDs, with shape (n_psds, n_freqs).
+    basis_set : numpy.ndarray
+        Array of PSDs with shape (n_basis, n_freqs),
+        e.g. returned by ``songdkl.songdkl.get_basis_set``.
+    start : int
+        Index of first row of ``psds`` to use. Default is 0.
+    stop : int
+        Index after last row of ``psds`` to use.
+        Default is None, in which case all rows after ``start`` are used.
+    chunk_rows : int
+        Number of rows to read at a time. Default is 1024.
+    basis_sq_norms : numpy.ndarray
+        Squared norms of rows of ``basis_set``, returned by ``sq_norms``.
+        Default is None, in which case they are computed.
+        Pass these in to avoid computing them again
+        when comparing many arrays of PSDs with the same basis set.
+
+    Returns
+    -------
+    D : numpy.ndarray
+        Distances with shape (stop - start, n_basis).
+    """
+    if stop is None:
+        stop = len(psds)
+    if basis_sq_norms is None:
+        basis_sq_norms = sq_norms(basis_set)
+    D = np.empty((stop - start, len(basis_set)), dtype=basis_set.dtype)
+    for chunk_start in range(start, stop, chunk_rows):
+        chunk_stop = min(chunk_start + chunk_rows, stop)
+        sqeuclidean(np.asarray(psds[chunk_start:chunk_stop], dtype=basis_set.dtype),
+                    basis_set, basis_sq_norms, out=D[chunk_start - start:chunk_stop - start])
+    return D
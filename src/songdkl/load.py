@@ -7,6 +7,8 @@ import numpy as np
 import zarr
 from zarr import Array, Group
 
+from .constants import DEFAULT_FREQ_RANGE
+from .cache import PSDCache, get_cache_dir, prep_with_cache
 from .prep import prep
 
 
@@ -16,7 +18,14 @@ logger = logging.getLogger(__name__)
 def load_or_prep(data_path: str | pathlib.Path,
                  max_wavs: int | None = None,
                  max_num_psds: int | None = None,
-                 ) -> np.ndarray:
+                 cache_dir: str | pathlib.Path | None = None,
+                 cache_max_size: int | None = None,
+                 freq_range: tuple[float, float] = DEFAULT_FREQ_RANGE,
+                 rows: slice | np.ndarray | None = None,
+                 lazy: bool = False,
+                 dtype: str = 'float64',
+                 threshold: str | float | int = 'half-otsu',
+                 ) -> np.ndarray | Array:
     """Either load an array of PSDs from a .zarr file,
     or prepare the PSDs from a directory of .wav files.
 
@@ -24,55 +33,227 @@ def load_or_prep(data_path: str | pathlib.Path,
     ----------
     data_path : str or pathlib.Path
         Either a path to a directory with .wav files of songs,
-        or a path to a .songdkl.zarr file generated by songdkl prep.
+        or a path to a .songdkl.zarr file generated by songdkl prep,
+        or to a .npy file with an array of PSDs.
     max_wavs : int
         Maximum number of wav files to use.
         Default is None, in which case all are used.
     max_num_psds : int
         Maximum number of power spectral densities (PSDs) to calculate.
         Default is None, in which case all are used.
+    cache_dir : str, pathlib.Path
+        Directory where PSDs prepared from .wav files are cached,
+        so that preparing the same .wav files again loads them from the cache.
+        Default is None, in which case the value of the
+        environment variable ``SONGDKL_CACHE_DIR`` is used, if it is set.
+        If neither is set, no cache is used.
+        See ``songdkl.cache`` for details.
+    cache_max_size : int
+        Maximum size of the cache in bytes. Least recently used entries
+        are removed when the cache is larger than this.
+        Default is None, in which case
+        ``songdkl.cache.DEFAULT_CACHE_MAX_SIZE`` is used.
+    freq_range : tuple
+        Of two numbers, the lowest and highest frequency in Hz
+        of PSDs computed from syllables, when preparing
+        PSDs from .wav files. Default is (600, 16000).
+    rows : slice, numpy.ndarray
+        Rows of PSDs to use, either a slice or an array of row indices.
+        Default is None, in which case all rows are used.
+        See ``load``.
+    lazy : bool
+        If True, and ``data_path`` is a .zarr or .npy file,
+        return an array that only reads rows from disk when they are indexed.
+        Default is False. See ``load``.
+    dtype : str
+        Data type of returned PSDs, one of {'float64', 'float32'}.
+        Arrays that are read lazily keep the data type they were saved with,
+        and are converted as rows are read. Default is 'float64'.
+    threshold : str, float, int
+        Thresholding method used to segment .wav files, when preparing
+        PSDs from .wav files, one of
+        {'half-otsu', 'half-average', 'pooled-half-otsu', 'pooled-half-average'},
+        or a float or int value. The 'pooled-' methods compute one threshold
+        for all the .wav files used, that is also cached if a cache is used.
+        See ``songdkl.prep.prep``. Default is 'half-otsu'.
 
     Returns
     -------
-    segedpsds : numpy.ndarray
+    segedpsds : numpy.ndarray, zarr.Array
         Array with PSDs from syllable segments.
     """
     data_path = pathlib.Path(data_path)
-    if data_path.suffix == '.zarr':
+    if data_path.suffix in ('.zarr', '.npy'):
         if max_wavs is not None or max_num_psds is not None:
             warnings.warn(
                 f'Values were specified for max_wavs or max_num_psds, '
-                f'but data_path was recognized as a .zarr file. '
+                f'but data_path was recognized as a .zarr or .npy file. '
                 f'These values are not applied to already prepared datasets. '
                 f'To apply them, run this function on a directory of .wav files.'
             )
-        segedpsds = load(zarr_path=data_path)
+        segedpsds = load(zarr_path=data_path, rows=rows, lazy=lazy)
+        if rows is not None or not lazy:
+            segedpsds = segedpsds.astype(dtype, copy=False)
     elif data_path.is_dir():
-        # we don't return syls_from_wavs
-        _, segedpsds = prep(data_path, max_wavs, max_num_psds)
+        cache_dir = get_cache_dir(cache_dir)
+        if cache_dir is not None:
+            cache = PSDCache(cache_dir, max_size=cache_max_size)
+            segedpsds = prep_with_cache(data_path, cache, max_wavs, max_num_psds, freq_range, threshold)
+            segedpsds = segedpsds.astype(dtype, copy=False)
+        else:
+            # we don't return syls_from_wavs
+            _, segedpsds = prep(data_path, max_wavs, max_num_psds, freq_range, dtype, keep_syls=False,
+                                threshold=threshold)
+        if rows is not None:
+            segedpsds = select_rows(segedpsds, rows)
     else:
         raise ValueError(
-            f'Not recognized as a .zarr file or a directory: {data_path}'
+            f'Not recognized as a .zarr file, a .npy file, or a directory: {data_path}'
         )
     return segedpsds
 
 
-def load(zarr_path: str | pathlib.Path) -> Array | Group:
-    """Load an array saved in a .zarr file.
+def load(zarr_path: str | pathlib.Path,
+         rows: slice | np.ndarray | None = None,
+         lazy: bool = False) -> np.ndarray | Array:
+    """Load an array of PSDs saved in a .zarr file.
+
+    Loads datasets saved by ``songdkl.prep_and_save``
+    as a ``zarr`` group, and also datasets saved
+    by earlier versions of songdkl as a single array,
+    or saved with ``numpy.save`` in a .npy file.
 
     Parameters
     ----------
     zarr_path : str, pathlib.Path
         Path to a file with extension .zarr,
-        saved by ``songdkl.prep_and_save``
+        saved by ``songdkl.prep_and_save``,
+        or a .npy file.
+    rows : slice, numpy.ndarray
+        Rows of PSDs to load, either a slice,
+        e.g. ``slice(0, 1000)`` or ``slice(None, None, 10)``,
+        or an array of row indices, e.g. returned by ``subsample_rows``.
+        Only the chunks of the saved array that contain these rows are read.
+        Default is None, in which case all rows are loaded.
+    lazy : bool
+        If True and ``rows`` is None, return an array
+        that only reads rows from disk when they are indexed,
+        a ``zarr.Array`` for .zarr files or a memory-mapped array for .npy files,
+        instead of loading all PSDs into memory. Default is False.
 
     Returns
     -------
-    segedpsds : numpy.ndarray
+    segedpsds : numpy.ndarray, zarr.Array
         Array with PSDs from syllable segments.
     """
     logger.log(
         msg=f'Loading array from: {zarr_path}',
         level=logging.INFO,
     )
-    return zarr.load(zarr_path)
+    psds = open_psds(zarr_path)
+    if rows is not None:
+        return select_rows(psds, rows)
+    if lazy:
+        return psds
+    return psds[:]
+
+
+def open_psds(zarr_path: str | pathlib.Path) -> Array | np.ndarray:
+    """Open an array of PSDs saved in a .zarr or .npy file,
+    without loading it into memory.
+
+    Parameters
+    ----------
+    zarr_path : str, pathlib.Path
+        Path to a file with extension .zarr,
+        saved by ``songdkl.prep_and_save``,
+        or a .npy file.
+
+    Returns
+    -------
+    psds : zarr.Array, numpy.memmap
+        For .zarr files, the ``zarr.Array`` of PSDs,
+        and for .npy files, a read-only memory-mapped array.
+    """
+    zarr_path = pathlib.Path(zarr_path)
+    if zarr_path.suffix == '.npy':
+        return np.load(zarr_path, mmap_mode='r')
+    root = zarr.open(str(zarr_path), mode='r')
+    if isinstance(root, Group):
+        return root['psds']
+    return root
+
+
+def select_rows(psds: np.ndarray | Array,
+                rows: slice | np.ndarray) -> np.ndarray:
+    """Select rows from an array of PSDs,
+    reading only those rows if the array is saved on disk.
+
+    Parameters
+    ----------
+    psds : numpy.ndarray, zarr.Array
+        Array of PSDs, e.g. returned by ``open_psds``.
+    rows : slice, numpy.ndarray
+        Either a slice, or an array of row indices.
+
+    Returns
+    -------
+    psds : numpy.ndarray
+        The selected rows.
+    """
+    if isinstance(rows, slice):
+        return np.asarray(psds[rows])
+    rows = np.asarray(rows)
+    if rows.ndim != 1:
+        raise ValueError(
+            f'`rows` must be a slice or a one-dimensional array of row indices, '
+            f'but had shape: {rows.shape}'
+        )
+    if isinstance(psds, Array):
+        return psds.get_orthogonal_selection((rows, slice(None)))
+    return np.asarray(psds[rows])
+
+
+def subsample_rows(n_rows: int, size: int, seed: int | None = None) -> np.ndarray:
+    """Get indices of a random subsample of rows, without replacement,
+    in sorted order so that rows are read from disk sequentially.
+
+    Parameters
+    ----------
+    n_rows : int
+        Total number of rows, e.g. returned by ``n_psds``.
+    size : int
+        Number of rows in subsample.
+    seed : int
+        Seed for random number generator. Default is None.
+
+    Returns
+    -------
+    rows : numpy.ndarray
+        Sorted indices of rows in subsample.
+    """
+    if not 0 <= size <= n_rows:
+        raise ValueError(
+            f'`size` of subsample must be between 0 and the number of rows, {n_rows}, but was: {size}'
+        )
+    rng = np.random.default_rng(seed)
+    return np.sort(rng.choice(n_rows, size=size, replace=False))
+
+
+def n_psds(zarr_path: str | pathlib.Path) -> int:
+    """Get the number of PSDs in a .zarr file
+    saved by ``songdkl.prep_and_save``, without loading them.
+
+    Parameters
+    ----------
+    zarr_path : str, pathlib.Path
+        Path to a file with extension .zarr,
+        saved by ``songdkl.prep_and_save``,
+        or a .npy file.
+
+    Returns
+    -------
+    n_psds : int
+        Number of rows in the array of PSDs.
+    """
+    return open_psds(zarr_path).shape[0]
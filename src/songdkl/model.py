@@ -0,0 +1,496 @@
+"""Gaussian Mixture Models fit to the song of one bird,
+that can be saved and loaded again,
+so that the model of a bird does not need to be fit every time
+its song is compared with the song of another bird.
+
+A model is saved along with everything needed to reuse it:
+the basis set it was fit in, the distances from the bird's PSDs
+to that basis set, the maximum distance used to convert
+distances to similarities, and the parameters used to fit it.
+Models are saved as a group in a .zarr file, either in the
+.songdkl.zarr file with the bird's dataset prepared by ``songdkl prep``,
+or in a separate "sidecar" .zarr file.
+"""
+from __future__ import annotations
+import dataclasses
+import logging
+import pathlib
+
+import numpy as np
+from sklearn.mixture import GaussianMixture
+import zarr
+
+from .__about__ import __version__
+from .constants import DEFAULT_FREQ_RANGE, DEFAULT_GMM_KWARGS, DTYPES, MODELS_GROUP
+from .distance import distances_to_basis, sq_norms
+from .load import load_or_prep
+from .songdkl import _calculate_many, _validate_gmm_kwargs, get_basis_set, NORMALIZE
+
+
+logger = logging.getLogger(__name__)
+
+
+# increment when the way models are saved changes
+MODEL_FORMAT_VERSION = 1
+
+# fitted attributes of ``sklearn.mixture.GaussianMixture`` that are saved as arrays
+GMM_ARRAYS = ('weights_', 'means_', 'covariances_', 'precisions_cholesky_')
+
+
+@dataclasses.dataclass
+class BirdModel:
+    """A Gaussian Mixture Model fit to the song of one bird.
+
+    Attributes
+    ----------
+    gmm : sklearn.mixture.GaussianMixture
+        Model fit to similarities between the first half of the bird's PSDs
+        and the basis set.
+    basis_set : numpy.ndarray
+        Array of PSDs with shape (n_basis, n_freqs),
+        that the model was fit in.
+    basis : str
+        How the basis set was selected, one of {'first', 'random'}.
+    distances : numpy.ndarray
+        Squared Euclidean distances from all of the bird's PSDs to the basis set,
+        with shape (n_psds, n_basis). The second half is used to score the model
+        on held out data.
+    mx : float
+        Maximum distance used to convert distances to similarities.
+    k : int
+        Number of components of the model,
+        i.e., number of syllable classes in the bird's song.
+    gmm_kwargs : dict
+        Keyword arguments used to instantiate ``sklearn.mixture.GaussianMixture``.
+    source : str
+        Path to the bird's data that the model was fit to, if known.
+    """
+    gmm: GaussianMixture
+    basis_set: np.ndarray
+    basis: str
+    distances: np.ndarray
+    mx: float
+    k: int
+    gmm_kwargs: dict
+    source: str | None = None
+
+    @property
+    def n_psds(self) -> int:
+        """Number of PSDs from the bird."""
+        return len(self.distances)
+
+
+def fit_model(psds: np.ndarray,
+              k: int,
+              n_basis: int = 50,
+              basis: str = 'first',
+              gmm_kwargs: DEFAULT_GMM_KWARGS | dict = DEFAULT_GMM_KWARGS,
+              dtype: str = 'float64',
+              source: str | pathlib.Path | None = None) -> BirdModel:
+    """Fit a model to the song of one bird,
+    in a basis set selected from the bird's own PSDs.
+
+    The maximum distance to the basis set across the bird's PSDs
+    is used to convert distances to similarities,
+    as ``songdkl.songdkl.calculate_many`` does with ``normalize='ref'``.
+
+    Parameters
+    ----------
+    psds : numpy.ndarray, zarr.Array
+        Array of PSDs from the bird.
+        Can be an array that is read lazily from disk,
+        e.g. returned by ``songdkl.load.load`` with ``lazy=True``.
+    k : int
+        Number of syllable classes in song of bird,
+        used as the number of components of the model.
+    n_basis : int
+        Number of syllables to use as basis set. Default is 50.
+    basis : str
+        One of {'first', 'random'}.
+        Controls which syllables are used as the basis set.
+        If 'first', use the first `n_basis` syllables.
+        If `random`, grab a random set of size `n_basis`.
+        Default is 'first'.
+    gmm_kwargs : dict, DefaultGaussianMixtureKwargs
+        Optional dict with keyword argument to pass into
+        ``sklearn.GaussianMixtureModel`` when instantiating.
+        If not supplied, the defaults are used,
+        that are represented by a dataclass,
+        ``songdkl.constants.DefaultGaussianMixtureKwargs``.
+    dtype : str
+        Data type of PSDs and distances,
+        one of {'float64', 'float32'}. Default is 'float64'.
+    source : str, pathlib.Path
+        Path to the bird's data, saved with the model
+        so that it can be identified. Default is None.
+
+    Returns
+    -------
+    model : BirdModel
+    """
+    gmm_kwargs = _validate_gmm_kwargs(gmm_kwargs)
+    if dtype not in DTYPES:
+        raise ValueError(
+            f'`dtype` must be one of {DTYPES}, but was: {dtype}'
+        )
+    basis_set = get_basis_set(psds, n_basis, basis).astype(dtype, copy=False)
+    distances = distances_to_basis(psds, basis_set)
+    mx = np.max(distances)
+    len_half = int(len(distances) / 2)
+    # fit in float64, see ``songdkl.songdkl.calculate_many``
+    s = (1 - (distances[:len_half] / mx)).astype(np.float64, copy=False)
+    logger.log(
+        msg=f'Fitting Gaussian Mixture Model with k={k} to PSDs with shape: {psds.shape}',
+        level=logging.INFO
+    )
+    gmm = GaussianMixture(n_components=k, **gmm_kwargs)
+    gmm.fit(s)
+    return BirdModel(gmm=gmm, basis_set=basis_set, basis=basis, distances=distances, mx=mx, k=k,
+                     gmm_kwargs=gmm_kwargs, source=str(source) if source is not None else None)
+
+
+def fit_model_from_path(data_path: str | pathlib.Path,
+                        k: int,
+                        max_wavs: int = 120,
+                        max_num_psds: int = 10000,
+                        n_basis: int = 50,
+                        basis: str = 'first',
+                        gmm_kwargs: DEFAULT_GMM_KWARGS | dict = DEFAULT_GMM_KWARGS,
+                        cache_dir: str | pathlib.Path | None = None,
+                        cache_max_size: int | None = None,
+                        freq_range: tuple[float, float] = DEFAULT_FREQ_RANGE,
+                        rows: slice | np.ndarray | None = None,
+                        dtype: str = 'float64',
+                        threshold: str | float | int = 'half-otsu',
+                        ) -> BirdModel:
+    """Fit a model to the song of one bird,
+    loading or preparing the bird's PSDs from ``data_path``.
+
+    Parameters
+    ----------
+    data_path : str, pathlib.Path
+        Path to data from bird. Either a path to a directory with .wav files of songs,
+        or a path to a .songdkl.zarr file generated by ``songdkl prep``.
+        Saved with the model as its ``source``.
+    k : int
+        Number of syllable classes in song of bird,
+        used as the number of components of the model.
+    max_wavs : int
+        Maximum number of wav files to use. Default is 120.
+    max_num_psds : int
+        Maximum number of power spectral densities (PSDs) to calculate.
+        Default is 10000.
+    n_basis : int
+        Number of syllables to use as basis set. Default is 50.
+    basis : str
+        One of {'first', 'random'}. Default is 'first'.
+        See ``fit_model``.
+    gmm_kwargs : dict, DefaultGaussianMixtureKwargs
+        Optional dict with keyword argument to pass into
+        ``sklearn.GaussianMixtureModel`` when instantiating.
+        See ``fit_model``.
+    cache_dir : str, pathlib.Path
+        Directory where PSDs prepared from .wav files are cached.
+        Default is None. See ``songdkl.load.load_or_prep``.
+    cache_max_size : int
+        Maximum size of the cache in bytes. Default is None.
+        See ``songdkl.load.load_or_prep``.
+    freq_range : tuple
+        Of two numbers, the lowest and highest frequency in Hz
+        of PSDs computed from syllables, when preparing
+        PSDs from .wav files. Default is (600, 16000).
+    rows : slice, numpy.ndarray
+        Rows of PSDs to use. Default is None, in which case all rows are used.
+        See ``songdkl.load.load``.
+    dtype : str
+        Data type of PSDs and distances,
+        one of {'float64', 'float32'}. Default is 'float64'.
+    threshold : str, float
+        Method used to find the threshold that segments syllables,
+        when preparing PSDs from .wav files, or a number to use as the threshold.
+        Default is 'half-otsu'. See ``songdkl.load.load_or_prep``.
+
+    Returns
+    -------
+    model : BirdModel
+    """
+    logger.log(
+        msg=f'Getting PSDs from data_path: {data_path}',
+        level=logging.INFO
+    )
+    psds = load_or_prep(data_path, max_wavs, max_num_psds, cache_dir, cache_max_size, freq_range,
+                        rows, lazy=True, dtype=dtype, threshold=threshold)
+    return fit_model(psds, k, n_basis, basis, gmm_kwargs, dtype, source=data_path)
+
+
+def save_model(model: BirdModel, zarr_path: str | pathlib.Path, name: str = 'model') -> None:
+    """Save a model in a .zarr file.
+
+    The model is saved as a group ``models/{name}`` in the .zarr file.
+    If ``zarr_path`` is the .songdkl.zarr file with the bird's dataset,
+    prepared by ``songdkl prep``, the model is saved along with it.
+    Any other path is created as a new .zarr file if it does not exist.
+    An existing model with the same ``name`` is replaced.
+
+    Note that models saved in a dataset are removed when
+    the dataset is prepared again, or updated by ``songdkl prep --incremental``,
+    since they are no longer fit to the data in it.
+
+    Parameters
+    ----------
+    model : BirdModel
+    zarr_path : str, pathlib.Path
+        Path to .zarr file.
+    name : str
+        Name of model, so that more than one model
+        can be saved for a bird, e.g. with different values of ``k``.
+        Default is 'model'.
+    """
+    root = zarr.open_group(str(zarr_path), mode='a')
+    group = root.require_group(MODELS_GROUP).create_group(name, overwrite=True)
+    for attr in GMM_ARRAYS:
+        group.array(attr.rstrip('_'), getattr(model.gmm, attr))
+    group.array('basis_set', model.basis_set)
+    group.array('distances', model.distances)
+    group.attrs.update(
+        {
+            'songdkl_version': __version__,
+            'format_version': MODEL_FORMAT_VERSION,
+            'k': int(model.k),
+            'gmm_kwargs': model.gmm_kwargs,
+            'basis': model.basis,
+            'mx': float(model.mx),
+            'source': model.source,
+            'converged': bool(model.gmm.converged_),
+            'n_iter': int(model.gmm.n_iter_),
+            'lower_bound': float(model.gmm.lower_bound_),
+        }
+    )
+
+
+def _model_group(zarr_path: str | pathlib.Path, name: str) -> zarr.Group:
+    """Helper function that opens the group where a model was saved by ``save_model``"""
+    root = zarr.open_group(str(zarr_path), mode='r')
+    path = f'{MODELS_GROUP}/{name}'
+    if path not in root:
+        raise ValueError(
+            f'No model named "{name}" saved in: {zarr_path}'
+        )
+    return root[path]
+
+
+def load_model_attrs(zarr_path: str | pathlib.Path, name: str = 'model') -> dict:
+    """Load the attributes of a model saved by ``save_model``,
+    e.g. ``k``, without loading the model itself.
+    Also returns ``n_basis``, the number of PSDs in the basis set of the model.
+
+    Parameters
+    ----------
+    zarr_path : str, pathlib.Path
+        Path to .zarr file where model was saved.
+    name : str
+        Name of model. Default is 'model'.
+
+    Returns
+    -------
+    attrs : dict
+    """
+    group = _model_group(zarr_path, name)
+    return dict(group.attrs.asdict(), n_basis=group['basis_set'].shape[0])
+
+
+def load_model(zarr_path: str | pathlib.Path, name: str = 'model') -> BirdModel:
+    """Load a model saved by ``save_model``.
+
+    Parameters
+    ----------
+    zarr_path : str, pathlib.Path
+        Path to .zarr file where model was saved.
+    name : str
+        Name of model. Default is 'model'.
+
+    Returns
+    -------
+    model : BirdModel
+    """
+    group = _model_group(zarr_path, name)
+    attrs = group.attrs.asdict()
+    gmm = GaussianMixture(n_components=attrs['k'], **attrs['gmm_kwargs'])
+    for attr in GMM_ARRAYS:
+        setattr(gmm, attr, group[attr.rstrip('_')][:])
+    gmm.converged_ = attrs['converged']
+    gmm.n_iter_ = attrs['n_iter']
+    gmm.lower_bound_ = attrs['lower_bound']
+    gmm.n_features_in_ = gmm.means_.shape[1]
+    # convert ``mx`` back to the dtype of the distances, so similarities are computed exactly as when fitting
+    distances = group['distances'][:]
+    return BirdModel(gmm=gmm, basis_set=group['basis_set'][:], basis=attrs['basis'], distances=distances,
+                     mx=distances.dtype.type(attrs['mx']), k=attrs['k'], gmm_kwargs=attrs['gmm_kwargs'],
+                     source=attrs['source'])
+
+
+def calculate_from_model(model: BirdModel,
+                         psds_compares: list[np.ndarray],
+                         k_compares: list[int],
+                         normalize: str = 'ref',
+                         ) -> tuple[np.ndarray, np.ndarray, int, list[int]]:
+    """Calculate :math:`\text{Song }D_{KL}` metric
+    between a bird whose model was already fit, used as the reference,
+    and one or more birds compared with it.
+
+    Computes the same quantities as ``songdkl.songdkl.calculate_many``,
+    using the basis set and distances saved with the model
+    of the reference, so that the data from the reference is not needed.
+    Fitting the model of the reference is skipped whenever
+    the maximum distance used to convert distances to similarities
+    is the one the model was fit with, which is always true
+    for the default ``normalize='ref'`` with a model returned by ``fit_model``.
+    Otherwise, the model is fit again, from the saved distances.
+    A model is still fit to the data from each bird compared with the reference.
+
+    Parameters
+    ----------
+    model : BirdModel
+        Model of bird used as reference,
+        returned by ``fit_model`` or ``load_model``.
+    psds_compares : list
+        Of ``numpy.ndarray``, arrays of PSDs,
+        one for each bird that should be compared with reference.
+        Can be read lazily from disk.
+    k_compares : list
+        Of int, number of syllable classes in song of each bird
+        compared with reference. Must be the same length as ``psds_compares``.
+    normalize : str
+        One of {'pair', 'ref', 'all'}.
+        Controls which maximum distance to the basis set
+        is used to convert distances to similarities.
+        Default is 'ref'. See ``songdkl.songdkl.calculate_many``.
+
+    Returns
+    -------
+    DKL_PQ : numpy.ndarray
+        Of :math:`D_{KL}(\hat{P}||\hat{Q}`, one for each bird
+        compared with reference, in the same order as ``psds_compares``.
+    DKL_QP : numpy.ndarray
+        Same computation as ``DKL_PQ``,
+        but in the opposite direction:
+        Q with respect to P.
+    n_psds_ref : int
+        Number of PSDs used from reference data set.
+    n_psds_compare : list
+        Of int, number of PSDs used from each comparison data set.
+    """
+    if len(psds_compares) != len(k_compares):
+        raise ValueError(
+            f'Number of arrays in `psds_compares` ({len(psds_compares)}) did not match '
+            f'number of values in `k_compares` ({len(k_compares)}).'
+        )
+    if normalize not in NORMALIZE:
+        raise ValueError(
+            f'`normalize` must be one of {NORMALIZE}, but was: {normalize}'
+        )
+
+    logger.log(
+        msg=(f'Calculating songdkl with model of reference (source: {model.source}, k={model.k}) '
+             f'and {len(psds_compares)} psds_compares, with parameters k_compares={k_compares}, '
+             f'normalize={normalize}.'),
+        level=logging.INFO
+    )
+    basis_sq_norms = sq_norms(model.basis_set)
+    D_compares_all = [
+        distances_to_basis(psds_compare, model.basis_set, basis_sq_norms=basis_sq_norms)
+        for psds_compare in psds_compares
+    ]
+    DKL_PQ, DKL_QP = _calculate_many(model.distances, D_compares_all, model.k, k_compares, len(model.basis_set),
+                                     model.gmm_kwargs, normalize, ref_models={model.mx: model.gmm})
+    n_psds_compare = [len(psds_compare) for psds_compare in psds_compares]
+    return DKL_PQ, DKL_QP, model.n_psds, n_psds_compare
+
+
+def calculate_from_model_path(model_path: str | pathlib.Path,
+                              compare_paths: list[str | pathlib.Path],
+                              k_compares: list[int],
+                              name: str = 'model',
+                              max_wavs: int = 120,
+                              max_num_psds: int = 10000,
+                              cache_dir: str | pathlib.Path | None = None,
+                              cache_max_size: int | None = None,
+                              freq_range: tuple[float, float] = DEFAULT_FREQ_RANGE,
+                              rows: slice | np.ndarray | None = None,
+                              normalize: str = 'ref',
+                              threshold: str | float | int = 'half-otsu',
+                              ) -> tuple[np.ndarray, np.ndarray, int, list[int]]:
+    """Calculate :math:`\text{Song }D_{KL}` metric
+    between a bird whose model was saved by ``save_model``, used as the reference,
+    and one or more birds compared with it.
+
+    Parameters
+    ----------
+    model_path : str, pathlib.Path
+        Path to .zarr file where model of reference was saved.
+    compare_paths : list
+        Of str or pathlib.Path, paths to data from each bird
+        that should be compared with reference.
+        Each is either a path to a directory with .wav files of songs,
+        or a path to a .songdkl.zarr file generated by songdkl prep.
+    k_compares : list
+        Of int, number of syllable classes in song of each bird
+        compared with reference. Must be the same length as ``compare_paths``.
+    name : str
+        Name of model. Default is 'model'.
+    max_wavs : int
+        Maximum number of wav files to use. Default is 120.
+    max_num_psds : int
+        Maximum number of power spectral densities (PSDs) to calculate.
+        Default is 10000.
+    cache_dir : str, pathlib.Path
+        Directory where PSDs prepared from .wav files are cached.
+        Default is None, in which case the environment variable
+        ``SONGDKL_CACHE_DIR`` is used if set, and otherwise no cache is used.
+        See ``songdkl.load.load_or_prep``.
+    cache_max_size : int
+        Maximum size of the cache in bytes.
+        Default is None, in which case
+        ``songdkl.cache.DEFAULT_CACHE_MAX_SIZE`` is used.
+    freq_range : tuple
+        Of two numbers, the lowest and highest frequency in Hz
+        of PSDs computed from syllables, when preparing
+        PSDs from .wav files. Default is (600, 16000).
+    rows : slice, numpy.ndarray
+        Rows of PSDs to use from each bird compared with reference.
+        Default is None, in which case all rows are used.
+        See ``songdkl.load.load``.
+    normalize : str
+        One of {'pair', 'ref', 'all'}.
+        Default is 'ref'. See ``calculate_from_model``.
+    threshold : str, float
+        Method used to find the threshold that segments syllables,
+        when preparing PSDs from .wav files, or a number to use as the threshold.
+        Default is 'half-otsu'. See ``songdkl.load.load_or_prep``.
+
+    Returns
+    -------
+    DKL_PQ : numpy.ndarray
+    DKL_QP : numpy.ndarray
+    n_psds_ref : int
+    n_psds_compare : list
+        See ``calculate_from_model``.
+    """
+    logger.log(
+        msg=f'Loading model "{name}" from: {model_path}',
+        level=logging.INFO
+    )
+    model = load_model(model_path, name)
+    dtype = model.basis_set.dtype.name
+
+    segedpsds_compares = []
+    for compare_path in compare_paths:
+        logger.log(
+            msg=f'Getting PSDs from compare_path: {compare_path}',
+            level=logging.INFO
+        )
+        segedpsds_compares.append(
+            load_or_prep(compare_path, max_wavs, max_num_psds, cache_dir, cache_max_size, freq_range,
+                         rows, lazy=True, dtype=dtype, threshold=threshold)
+        )
+    return calculate_from_model(model, segedpsds_compares, k_compares, normalize)
@@ -1,21 +1,212 @@
 """functions to estimate the number of syllables in a bird's song"""
 from __future__ import annotations
-import dataclasses
+import concurrent.futures
+import contextlib
 import logging
+import os
 import pathlib
+from typing import Callable
 
 import numpy as np
 import rich.progress
 from sklearn.mixture import GaussianMixture
-import scipy.spatial
 
-from .constants import DefaultGaussianMixtureKwargs, DEFAULT_GMM_KWARGS
+from .constants import DEFAULT_FREQ_RANGE, DEFAULT_GMM_KWARGS, DTYPES
 from .load import load_or_prep
+from .distance import distances_to_basis
+from .songdkl import _validate_gmm_kwargs, get_basis_set
 
 
 logger = logging.getLogger(__name__)
 
 
+BACKENDS = ('threads', 'processes')
+SEARCHES = ('exhaustive', 'early-stop')
+
+
+def _split_component(gmm: GaussianMixture, X: np.ndarray) -> dict:
+    """Get parameters to initialize a Gaussian Mixture Model
+    with one more component than ``gmm``,
+    by splitting in two the component of ``gmm`` that accounts
+    for the most variance, i.e., the component with the largest
+    weight times the trace of its covariance.
+
+    The two new components have the same covariance as the component they
+    are split from, half of its weight, and means that are moved
+    in opposite directions along its principal axis,
+    by half of the standard deviation along that axis.
+
+    Parameters
+    ----------
+    gmm : sklearn.mixture.GaussianMixture
+        A fit Gaussian Mixture Model.
+    X : numpy.ndarray
+        The data that ``gmm`` was fit to.
+
+    Returns
+    -------
+    init_kwargs : dict
+        With keys 'weights_init', 'means_init', and 'precisions_init',
+        that can be passed to ``sklearn.mixture.GaussianMixture``.
+    """
+    n_features = gmm.means_.shape[1]
+    if gmm.covariance_type == 'full':
+        covariances = gmm.covariances_
+    elif gmm.covariance_type == 'tied':
+        covariances = np.repeat(gmm.covariances_[np.newaxis, ...], gmm.n_components, axis=0)
+    elif gmm.covariance_type == 'diag':
+        covariances = np.stack([np.diag(cov) for cov in gmm.covariances_])
+    elif gmm.covariance_type == 'spherical':
+        covariances = gmm.covariances_[:, np.newaxis, np.newaxis] * np.eye(n_features)
+
+    # weighting by the mixture weights means that for 'tied' covariance,
+    # where all components have the same variance, we split the one with the most weight
+    split_ind = np.argmax(np.trace(covariances, axis1=1, axis2=2) * gmm.weights_)
+
+    cov = covariances[split_ind]
+    if gmm.covariance_type == 'spherical':
+        # variance is the same along every axis, so use the data to find a principal axis
+        X_component = X[gmm.predict(X) == split_ind]
+        if len(X_component) > 1:
+            cov = np.cov(X_component, rowvar=False)
+    eigvals, eigvecs = np.linalg.eigh(cov)
+    offset = 0.5 * np.sqrt(max(eigvals[-1], 0.)) * eigvecs[:, -1]
+
+    mean = gmm.means_[split_ind]
+    means_init = np.concatenate(
+        [np.delete(gmm.means_, split_ind, axis=0), [mean - offset, mean + offset]]
+    )
+    weight = gmm.weights_[split_ind]
+    weights_init = np.concatenate(
+        [np.delete(gmm.weights_, split_ind), [weight / 2, weight / 2]]
+    )
+    weights_init /= weights_init.sum()  # guard against round-off
+    if gmm.covariance_type == 'tied':
+        precisions_init = gmm.precisions_
+    else:
+        precision = gmm.precisions_[split_ind]
+        precisions_init = np.concatenate(
+            [np.delete(gmm.precisions_, split_ind, axis=0), [precision, precision]]
+        )
+    return dict(weights_init=weights_init, means_init=means_init, precisions_init=precisions_init)
+
+
+def _fit_gmm_bic(n_components: int,
+                 train: np.ndarray,
+                 val: np.ndarray,
+                 gmm_kwargs: dict,
+                 init_from: GaussianMixture | None = None,
+                 return_model: bool = False) -> tuple[float, GaussianMixture | None]:
+    """Fit a Gaussian Mixture Model with ``n_components`` to ``train``,
+    and return the Bayesian Information Criterion computed on ``val``,
+    along with the model if ``return_model`` is True.
+
+    If ``init_from`` is a Gaussian Mixture Model fit to ``train``
+    with one fewer component, the model is initialized by
+    splitting one of its components (see ``_split_component``),
+    and only one initialization is performed.
+    """
+    if init_from is not None:
+        gmm_kwargs = {
+            **gmm_kwargs,
+            **_split_component(init_from, train),
+            'n_init': 1,
+            # parameters are specified by split, so avoid running k-means we don't need
+            'init_params': 'random',
+        }
+    gmm = GaussianMixture(n_components=n_components, **gmm_kwargs)
+    gmm.fit(train)
+    return gmm.bic(val), gmm if return_model else None
+
+
+def _get_fit_seeds(random_state, n_fits: int) -> list:
+    """Get the value for ``random_state`` to use with each fit,
+    so that results do not depend on the order fits are run in.
+
+    If ``random_state`` is an int, it is used for every fit,
+    which gives the same results as fitting sequentially.
+    Otherwise (None or a ``numpy.random.RandomState``),
+    a seed is drawn for each fit before any fits are run.
+    """
+    if isinstance(random_state, (int, np.integer)):
+        return [random_state] * n_fits
+    rng = random_state if isinstance(random_state, np.random.RandomState) else np.random.RandomState(random_state)
+    return [int(seed) for seed in rng.randint(np.iinfo(np.int32).max, size=n_fits)]
+
+
+def _sweep_bics(n_components_list: list[int],
+                folds: list[tuple[np.ndarray, np.ndarray]],
+                task_gmm_kwargs: dict,
+                executor: concurrent.futures.Executor | None = None,
+                advance: Callable | None = None,
+                init_from: list[GaussianMixture] | None = None,
+                return_models: bool = False) -> tuple[list[float], list[GaussianMixture] | None]:
+    """Compute the BIC for each number of components in ``n_components_list``,
+    averaged across ``folds``, a list of (train, validation) tuples.
+
+    Each (number of components, fold) pair is an independent fit,
+    that uses the keyword arguments in ``task_gmm_kwargs``
+    for that pair. If an ``executor`` is specified,
+    the fits are run in parallel on it.
+    ``advance`` is called after each fit, to update progress.
+
+    When warm starting, ``n_components_list`` should contain only one
+    number of components, and ``init_from`` should be a list
+    of the models fit to each fold with one fewer component.
+    If ``return_models`` is True, the models fit to each fold
+    with the last number of components are returned,
+    so they can be used to warm start the next fits.
+    """
+    tasks = [
+        (n_components, fold_ind)
+        for n_components in n_components_list
+        for fold_ind in range(len(folds))
+    ]
+
+    def _task_args(task):
+        n_components, fold_ind = task
+        fold_init_from = init_from[fold_ind] if init_from is not None else None
+        return (n_components, *folds[fold_ind], task_gmm_kwargs[task], fold_init_from, return_models)
+
+    fold_results = {}
+    if executor is None:
+        for task in tasks:
+            fold_results[task] = _fit_gmm_bic(*_task_args(task))
+            if advance:
+                advance()
+    else:
+        future_to_task = {
+            executor.submit(_fit_gmm_bic, *_task_args(task)): task
+            for task in tasks
+        }
+        for future in concurrent.futures.as_completed(future_to_task):
+            fold_results[future_to_task[future]] = future.result()
+            if advance:
+                advance()
+
+    bics = [
+        np.mean([fold_results[(n_components, fold_ind)][0] for fold_ind in range(len(folds))])
+        for n_components in n_components_list
+    ]
+    if return_models:
+        models = [fold_results[(n_components_list[-1], fold_ind)][1] for fold_ind in range(len(folds))]
+    else:
+        models = None
+    return bics, models
+
+
+def _find_early_stop(bics: list[float], patience: int) -> int | None:
+    """Find the index of the first BIC value where the BIC
+    has risen for ``patience`` consecutive numbers of components.
+    Returns None if that never happens."""
+    n_rises = 0
+    for ind in range(1, len(bics)):
+        n_rises = n_rises + 1 if bics[ind] > bics[ind - 1] else 0
+        if n_rises >= patience:
+            return ind
+    return None
+
+
 def numsyls(psds_ref: np.ndarray,
             n_basis: int = 50,
             basis: str = 'first',
@@ -23,7 +214,14 @@ def numsyls(psds_ref: np.ndarray,
             max_components: int = 22,
             n_splits: int = 1,
             gmm_kwargs: DEFAULT_GMM_KWARGS | dict = DEFAULT_GMM_KWARGS,
-            ) -> int:
+            n_jobs: int = 1,
+            backend: str = 'processes',
+            search: str = 'exhaustive',
+            patience: int = 3,
+            return_bics: bool = False,
+            warm_start: bool = False,
+            dtype: str = 'float64',
+            ) -> int | tuple[int, dict[int, float]]:
     """Determine number of syllable classes in a bird's song.
 
     Takes an array of PSDs from segmented syllables, fits them
@@ -33,9 +231,13 @@ def numsyls(psds_ref: np.ndarray,
 
     Parameters
     ----------
-    psds_ref : numpy.ndarray
+    psds_ref : numpy.ndarray, zarr.Array
         PSDs of segmented syllables,
         returned by ``songdkl.songdkl.convert_syls_to_psd``.
+        Can be an array that is read lazily from disk,
+        e.g. returned by ``songdkl.load.load`` with ``lazy=True``,
+        in which case PSDs are read in chunks, and only the distances
+        to the basis set are held in memory.
     n_basis : int
         Number of syllables to use as basis set. Default is 50.
     basis : str
@@ -66,12 +268,57 @@ def numsyls(psds_ref: np.ndarray,
         as one of the ``gmm_kwargs`` will raise an
         error since this function searches for the best
         value for ``n_components``.
+    n_jobs : int
+        Number of workers used to fit models in parallel.
+        Each combination of number of components and split
+        is fit independently. Default is 1, in which case
+        models are fit sequentially. If -1, use all CPUs.
+    backend : str
+        One of {'threads', 'processes'}.
+        Whether to fit models on a pool of threads or processes,
+        when ``n_jobs`` is greater than 1. Default is 'processes'.
+        Each fit uses the same ``random_state`` from ``gmm_kwargs``,
+        so results do not depend on ``n_jobs`` or ``backend``.
+    search : str
+        One of {'exhaustive', 'early-stop'}.
+        If 'exhaustive', fit models with every number of components
+        from ``min_components`` up to ``max_components``.
+        If 'early-stop', fit models with an increasing number of components,
+        but stop once the BIC has risen for ``patience`` consecutive
+        numbers of components, since the minimum has then
+        most likely already been found. Default is 'exhaustive'.
+    patience : int
+        Number of consecutive numbers of components for which the BIC
+        must rise before stopping, when ``search`` is 'early-stop'.
+        Default is 3.
+    return_bics : bool
+        If True, return a ``dict`` mapping each number of components
+        that was evaluated to its BIC, along with ``n_syls``.
+        Default is False.
+    warm_start : bool
+        If True, initialize each model from the model fit
+        with one fewer component, by splitting the component
+        that accounts for the most variance in two, instead of initializing
+        from scratch with ``n_init`` runs of k-means.
+        This requires far fewer EM iterations and initializations,
+        but models must then be fit one number of components at a time,
+        so when ``n_jobs`` is greater than 1 only the splits
+        are fit in parallel. Default is False.
+    dtype : str
+        Data type of PSDs, distances and similarities,
+        one of {'float64', 'float32'}.
+        Using 'float32' halves the memory used,
+        but results can differ slightly from those computed with 'float64'.
+        Default is 'float64'.
 
     Returns
     -------
     n_syls : int
         The number of components that gave the minimum
         Bayesian Information Criterion, plus two.
+    bics : dict
+        Mapping number of components to the BIC for that number.
+        Only returned if ``return_bics`` is True.
 
     Notes
     -----
@@ -83,62 +330,122 @@ def numsyls(psds_ref: np.ndarray,
     human assessment or BIC values
     computed without splits.
     """
-    if isinstance(gmm_kwargs, DefaultGaussianMixtureKwargs):
-        gmm_kwargs = dataclasses.asdict(gmm_kwargs)
-    elif isinstance(gmm_kwargs, dict):
-        pass
-    else:
-        raise TypeError(
-            '`gmm_kwargs` must be a dict or DefaultGaussianMixtureKwargs,'
-            f'but was type: {type(gmm_kwargs)}'
+    gmm_kwargs = _validate_gmm_kwargs(gmm_kwargs)
+    if backend not in BACKENDS:
+        raise ValueError(
+            f'`backend` must be one of {BACKENDS}, but was: {backend}'
+        )
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+    elif n_jobs < 1:
+        raise ValueError(
+            f'`n_jobs` must be a positive integer or -1, but was: {n_jobs}'
+        )
+    if search not in SEARCHES:
+        raise ValueError(
+            f'`search` must be one of {SEARCHES}, but was: {search}'
         )
-    if 'n_components' in gmm_kwargs:
+    if patience < 1:
         raise ValueError(
-            "`gmm_kwargs` has key `n_components` but that argument to GaussianMixture "
-            "are the `k_ref` and `k_compare` arguments to this function."
+            f'`patience` must be a positive integer, but was: {patience}'
+        )
+    if dtype not in DTYPES:
+        raise ValueError(
+            f'`dtype` must be one of {DTYPES}, but was: {dtype}'
         )
 
     logger.log(
         msg=(f'Identifying best number of components to describe the data, psds_ref (shape: {psds_ref.shape}), '
              f'with parameters n_basis={n_basis}, basis={basis}, '
-             f'min_components={min_components}, max_components={max_components}, n_splits={n_splits}.'),
+             f'min_components={min_components}, max_components={max_components}, n_splits={n_splits}, '
+             f'search={search}, warm_start={warm_start}, dtype={dtype}.'),
         level=logging.INFO
     )
 
-    if basis == 'first':
-        # select the first `n_basis` syllables of the reference song as the basis set
-        basis_set = psds_ref[:n_basis]
-    elif basis == 'random':
-        # select a random set of `n_basis` syllables as the basis set
-        basis_set = [psds_ref[ind]
-                     for ind in np.random.randint(0, len(psds_ref), size=n_basis)]
+    basis_set = get_basis_set(psds_ref, n_basis, basis).astype(dtype, copy=False)
 
     logger.log(
         msg=f'Computing distances',
         level=logging.INFO
     )
 
-    D = scipy.spatial.distance.cdist(psds_ref, basis_set, 'sqeuclidean')
-    s = 1 - D / np.max(D) * 1000
-    bics = []
+    D = distances_to_basis(psds_ref, basis_set)
+    # similarities are converted to float64 if they are not already,
+    # because fitting GMMs with float32 can fail when covariances are not positive definite
+    s = (1 - D / np.max(D) * 1000).astype(np.float64, copy=False)
+    if n_splits > 1:
+        splits = np.array_split(s, n_splits)
+        folds = [
+            (np.concatenate([split for ind, split in enumerate(splits) if ind != split_ind]), splits[split_ind])
+            for split_ind in range(len(splits))
+        ]
+    else:
+        folds = [(s, s)]
     n_components_list = list(range(min_components, max_components))
-    for n_components in rich.progress.track(n_components_list, 'Fitting components'):
-        if n_splits > 1:
-            split_bics = []
-            splits = np.array_split(s, n_splits)
-            for split_ind in range(len(splits)):
-                train_split = np.concatenate([split for ind, split in enumerate(splits) if ind != split_ind])
-                val_split = splits[split_ind]
-                gmm = GaussianMixture(n_components=n_components, **gmm_kwargs)
-                gmm.fit(train_split)
-                split_bics.append(gmm.bic(val_split))
-            bics.append(np.mean(split_bics))
-        else:
-            gmm = GaussianMixture(n_components=n_components, **gmm_kwargs)
-            gmm.fit(np.array(s))
-            bics.append(gmm.bic(np.array(s)))
+
+    # get all seeds before fitting, so results don't depend on how many fits we end up running
+    tasks = [
+        (n_components, fold_ind)
+        for n_components in n_components_list
+        for fold_ind in range(len(folds))
+    ]
+    seeds = _get_fit_seeds(gmm_kwargs.get('random_state'), len(tasks))
+    task_gmm_kwargs = {
+        task: {**gmm_kwargs, 'random_state': seed}
+        for task, seed in zip(tasks, seeds)
+    }
+
+    if n_jobs == 1:
+        executor = None
+    elif backend == 'threads':
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=n_jobs)
+    else:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=n_jobs)
+
+    with executor or contextlib.nullcontext(), rich.progress.Progress() as progress:
+        progress_task = progress.add_task('Fitting components', total=len(tasks))
+
+        def advance():
+            progress.advance(progress_task)
+
+        if warm_start:
+            # each model is initialized from the previous one, so we fit one number of components at a time
+            wave_size = 1
+        elif search == 'exhaustive':
+            wave_size = len(n_components_list)
+        elif search == 'early-stop':
+            # fit as many numbers of components at a time as we can in parallel
+            wave_size = max(1, n_jobs // len(folds))
+
+        evaluated, bics = [], []
+        models = None
+        for wave_start in range(0, len(n_components_list), wave_size):
+            wave = n_components_list[wave_start:wave_start + wave_size]
+            evaluated.extend(wave)
+            wave_bics, models = _sweep_bics(wave, folds, task_gmm_kwargs, executor, advance,
+                                            init_from=models, return_models=warm_start)
+            bics.extend(wave_bics)
+            if search == 'early-stop':
+                stop_ind = _find_early_stop(bics, patience)
+                if stop_ind is not None:
+                    # drop any values past where we would have stopped fitting one at a time,
+                    # so results don't depend on ``n_jobs``
+                    evaluated, bics = evaluated[:stop_ind + 1], bics[:stop_ind + 1]
+                    logger.log(
+                        msg=f'BIC rose for {patience} consecutive numbers of components, '
+                            f'stopping search at {evaluated[-1]} components.',
+                        level=logging.INFO
+                    )
+                    break
+
+    logger.log(
+        msg=f'BIC for each number of components: {dict(zip(evaluated, np.round(bics, decimals=3)))}',
+        level=logging.INFO
+    )
     lowest_bic_ind = np.argmin(bics)
-    n_syls = n_components_list[lowest_bic_ind]
+    n_syls = evaluated[lowest_bic_ind]
+    if return_bics:
+        return n_syls, dict(zip(evaluated, bics))
     return n_syls
 
 
@@ -151,7 +458,19 @@ def numsyls_from_path(ref_path: str | pathlib.Path,
                       max_components: int = 22,
                       n_splits: int = 1,
                       gmm_kwargs: DEFAULT_GMM_KWARGS | dict = DEFAULT_GMM_KWARGS,
-                      ) -> int:
+                      n_jobs: int = 1,
+                      backend: str = 'processes',
+                      search: str = 'exhaustive',
+                      patience: int = 3,
+                      return_bics: bool = False,
+                      warm_start: bool = False,
+                      cache_dir: str | pathlib.Path | None = None,
+                      cache_max_size: int | None = None,
+                      freq_range: tuple[float, float] = DEFAULT_FREQ_RANGE,
+                      rows: slice | np.ndarray | None = None,
+                      dtype: str = 'float64',
+                      threshold: str | float | int = 'half-otsu',
+                      ) -> int | tuple[int, dict[int, float]]:
     """Determine number of syllable classes in a bird's song,
     by fitting Gaussian Mixture Models to PSDs of segmented
     syllable renditions, and selecting the number of components
@@ -197,6 +516,59 @@ def numsyls_from_path(ref_path: str | pathlib.Path,
         as one of the ``gmm_kwargs`` will raise an
         error since this function searches for the best
         value for ``n_components``.
+    n_jobs : int
+        Number of workers used to fit models in parallel.
+        Default is 1, in which case models are fit sequentially.
+        If -1, use all CPUs.
+    backend : str
+        One of {'threads', 'processes'}.
+        Whether to fit models on a pool of threads or processes,
+        when ``n_jobs`` is greater than 1. Default is 'processes'.
+    search : str
+        One of {'exhaustive', 'early-stop'}.
+        If 'early-stop', stop fitting models once the BIC has risen
+        for ``patience`` consecutive numbers of components.
+        Default is 'exhaustive'.
+    patience : int
+        Number of consecutive numbers of components for which the BIC
+        must rise before stopping, when ``search`` is 'early-stop'.
+        Default is 3.
+    return_bics : bool
+        If True, also return a ``dict`` mapping each number of components
+        that was evaluated to its BIC. Default is False.
+    warm_start : bool
+        If True, initialize each model from the model fit
+        with one fewer component, by splitting the component
+        that accounts for the most variance in two. Default is False.
+    cache_dir : str, pathlib.Path
+        Directory where PSDs prepared from .wav files are cached.
+        Default is None, in which case the environment variable
+        ``SONGDKL_CACHE_DIR`` is used if set, and otherwise no cache is used.
+        See ``songdkl.load.load_or_prep``.
+    cache_max_size : int
+        Maximum size of the cache in bytes.
+        Default is None, in which case
+        ``songdkl.cache.DEFAULT_CACHE_MAX_SIZE`` is used.
+    freq_range : tuple
+        Of two numbers, the lowest and highest frequency in Hz
+        of PSDs computed from syllables, when preparing
+        PSDs from .wav files. Default is (600, 16000).
+    rows : slice, numpy.ndarray
+        Rows of PSDs to use, either a slice,
+        e.g. ``slice(0, 20000)`` or ``slice(None, None, 10)``,
+        or an array of row indices, e.g. returned by ``songdkl.load.subsample_rows``.
+        Default is None, in which case all rows are used.
+        See ``songdkl.load.load``.
+    dtype : str
+        Data type of PSDs, distances and similarities,
+        one of {'float64', 'float32'}.
+        Using 'float32' halves the memory used,
+        but results can differ slightly from those computed with 'float64'.
+        Default is 'float64'.
+    threshold : str, float
+        Method used to find the threshold that segments syllables,
+        when preparing PSDs from .wav files, or a number to use as the threshold.
+        Default is 'half-otsu'. See ``songdkl.load.load_or_prep``.
 
     Returns
     -------
@@ -205,12 +577,17 @@ def numsyls_from_path(ref_path: str | pathlib.Path,
         the number of components
         that produced the fit Gaussian Mixture Model
         with the lowest Bayesian Information Criterion.
+    bics : dict
+        Mapping number of components to the BIC for that number.
+        Only returned if ``return_bics`` is True.
     """
     logger.log(
         msg=f'Getting PSDs from ref_path: {ref_path}',
         level=logging.INFO
     )
-    psds_ref = load_or_prep(ref_path, max_wavs, max_num_psds)
+    # PSDs saved in .zarr files are read lazily, in chunks, so they are never all in memory
+    psds_ref = load_or_prep(ref_path, max_wavs, max_num_psds, cache_dir, cache_max_size, freq_range,
+                            rows, lazy=True, dtype=dtype, threshold=threshold)
 
-    sylno_bic = numsyls(psds_ref, n_basis, basis, min_components, max_components, n_splits, gmm_kwargs)
-    return sylno_bic
+    return numsyls(psds_ref, n_basis, basis, min_components, max_components, n_splits, gmm_kwargs,
+                   n_jobs, backend, search, patience, return_bics, warm_start, dtype)
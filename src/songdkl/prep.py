@@ -1,28 +1,51 @@
 from __future__ import annotations
+import concurrent.futures
 import copy
+import dataclasses
 import logging
+import os
 import pathlib
+import time
 
 import crowsetta
+import numcodecs
 import numpy as np
-import rich.progress
 import zarr
 
-from .syllables import get_all_syls, convert_syl_to_psd, SyllablesFromWav
+from .__about__ import __version__
+from .constants import DEFAULT_FREQ_RANGE, DTYPES, MODELS_GROUP
+from .syllables import (_pooled_method, dask_scheduler, iter_syls_and_psds, resolve_threshold, SCHEDULERS,
+                        SyllablesFromWav)
 
 
 logger = logging.getLogger(__name__)
 
 
+# number of rows of PSDs written to a .zarr file at a time, and in each chunk of the array
+PSD_CHUNK_ROWS = 256
+
+# version of the layout of .songdkl.zarr files; see ``prep_and_save`` for a description
+DATASET_FORMAT_VERSION = 1
+
+# arrays saved in a .songdkl.zarr file alongside PSDs, with one element for each row of PSDs
+ROW_METADATA = ('wav_index', 'onset_sample', 'offset_sample', 'rate')
+
+
 def prep(dir_path: str | pathlib.Path,
          max_wavs: int = 120,
-         max_num_psds: int = 10000) -> tuple[list[SyllablesFromWav], np.ndarray]:
+         max_num_psds: int = 10000,
+         freq_range: tuple[float, float] = DEFAULT_FREQ_RANGE,
+         dtype: str = 'float64',
+         keep_syls: bool = True,
+         threshold: str | float | int = 'half-otsu') -> tuple[list[SyllablesFromWav], np.ndarray]:
     """Prepare dataset for use with either
     ``songdkl.numsyls`` or ``songdkl.calculate``.
 
     For a given directory, load all .wav files,
     segment into syllables, compute PSDs for each segment,
     and return as an array.
+    Files are processed in batches, and once ``max_num_psds``
+    PSDs have been computed, no more files are read.
 
     Parameters
     ----------
@@ -31,10 +54,33 @@ def prep(dir_path: str | pathlib.Path,
         Maximum number of .wav files to use. Default is 120.
     max_num_psds : int
         Maximum number of PSDs to compute. Default is 10k.
+    freq_range : tuple
+        Of two numbers, the lowest and highest frequency in Hz
+        of PSDs computed from syllables. Default is (600, 16000).
+    dtype : str
+        Data type of returned PSDs, one of {'float64', 'float32'}.
+        PSDs from each .wav file are converted as they are computed,
+        so that PSDs from all files are never held in memory as 'float64'.
+        Default is 'float64'.
+    keep_syls : bool
+        If True, the default, return the audio of each syllable
+        as the ``syls`` attribute of each ``SyllablesFromWav``.
+        If False, ``syls`` is None, so that the audio of all syllables
+        is not held in memory when only the PSDs are needed.
+    threshold : str, float, int
+        Thresholding method used to segment .wav files, one of
+        {'half-otsu', 'half-average', 'pooled-half-otsu', 'pooled-half-average'},
+        or a float or int value. The 'pooled-' methods compute one threshold
+        for all the .wav files used. See ``songdkl.syllables.iter_syls_and_psds``.
+        Default is 'half-otsu'.
     """
+    if dtype not in DTYPES:
+        raise ValueError(
+            f'`dtype` must be one of {DTYPES}, but was: {dtype}'
+        )
     logger.log(
         msg=f'Preparing dataset from dir_path: {dir_path}, '
-            f'with max_wavs={max_wavs} and max_num_psds={max_num_psds}.',
+            f'with max_wavs={max_wavs}, max_num_psds={max_num_psds}, and freq_range={freq_range}.',
         level=logging.INFO
     )
     dir_path = pathlib.Path(dir_path)
@@ -42,24 +88,430 @@ def prep(dir_path: str | pathlib.Path,
     wav_paths = sorted(pathlib.Path(dir_path).glob('*.wav'))
     if max_wavs:
         wav_paths = wav_paths[:max_wavs]
+    syls_from_wavs, psds_per_wav = [], []
+    for syls_from_wav, psds in iter_syls_and_psds(wav_paths, max_num_psds, freq_range, keep_syls=keep_syls,
+                                                  threshold=threshold):
+        syls_from_wavs.append(syls_from_wav)
+        psds_per_wav.append(psds.astype(dtype, copy=False))
+    if psds_per_wav:
+        segedpsds = np.concatenate(psds_per_wav)
+    else:
+        segedpsds = np.array([], dtype=dtype)
+    return syls_from_wavs, segedpsds
+
+
+def _compressor() -> numcodecs.abc.Codec:
+    """Compressor for arrays in .songdkl.zarr files.
+    Byte shuffling groups together the exponent bytes of the floating point PSDs,
+    that zstd then compresses well."""
+    return numcodecs.Blosc(cname='zstd', clevel=5, shuffle=numcodecs.Blosc.SHUFFLE)
+
+
+class _DatasetWriter:
+    """Helper class that writes PSDs and metadata for each row
+    to a .songdkl.zarr file, as they are computed,
+    in chunks of ``PSD_CHUNK_ROWS`` rows,
+    so the whole dataset never needs to be held in memory.
+
+    If ``append`` is True, rows are appended to the dataset already saved in ``zarr_path``,
+    and PSDs are saved with the dtype of that dataset.
+    Otherwise any existing dataset is replaced.
+    """
+    def __init__(self,
+                 zarr_path: pathlib.Path,
+                 append: bool = False,
+                 dtype: str = 'float64',
+                 chunk_rows: int = PSD_CHUNK_ROWS):
+        self.chunk_rows = chunk_rows
+        self._buffer = {name: [] for name in ('psds',) + ROW_METADATA}
+        self._n_buffered = 0
+        if append:
+            self.root = zarr.open_group(str(zarr_path), mode='a')
+            self.dtype = self.root['psds'].dtype
+            # models saved with the dataset are no longer fit to the data once we add rows
+            if MODELS_GROUP in self.root:
+                del self.root[MODELS_GROUP]
+        else:
+            self.dtype = np.dtype(dtype)
+            self.root = zarr.open_group(str(zarr_path), mode='w')
+            for name in ROW_METADATA:
+                self.root.create_dataset(name, shape=(0,), chunks=(16 * chunk_rows,), dtype='int64',
+                                         compressor=_compressor())
+            # we don't know the number of frequency bins until we have PSDs
+            self.root.create_dataset('psds', shape=(0, 0), chunks=(chunk_rows, 1), dtype=self.dtype,
+                                     compressor=_compressor())
+
+    def append(self, psds: np.ndarray, wav_index: int, syls_from_wav: SyllablesFromWav) -> None:
+        """Append PSDs from one .wav file,
+        along with the index of the file, and the onsets, offsets, and sampling rate of syllables"""
+        self.append_rows(
+            psds,
+            wav_index=np.full(len(psds), wav_index),
+            onset_sample=np.array([slice_.start for slice_ in syls_from_wav.slices[:len(psds)]], dtype=int),
+            offset_sample=np.array([slice_.stop for slice_ in syls_from_wav.slices[:len(psds)]], dtype=int),
+            rate=np.full(len(psds), syls_from_wav.rate),
+        )
+
+    def append_rows(self, psds: np.ndarray, **row_metadata: np.ndarray) -> None:
+        """Append rows of PSDs and the metadata for each row"""
+        if len(psds) == 0:
+            return
+        self._buffer['psds'].append(psds.astype(self.dtype, copy=False))
+        for name in ROW_METADATA:
+            self._buffer[name].append(row_metadata[name])
+        self._n_buffered += len(psds)
+        if self._n_buffered >= self.chunk_rows:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._n_buffered == 0:
+            return
+        rows = {name: np.concatenate(arrs) for name, arrs in self._buffer.items()}
+        self._buffer = {name: [] for name in self._buffer}
+        self._n_buffered = 0
+        if self.root['psds'].shape[0] == 0 and self.root['psds'].shape[1] != rows['psds'].shape[1]:
+            # first PSDs, now we know the number of frequency bins
+            n_bins = rows['psds'].shape[1]
+            self.root.create_dataset('psds', shape=(0, n_bins), chunks=(self.chunk_rows, n_bins),
+                                     dtype=self.dtype, compressor=_compressor(), overwrite=True)
+        for name, arr in rows.items():
+            self.root[name].append(arr)
+
+    def close(self, **attrs) -> None:
+        """Write any remaining rows, then save ``attrs`` as attributes of the dataset"""
+        self.flush()
+        self.root.attrs.update(attrs)
+
+
+def _save_segmentation(syls: SyllablesFromWav,
+                       output_dir_path: pathlib.Path) -> crowsetta.Annotation:
+    """Helper function that saves segmentation of a .wav file
+    in a simple-seq annotation file, and returns the annotation"""
+    segments = []
+    for slice_ in syls.slices:
+        segment = crowsetta.Segment.from_keyword(
+            label='-',  # dummy label
+            onset_sample=slice_.start,
+            offset_sample=slice_.stop,
+            onset_s=np.around(slice_.start / syls.threshold, decimals=3),  # 3 because milliseconds
+            offset_s=np.around(slice_.stop / syls.threshold, decimals=3),
+        )
+        segments.append(segment)
+    seq = crowsetta.Sequence.from_segments(segments)
+    # save segments from each file in simple-seq format
+    annot_path = output_dir_path / f'{pathlib.Path(syls.wav_path).name}-threshold-{syls.threshold}'
+    simpleseq = crowsetta.formats.seq.SimpleSeq(labels=seq.labels, onsets_s=seq.onsets_s,
+                                                offsets_s=seq.offsets_s, annot_path=annot_path)
+    simpleseq.to_file(annot_path=annot_path)
+    return crowsetta.Annotation(seq=seq, annot_path=annot_path, notated_path=syls.wav_path)
+
+
+def _save_wavs(wav_paths: list[pathlib.Path],
+               output_dir_path: pathlib.Path,
+               writer: _DatasetWriter,
+               max_num_psds: int | None,
+               freq_range: tuple[float, float],
+               first_wav_index: int = 0,
+               n_workers: int | None = None,
+               scheduler: str | None = None,
+               partition_size: int | None = None,
+               threshold: str | float | int = 'half-otsu') -> tuple[list[crowsetta.Annotation], list[dict]]:
+    """Helper function that segments .wav files and computes PSDs one batch at a time,
+    writing PSDs with ``writer`` and saving segmentation as each .wav file is processed.
+    Syllable clips are never returned from the workers, only PSDs and slices, so memory use stays bounded.
+
+    Returns annotations and manifest entries for the .wav files that were used;
+    once ``max_num_psds`` is reached, no more .wav files are read."""
+    annots, entries = [], []
+    for wav_index, (syls_from_wav, psds) in enumerate(
+            iter_syls_and_psds(wav_paths, max_num_psds, freq_range, n_workers=n_workers, scheduler=scheduler,
+                               partition_size=partition_size, keep_syls=False, threshold=threshold),
+            start=first_wav_index
+    ):
+        writer.append(psds, wav_index, syls_from_wav)
+        annot = _save_segmentation(syls_from_wav, output_dir_path)
+        annots.append(annot)
+        entries.append(
+            dict(**_wav_stat(pathlib.Path(syls_from_wav.wav_path)),
+                 n_psds=len(psds),
+                 annot_path=pathlib.Path(annot.annot_path).name)
+        )
+    return annots, entries
+
+
+def _wav_stat(wav_path: pathlib.Path) -> dict:
+    """Helper function that gets the size and modification time of a .wav file,
+    used to detect whether it has changed since it was prepared"""
+    stat = wav_path.stat()
+    return dict(name=wav_path.name, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+
+
+def _dataset_attrs(freq_range: tuple[float, float],
+                   max_wavs: int | None,
+                   max_num_psds: int | None,
+                   dtype: str,
+                   entries: list[dict],
+                   threshold: str | float | int = 'half-otsu',
+                   threshold_value: float | int | None = None) -> dict:
+    """Helper function that gets the attributes saved with a dataset.
+    ``threshold`` is the thresholding method specified, and ``threshold_value``
+    is the value used for all .wav files, or None if a threshold was found for each file"""
+    return dict(
+        songdkl_version=__version__,
+        format_version=DATASET_FORMAT_VERSION,
+        freq_range=[float(freq) for freq in freq_range],
+        max_wavs=max_wavs,
+        max_num_psds=max_num_psds,
+        dtype=str(np.dtype(dtype)),
+        threshold=threshold,
+        threshold_value=threshold_value,
+        wavs=entries,
+    )
+
+
+def _read_attrs(zarr_path: pathlib.Path) -> dict | None:
+    """Helper function that reads the attributes of a dataset saved by ``prep_and_save``.
+    Returns None if there is no dataset, or if it was saved by an earlier version
+    as a single array without a manifest of .wav files"""
+    try:
+        root = zarr.open(str(zarr_path), mode='r')
+    except (FileNotFoundError, ValueError):  # zarr raises a ValueError if there is no array or group
+        return None
+    if not isinstance(root, zarr.Group) or 'wavs' not in root.attrs:
+        return None
+    return root.attrs.asdict()
+
+
+def _drop_rows(root: zarr.Group, keep_rows: np.ndarray, new_wav_index: np.ndarray) -> None:
+    """Helper function that removes rows from the arrays of a dataset in place,
+    one chunk of rows at a time, so the arrays are never read into memory all at once.
+
+    Kept rows are moved up to fill the gaps left by removed rows.
+    Each kept row moves to an index no greater than its own,
+    so a chunk is always read before any rows are written over it.
+    ``new_wav_index`` maps the ``wav_index`` of each kept row to its new value."""
+    n_rows = len(keep_rows)
+    for name in ('psds',) + ROW_METADATA:
+        arr = root[name]
+        block_rows = arr.chunks[0]
+        n_kept = 0
+        for start in range(0, n_rows, block_rows):
+            stop = min(start + block_rows, n_rows)
+            keep = keep_rows[start:stop]
+            if n_kept == start and keep.all():
+                # no rows removed yet, so these rows stay where they are
+                n_kept = stop
+                continue
+            if not keep.any():
+                continue
+            rows = arr.get_orthogonal_selection((np.flatnonzero(keep) + start,))
+            if name == 'wav_index':
+                rows = new_wav_index[rows]
+            arr[n_kept:n_kept + len(rows)] = rows
+            n_kept += len(rows)
+        arr.resize((n_kept,) + arr.shape[1:])
+
+
+def _update(dir_path: pathlib.Path,
+            output_dir_path: pathlib.Path,
+            max_wavs: int | None,
+            max_num_psds: int | None,
+            freq_range: tuple[float, float],
+            dtype: str,
+            n_workers: int | None = None,
+            scheduler: str | None = None,
+            partition_size: int | None = None,
+            threshold: str | float | int = 'half-otsu',
+            threshold_value: float | int | None = None) -> list[dict]:
+    """Helper function that updates a dataset prepared by ``prep_and_save``,
+    by removing PSDs and annotations from .wav files that were deleted or changed,
+    and then adding PSDs and annotations for .wav files that are new or changed.
+    If the dataset was segmented with one threshold for all .wav files, ``threshold_value``,
+    new .wav files are segmented with the same value.
+
+    Returns manifest entries for the .wav files that were added."""
+    zarr_path = output_dir_path / f'{dir_path.name}.songdkl.zarr'
+    annot_csv_path = output_dir_path / f'{dir_path.name}.annot.csv'
+    entries = zarr.open_group(str(zarr_path), mode='r').attrs['wavs']
+
+    wav_paths = {wav_path.name: wav_path for wav_path in sorted(dir_path.glob('*.wav'))}
+    kept, dropped = [], []
+    for entry in entries:
+        wav_path = wav_paths.get(entry['name'])
+        if wav_path is not None and _wav_stat(wav_path) == {k: entry[k] for k in ('name', 'size', 'mtime_ns')}:
+            kept.append(entry)
+        else:
+            dropped.append(entry)
+    kept_names = set(entry['name'] for entry in kept)
+    new_wav_paths = [wav_path for name, wav_path in wav_paths.items() if name not in kept_names]
+    if max_wavs:
+        new_wav_paths = new_wav_paths[:max(max_wavs - len(kept), 0)]
+    n_psds_kept = sum(entry['n_psds'] for entry in kept)
+    if max_num_psds:
+        max_num_psds_new = max_num_psds - n_psds_kept
+        if max_num_psds_new <= 0:
+            new_wav_paths = []
+    else:
+        max_num_psds_new = None
+
+    logger.log(
+        msg=f'Updating dataset from dir_path: {dir_path}. '
+            f'Keeping {len(kept)} .wav files, removing {len(dropped)}, and adding {len(new_wav_paths)}.',
+        level=logging.INFO
+    )
+    if not dropped and not new_wav_paths:
+        return []
 
     logger.log(
-        msg=f'Segmenting .wav files to get syllables',
+        msg=f'Saving syllable segmentation in annotation files and array to: {output_dir_path}',
         level=logging.INFO
     )
-    syls_from_wavs = get_all_syls(wav_paths)
+    dropped_names = set(entry['name'] for entry in dropped)
+    for entry in dropped:
+        (output_dir_path / entry['annot_path']).unlink(missing_ok=True)
+    annots = [
+        annot for annot in crowsetta.formats.seq.GenericSeq.from_file(annot_csv_path).annots
+        if pathlib.Path(annot.notated_path).name not in dropped_names
+    ]
+
+    if dropped:
+        # remove rows from dropped .wav files
+        keep_rows = np.repeat([entry['name'] in kept_names for entry in entries],
+                              [entry['n_psds'] for entry in entries])
+        # indices of kept .wav files change when we remove dropped ones
+        new_wav_index = np.cumsum([entry['name'] in kept_names for entry in entries]) - 1
+        _drop_rows(zarr.open_group(str(zarr_path), mode='r+'), keep_rows, new_wav_index)
+    writer = _DatasetWriter(zarr_path, append=True, dtype=dtype)
+    new_annots, new_entries = _save_wavs(new_wav_paths, output_dir_path, writer, max_num_psds_new, freq_range,
+                                         first_wav_index=len(kept), n_workers=n_workers, scheduler=scheduler,
+                                         partition_size=partition_size,
+                                         threshold=threshold if threshold_value is None else threshold_value)
+    writer.close(**_dataset_attrs(freq_range, max_wavs, max_num_psds, writer.dtype, kept + new_entries,
+                                  threshold, threshold_value))
+
+    generic_seq = crowsetta.formats.seq.GenericSeq(annots=annots + new_annots)
+    generic_seq.to_file(annot_path=annot_csv_path)
+    return new_entries
+
+
+@dataclasses.dataclass
+class PrepResult:
+    """Dataclass representing the result of
+    preparing a dataset from one directory with ``prep_and_save``.
+
+    Attributes
+    ----------
+    dir_path : pathlib.Path
+        Directory that the dataset was prepared from.
+    zarr_path : pathlib.Path
+        Path to .songdkl.zarr file where dataset was saved.
+    n_wavs : int
+        Number of .wav files that were prepared.
+        When a dataset is updated with ``incremental=True``,
+        only .wav files that were new or changed are counted.
+    n_psds : int
+        Number of PSDs computed from those .wav files.
+    seconds : float
+        Time taken to prepare the dataset, in seconds.
+    """
+    dir_path: pathlib.Path
+    zarr_path: pathlib.Path
+    n_wavs: int
+    n_psds: int
+    seconds: float
+
+    def throughput(self) -> str:
+        """Describe how quickly the dataset was prepared."""
+        # avoid dividing by zero when nothing needed to be prepared
+        seconds = max(self.seconds, 1e-9)
+        return (f'Prepared {self.n_wavs} .wav files and {self.n_psds} PSDs from dir_path: {self.dir_path} '
+                f'in {self.seconds:.1f} s ({self.n_wavs / seconds:.2f} .wav files/s, '
+                f'{self.n_psds / seconds:.1f} PSDs/s).')
+
+
+def _prep_and_save_dir(dir_path: pathlib.Path,
+                       output_dir_path: pathlib.Path,
+                       max_wavs: int | None,
+                       max_num_psds: int | None,
+                       incremental: bool,
+                       freq_range: tuple[float, float],
+                       dtype: str,
+                       n_workers: int | None = None,
+                       scheduler: str | None = None,
+                       partition_size: int | None = None,
+                       threshold: str | float | int = 'half-otsu') -> PrepResult:
+    """Helper function that prepares the dataset from one directory for ``prep_and_save``"""
+    tic = time.perf_counter()
+    zarr_path = output_dir_path / f'{dir_path.name}.songdkl.zarr'
+    if incremental:
+        attrs = _read_attrs(zarr_path)
+        if attrs is None:
+            logger.log(
+                msg=f'Did not find dataset with manifest from dir_path: {dir_path}, '
+                    f'will prepare entire dataset',
+                level=logging.INFO
+            )
+        elif attrs['freq_range'] != list(freq_range) or attrs['dtype'] != dtype:
+            logger.log(
+                msg=f'Dataset from dir_path: {dir_path} was prepared with '
+                    f'freq_range={attrs["freq_range"]} and dtype={attrs["dtype"]}, '
+                    f'not freq_range={freq_range} and dtype={dtype}, will prepare entire dataset',
+                level=logging.INFO
+            )
+        elif attrs.get('threshold', 'half-otsu') != threshold:
+            # datasets saved before the threshold was recorded were all segmented with 'half-otsu'
+            logger.log(
+                msg=f'Dataset from dir_path: {dir_path} was prepared with '
+                    f'threshold={attrs.get("threshold", "half-otsu")}, '
+                    f'not threshold={threshold}, will prepare entire dataset',
+                level=logging.INFO
+            )
+        else:
+            entries = _update(dir_path, output_dir_path, max_wavs, max_num_psds, freq_range, dtype, n_workers,
+                              scheduler, partition_size, threshold, attrs.get('threshold_value'))
+            return PrepResult(dir_path=dir_path, zarr_path=zarr_path, n_wavs=len(entries),
+                              n_psds=sum(entry['n_psds'] for entry in entries),
+                              seconds=time.perf_counter() - tic)
+
     logger.log(
-        msg=f'Computing PSDs from syllable segments',
+        msg=f'Preparing dataset from dir_path: {dir_path}, '
+            f'and saving syllable segmentation in annotation files and array to: {output_dir_path}',
         level=logging.INFO
     )
-    segedpsds = convert_syl_to_psd(syls_from_wavs, max_num_psds)
-    return syls_from_wavs, np.array(segedpsds)
+    wav_paths = sorted(dir_path.glob('*.wav'))
+    if max_wavs:
+        wav_paths = wav_paths[:max_wavs]
+    # compute a pooled threshold once here, so we can save it with the dataset
+    threshold_value = resolve_threshold(wav_paths, threshold) if wav_paths else threshold
+    if isinstance(threshold_value, str):
+        # a threshold is found for each .wav file
+        threshold_value = None
+    writer = _DatasetWriter(zarr_path, dtype=dtype)
+    annots, entries = _save_wavs(wav_paths, output_dir_path, writer, max_num_psds, freq_range,
+                                 n_workers=n_workers, scheduler=scheduler, partition_size=partition_size,
+                                 threshold=threshold if threshold_value is None else threshold_value)
+    writer.close(**_dataset_attrs(freq_range, max_wavs, max_num_psds, dtype, entries, threshold, threshold_value))
+
+    # save segments from all files in generic-seq format
+    generic_seq = crowsetta.formats.seq.GenericSeq(annots=annots)
+    generic_seq.to_file(
+        annot_path=output_dir_path / f'{dir_path.name}.annot.csv'
+    )
+    return PrepResult(dir_path=dir_path, zarr_path=zarr_path, n_wavs=len(entries),
+                      n_psds=sum(entry['n_psds'] for entry in entries), seconds=time.perf_counter() - tic)
 
 
 def prep_and_save(dir_path: str | pathlib.Path | list[str | pathlib.Path],
                   output_dir_path: str | pathlib.Path | list[str | pathlib.Path] | None = None,
                   max_wavs: int = 120,
-                  max_num_psds: int = 10000) -> None:
+                  max_num_psds: int = 10000,
+                  incremental: bool = False,
+                  freq_range: tuple[float, float] = DEFAULT_FREQ_RANGE,
+                  dtype: str = 'float64',
+                  n_jobs: int | None = None,
+                  scheduler: str | None = None,
+                  partition_size: int | None = None,
+                  threshold: str | float | int = 'half-otsu') -> list[PrepResult]:
     """Prepare dataset for use with either
     ``songdkl.numsyls`` or ``songdkl.calculate``.
 
@@ -69,6 +521,23 @@ def prep_and_save(dir_path: str | pathlib.Path | list[str | pathlib.Path],
     and then save resulting set of PSDs,
     persisting to disk with ``zarr``.
 
+    The dataset is saved as a ``zarr`` group in a .songdkl.zarr file, with these arrays:
+    ``psds``, with one row for each syllable,
+    chunked by rows and compressed with zstd,
+    so that subsets of rows can be read without reading the whole array;
+    and ``wav_index``, ``onset_sample``, ``offset_sample``, and ``rate``,
+    with one element for each row of ``psds``: the index of the .wav file
+    the syllable came from, its onset and offset in samples, and the sampling rate.
+    The attributes of the group record the version of songdkl,
+    the parameters used to prepare the dataset, including the threshold
+    used to segment all the .wav files if it was pooled, and a manifest of .wav files,
+    with the size and modification time of each .wav file,
+    and the number of rows of PSDs it contributed.
+    If ``incremental`` is True and a dataset was already
+    prepared from a directory, the manifest is used to update it:
+    rows and annotations from .wav files that were deleted or changed are removed,
+    and only .wav files that are new or changed are prepared and appended.
+
     Parameters
     ----------
     dir_path : str, pathlib.Path, list of str or pathlib.Path
@@ -79,7 +548,75 @@ def prep_and_save(dir_path: str | pathlib.Path | list[str | pathlib.Path],
         Maximum number of .wav files to use. Default is 120.
     max_num_psds : int
         Maximum number of PSDs to compute. Default is 10k.
+    incremental : bool
+        If True, update datasets that were already prepared,
+        instead of preparing them again from scratch.
+        When updating, ``max_wavs`` and ``max_num_psds`` limit
+        the total number of .wav files and PSDs in the dataset,
+        so new .wav files are not added once either limit is reached.
+        If the dataset was prepared with a different ``freq_range`` or ``dtype``,
+        or was saved by an earlier version of songdkl as a single array,
+        it is prepared again from scratch.
+        Default is False.
+    freq_range : tuple
+        Of two numbers, the lowest and highest frequency in Hz
+        of PSDs computed from syllables. Default is (600, 16000).
+    dtype : str
+        Data type that PSDs are saved as, one of {'float64', 'float32'}.
+        Saving as 'float32' halves the size of the dataset.
+        Default is 'float64'.
+    n_jobs : int
+        Total number of worker processes used to prepare datasets.
+        If there is more than one directory, up to ``n_jobs`` directories
+        are prepared at the same time, on a pool of processes,
+        and the workers are split evenly between them,
+        so that the .wav files in each directory are processed by
+        ``n_jobs // (number of directories prepared at a time)`` workers.
+        If -1, use all CPUs.
+        Default is None, in which case directories are prepared
+        one at a time, each with one worker per CPU.
+    scheduler : str
+        Scheduler used by ``dask`` to process the .wav files in each directory,
+        one of {'threads', 'processes', 'synchronous', 'distributed'}.
+        Default is None, in which case the scheduler configured for ``dask`` is used,
+        that is 'processes' unless it was changed.
+        See ``songdkl.syllables.dask_scheduler``.
+    partition_size : int
+        Number of .wav files processed by each ``dask`` task.
+        Default is None, in which case ``dask`` chooses the partition size.
+    threshold : str, float, int
+        Thresholding method used to segment .wav files, one of
+        {'half-otsu', 'half-average', 'pooled-half-otsu', 'pooled-half-average'},
+        or a float or int value. The 'pooled-' methods compute one threshold
+        for all the .wav files in each directory, and save it with the dataset.
+        When a dataset is updated with ``incremental=True``, new .wav files
+        are segmented with the saved threshold. If the dataset was prepared
+        with a different ``threshold``, it is prepared again from scratch.
+        Default is 'half-otsu'.
+
+    Returns
+    -------
+    results : list
+        Of ``PrepResult`` instances, one for each directory,
+        with the number of .wav files and PSDs that were prepared
+        and the time it took. The throughput for each directory
+        is also logged when it finishes.
     """
+    if dtype not in DTYPES:
+        raise ValueError(
+            f'`dtype` must be one of {DTYPES}, but was: {dtype}'
+        )
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+    elif n_jobs is not None and n_jobs < 1:
+        raise ValueError(
+            f'`n_jobs` must be a positive integer or -1, but was: {n_jobs}'
+        )
+    if scheduler is not None and scheduler not in SCHEDULERS:
+        raise ValueError(
+            f'`scheduler` must be one of {SCHEDULERS}, but was: {scheduler}'
+        )
+    _pooled_method(threshold)  # validate before preparing any directories
     if isinstance(dir_path, (str, pathlib.Path)):
         dir_path = [dir_path]
     dir_path = [pathlib.Path(dir_path_) for dir_path_ in dir_path]
@@ -100,48 +637,39 @@ def prep_and_save(dir_path: str | pathlib.Path | list[str | pathlib.Path],
                 'one `output_dir_path` per `dir_path`.'
             )
 
-    for a_dir_path, an_output_dir_path in zip(dir_path, output_dir_path):
-        logger.log(
-            msg=f'Preparing dataset from dir_path: {a_dir_path}',
-            level=logging.INFO
-        )
-        syls_from_wavs, segedpsds = prep(a_dir_path, max_wavs, max_num_psds)
-        logger.log(
-            msg=f'Saving syllable segmentation in annotation files: {an_output_dir_path}',
-            level=logging.INFO
-        )
-        annots = []
-        for syls in rich.progress.track(syls_from_wavs, 'Saving segmentation'):
-            segments = []
-            for slice_ in syls.slices:
-                segment = crowsetta.Segment.from_keyword(
-                    label='-',  # dummy label
-                    onset_sample=slice_.start,
-                    offset_sample=slice_.stop,
-                    onset_s=np.around(slice_.start / syls.threshold, decimals=3),  # 3 because milliseconds
-                    offset_s=np.around(slice_.stop / syls.threshold, decimals=3),
-                )
-                segments.append(segment)
-            seq = crowsetta.Sequence.from_segments(segments)
-            # save segments from each file in simple-seq format
-            annot_path = an_output_dir_path / f'{pathlib.Path(syls.wav_path).name}-threshold-{syls.threshold}'
-            simpleseq = crowsetta.formats.seq.SimpleSeq(labels=seq.labels, onsets_s=seq.onsets_s,
-                                                        offsets_s=seq.offsets_s, annot_path=annot_path)
-            simpleseq.to_file(annot_path=annot_path)
-            annot = crowsetta.Annotation(seq=seq, annot_path=annot_path, notated_path=syls.wav_path)
-            annots.append(annot)
-
-        # save segments from all files in generic-seq format
-        generic_seq = crowsetta.formats.seq.GenericSeq(annots=annots)
-        generic_seq.to_file(
-            annot_path=an_output_dir_path / f'{a_dir_path.name}.annot.csv'
-        )
+    if n_jobs is None or n_jobs == 1 or len(dir_path) == 1:
+        # prepare one directory at a time, each with all workers,
+        # using the same scheduler for all, so e.g. a distributed cluster is only started once
+        results = []
+        with dask_scheduler(scheduler, n_jobs):
+            for a_dir_path, an_output_dir_path in zip(dir_path, output_dir_path):
+                result = _prep_and_save_dir(a_dir_path, an_output_dir_path, max_wavs, max_num_psds, incremental,
+                                            freq_range, dtype, partition_size=partition_size,
+                                            threshold=threshold)
+                logger.log(msg=result.throughput(), level=logging.INFO)
+                results.append(result)
+        return results
 
-        logger.log(
-            msg=f'Saving array to: {an_output_dir_path}',
-            level=logging.INFO
-        )
-        zarr.save(
-            str(an_output_dir_path / f'{a_dir_path.name}.songdkl.zarr'),
-            segedpsds
-        )
+    # prepare directories concurrently, splitting workers between them
+    n_concurrent = min(n_jobs, len(dir_path))
+    n_workers = max(1, n_jobs // n_concurrent)
+    logger.log(
+        msg=f'Preparing datasets from {len(dir_path)} directories, {n_concurrent} at a time, '
+            f'with {n_workers} workers each.',
+        level=logging.INFO
+    )
+    # directories with the most .wav files first, so they don't finish last
+    order = sorted(range(len(dir_path)), key=lambda ind: len(list(dir_path[ind].glob('*.wav'))), reverse=True)
+    results: list[PrepResult | None] = [None] * len(dir_path)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=n_concurrent) as executor:
+        future_to_ind = {
+            executor.submit(_prep_and_save_dir, dir_path[ind], output_dir_path[ind], max_wavs, max_num_psds,
+                            incremental, freq_range, dtype, n_workers, scheduler, partition_size,
+                            threshold): ind
+            for ind in order
+        }
+        for future in concurrent.futures.as_completed(future_to_ind):
+            result = future.result()
+            logger.log(msg=result.throughput(), level=logging.INFO)
+            results[future_to_ind[future]] = result
+    return results
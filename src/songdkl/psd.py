@@ -0,0 +1,157 @@
+"""Functions to compute power spectral densities (PSDs)
+of many signals at once, e.g. all the syllables
+segmented out of a .wav file.
+
+The PSDs are estimated with Welch's method,
+giving the same result as calling ``matplotlib.mlab.psd``
+on each signal with its default parameters,
+but the frames from all signals are windowed and
+transformed with a single vectorized FFT,
+instead of computing one PSD at a time.
+"""
+from __future__ import annotations
+
+import numpy as np
+
+
+def n_frames(signal_len: int, nfft: int) -> int:
+    """Number of non-overlapping frames of length ``nfft``
+    that a signal is split into by ``matplotlib.mlab.psd``.
+    Signals shorter than ``nfft`` are zero-padded to one frame,
+    and samples after the last full frame are dropped."""
+    if signal_len < nfft:
+        return 1
+    return signal_len // nfft
+
+
+def band_bins(freq_range: tuple[float, float], nfft: int, fs: int | float) -> slice:
+    """Get the slice of frequency bins in a PSD
+    that fall within a frequency range.
+
+    Parameters
+    ----------
+    freq_range : tuple
+        Of two numbers, the lowest and highest frequency in Hz.
+    nfft : int
+        Number of samples in each frame used to compute the PSD.
+    fs : int, float
+        Sampling frequency.
+
+    Returns
+    -------
+    bins : slice
+        That can be used to index a PSD
+        with ``nfft // 2 + 1`` frequency bins.
+    """
+    low, high = freq_range
+    if not 0 <= low < high:
+        raise ValueError(
+            f'`freq_range` must be two non-negative numbers where the first is less than the second, '
+            f'but was: {freq_range}'
+        )
+    if high > fs / 2:
+        raise ValueError(
+            f'Highest frequency in `freq_range`, {high}, is greater than the Nyquist frequency, {fs / 2}'
+        )
+    bin_width = fs / float(nfft)
+    return slice(int(round(low / bin_width)), int(round(high / bin_width)))
+
+
+def welch_psd(signals: list[np.ndarray],
+              nfft: int,
+              fs: int | float,
+              max_frames_per_chunk: int = 256,
+              bins: slice | None = None,
+              normalize: bool = False) -> np.ndarray:
+    """Compute PSDs of a list of signals with Welch's method.
+
+    Equivalent to ``matplotlib.mlab.psd(signal, NFFT=nfft, Fs=fs)[0]``
+    for each signal: each signal is split into non-overlapping frames
+    of length ``nfft`` (zero-padded if shorter), a Hanning window
+    is applied to each frame, and the PSD is the average of
+    the frames' one-sided periodograms.
+
+    Frames from all signals are stacked into one matrix,
+    and transformed with a single call to ``numpy.fft.rfft``.
+    To bound memory usage, this is done in chunks of at most
+    ``max_frames_per_chunk`` frames (or more if one signal
+    alone has more frames than that).
+    If ``bins`` is specified, only those frequency bins
+    are kept from the transform, so the power is computed,
+    averaged and returned for only those bins.
+    If ``normalize`` is True, each signal is normalized
+    as it is copied into its frames, so signals can be views
+    into a larger array of audio, e.g. with integer samples,
+    and are never copied in full.
+
+    Parameters
+    ----------
+    signals : list
+        Of one-dimensional ``numpy.ndarray``s.
+    nfft : int
+        Number of samples in each frame.
+    fs : int, float
+        Sampling frequency.
+    max_frames_per_chunk : int
+        Maximum number of frames to transform at once.
+        Default is 256.
+    bins : slice
+        Frequency bins to return, e.g. as returned by ``band_bins``.
+        Default is None, in which case all ``nfft // 2 + 1`` bins are returned.
+    normalize : bool
+        If True, subtract the mean and divide by the standard deviation
+        of each signal, giving the same result as passing in
+        ``songdkl.syllables.norm(signal)``. Default is False.
+
+    Returns
+    -------
+    psds : numpy.ndarray
+        With shape (len(signals), nfft // 2 + 1),
+        or (len(signals), number of bins) if ``bins`` is specified.
+    """
+    window = np.hanning(nfft)
+    # scale everything except DC and Nyquist (when nfft is even) by 2, to get one-sided density
+    scale = np.full(nfft // 2 + 1, 2.)
+    scale[0] = 1.
+    if nfft % 2 == 0:
+        scale[-1] = 1.
+    scale /= fs * (window ** 2).sum()
+    if bins is None:
+        bins = slice(None)
+    scale = scale[bins]
+
+    frames_per_signal = np.array([n_frames(len(signal), nfft) for signal in signals], dtype=int)
+    psds = np.empty((len(signals), len(scale)))
+
+    start = 0
+    while start < len(signals):
+        # find the signals that go into this chunk
+        stop = start + 1
+        total_frames = frames_per_signal[start]
+        while stop < len(signals) and total_frames + frames_per_signal[stop] <= max_frames_per_chunk:
+            total_frames += frames_per_signal[stop]
+            stop += 1
+
+        frames = np.zeros((total_frames, nfft))
+        frame_ind = 0
+        for signal, signal_n_frames in zip(signals[start:stop], frames_per_signal[start:stop]):
+            signal = np.asarray(signal)
+            n_samples = min(len(signal), signal_n_frames * nfft)
+            signal_frames = frames[frame_ind:frame_ind + signal_n_frames].reshape(-1)[:n_samples]
+            if normalize:
+                np.subtract(signal[:n_samples], signal.mean(), out=signal_frames)
+                signal_frames /= signal.std()
+            else:
+                signal_frames[:] = signal[:n_samples]
+            frame_ind += signal_n_frames
+        frames *= window
+
+        spectra = np.fft.rfft(frames, axis=1)[:, bins]
+        power = spectra.real ** 2 + spectra.imag ** 2
+        power *= scale
+
+        offsets = np.concatenate(([0], np.cumsum(frames_per_signal[start:stop])[:-1]))
+        psds[start:stop] = np.add.reduceat(power, offsets, axis=0) / frames_per_signal[start:stop, np.newaxis]
+        start = stop
+
+    return psds
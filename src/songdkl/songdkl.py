@@ -5,33 +5,102 @@ import logging
 import pathlib
 from typing import Any, Tuple, Union
 
-import scipy.spatial as spatial
 import numpy as np
+import rich.progress
 from sklearn.mixture import GaussianMixture
+import zarr
 
-from .constants import DefaultGaussianMixtureKwargs, DEFAULT_GMM_KWARGS
-from .load import load_or_prep
+from .constants import DefaultGaussianMixtureKwargs, DEFAULT_FREQ_RANGE, DEFAULT_GMM_KWARGS, DTYPES
+from .distance import distances_to_basis, sq_norms
+from .load import load_or_prep, select_rows
 
 
 logger = logging.getLogger(__name__)
 
 
+# ways of choosing the maximum distance used to convert distances to similarities,
+# see ``calculate_many``
+NORMALIZE = ('pair', 'ref', 'all')
+
+
+def _validate_gmm_kwargs(gmm_kwargs: DefaultGaussianMixtureKwargs | dict) -> dict:
+    """Validate ``gmm_kwargs`` argument and return as a ``dict``"""
+    if isinstance(gmm_kwargs, DefaultGaussianMixtureKwargs):
+        gmm_kwargs = dataclasses.asdict(gmm_kwargs)
+    elif isinstance(gmm_kwargs, dict):
+        pass
+    else:
+        raise TypeError(
+            '`gmm_kwargs` must be a dict or DefaultGaussianMixtureKwargs,'
+            f'but was type: {type(gmm_kwargs)}'
+        )
+    if 'n_components' in gmm_kwargs:
+        raise ValueError(
+            "`gmm_kwargs` has key `n_components` but that argument to GaussianMixture "
+            "are the `k_ref` and `k_compare` arguments to this function."
+        )
+    return gmm_kwargs
+
+
+def get_basis_set(psds: np.ndarray | zarr.Array, n_basis: int = 50, basis: str = 'first') -> np.ndarray:
+    """Select the basis set from an array of PSDs.
+
+    Parameters
+    ----------
+    psds : numpy.ndarray, zarr.Array
+        Array of PSDs from the bird whose syllables are used as the basis set.
+        Can be an array that is read lazily from disk,
+        e.g. returned by ``songdkl.load.load`` with ``lazy=True``,
+        in which case only the rows in the basis set are read.
+    n_basis : int
+        Number of syllables to use as basis set. Default is 50.
+    basis : str
+        One of {'first', 'random'}.
+        Controls which syllables are used as the basis set.
+        If 'first', use the first `n_basis` syllables.
+        If `random`, grab a random set of size `n_basis`.
+        Default is 'first'.
+
+    Returns
+    -------
+    basis_set : numpy.ndarray
+        Array of PSDs with shape (n_basis, n_freqs).
+    """
+    if basis == 'first':
+        # select the first `n_basis` syllables of the reference song as the basis set
+        basis_set = psds[:n_basis]
+    elif basis == 'random':
+        # select a random set of `n_basis` syllables as the basis set
+        basis_set = select_rows(psds, np.random.randint(0, len(psds), size=n_basis))
+    else:
+        raise ValueError(
+            f"Invalid value for basis: {basis}. Must be one of {{'first', 'random'}}"
+        )
+    return np.asarray(basis_set)
+
+
 def calculate(psds_ref: np.ndarray,
               psds_compare: np.ndarray,
               k_ref: int,
               k_compare: int,
               n_basis: int = 50,
               basis: str = 'first',
-              gmm_kwargs: DEFAULT_GMM_KWARGS | dict = DEFAULT_GMM_KWARGS
+              gmm_kwargs: DEFAULT_GMM_KWARGS | dict = DEFAULT_GMM_KWARGS,
+              dtype: str = 'float64',
               ) -> Tuple[Union[float, Any], Union[float, Any], int, int]:
     """Calculate :math:`\text{Song }D_{KL}` metric.
 
     Parameters
     ----------
-    psds_ref : numpy.ndarray
+    psds_ref : numpy.ndarray, zarr.Array
         Array of PSDs from bird that should be used as reference.
-    psds_compare : numpy.ndarray
+        Can be an array that is read lazily from disk,
+        e.g. returned by ``songdkl.load.load`` with ``lazy=True``,
+        in which case PSDs are read in chunks, and only the distances
+        to the basis set are held in memory.
+    psds_compare : numpy.ndarray, zarr.Array
         Array of PSDs from bird that should be compared with reference.
+        Can also be read lazily from disk.
     k_ref : int
         Number of syllable classes in song of bird used as reference.
     k_compare : int
@@ -54,6 +123,12 @@ def calculate(psds_ref: np.ndarray,
         as one of the ``gmm_kwargs`` will raise an
         error since those are specified as the ``k_ref``
         and ``k_compare`` arguments to this function.
+    dtype : str
+        Data type of PSDs, distances and similarities,
+        one of {'float64', 'float32'}.
+        Using 'float32' halves the memory used,
+        but results can differ slightly from those computed with 'float64'.
+        Default is 'float64'.
 
     Returns
     -------
@@ -70,103 +145,22 @@ def calculate(psds_ref: np.ndarray,
         Number of PSDs used from reference data set.
     n_psd_compare : int
         Number of PDSs used from comparison data set.
-    """
-    if isinstance(gmm_kwargs, DefaultGaussianMixtureKwargs):
-        gmm_kwargs = dataclasses.asdict(gmm_kwargs)
-    elif isinstance(gmm_kwargs, dict):
-        pass
-    else:
-        raise TypeError(
-            '`gmm_kwargs` must be a dict or DefaultGaussianMixtureKwargs,'
-            f'but was type: {type(gmm_kwargs)}'
-        )
-    if 'n_components' in gmm_kwargs:
-        raise ValueError(
-            "`gmm_kwargs` has key `n_components` but that argument to GaussianMixture "
-            "are the `k_ref` and `k_compare` arguments to this function."
-        )
-
-    logger.log(
-        msg=(f'Calculating songdkl with psds_ref (shape: {psds_ref.shape}) '
-             f'and psds_compare (shape: {psds_compare.shape}.), '
-             f'and parameters k_ref={k_ref}, k_compare={k_compare}, n_basis={n_basis}, basis={basis}.'),
-        level=logging.INFO
-    )
-
-    if basis == 'first':
-        # select the first `n_basis` syllables of the reference song as the basis set
-        basis_set = psds_ref[:n_basis]
-    elif basis == 'random':
-        # select a random set of `n_basis` syllables as the basis set
-        basis_set = [psds_ref[ind]
-                     for ind in np.random.randint(0, len(psds_ref), size=n_basis)]
-    else:
-        raise ValueError(
-            f"Invalid value for basis: {basis}. Must be one of {{'first', 'random'}}"
-        )
-
-    len_ref_half = int(len(psds_ref) / 2)
-    len_compare_half = int(len(psds_compare) / 2)
-
-    logger.log(
-        msg=f'Calculating distance matrices',
-        level=logging.INFO
-    )
-
-    # calculate distance matrices
-    D_ref = spatial.distance.cdist(psds_ref[:len_ref_half], basis_set, 'sqeuclidean')
-    D_ref_2 = spatial.distance.cdist(psds_ref[len_ref_half:], basis_set, 'sqeuclidean')
-    D_compare = spatial.distance.cdist(psds_compare[:len_compare_half], basis_set, 'sqeuclidean')
-    D_compare_2 = spatial.distance.cdist(psds_compare[len_compare_half:], basis_set, 'sqeuclidean')
-
-    mx = np.max([np.max(D_ref), np.max(D_compare), np.max(D_ref_2), np.max(D_compare_2)])
-
-    logger.log(
-        msg='Converting to similarity matrices',
-        level=logging.INFO
-    )
-    # convert to similarity matrices
-    s_ref = 1 - (D_ref / mx)
-    s_ref_2 = 1 - (D_ref_2 / mx)
-    s_compare = 1 - (D_compare / mx)
-    s_compare_2 = 1 - (D_compare_2 / mx)
-
-    logger.info(
-        msg=f'Fitting Gaussian Mixture Models',
-    )
-    # estimate GMMs
-    P = GaussianMixture(n_components=k_ref, **gmm_kwargs)
-    P.fit(s_ref)
-
-    Q = GaussianMixture(n_components=k_compare, **gmm_kwargs)
-    Q.fit(s_compare)
-
-    logger.log(
-        msg=f'Calculating likelihoods for held out data',
-        level=logging.INFO
-    )
-    # calculate likelihoods for held out data
-    p_hat_p = P.score(s_ref_2)
-    q_hat_p = Q.score(s_ref_2)
-
-    p_hat_q = P.score(s_compare_2)
-    q_hat_q = Q.score(s_compare_2)
-
-    logger.log(
-        msg=f'Calculating Song_D_KL, divergence estimate',
-        level=logging.INFO
-    )
-    # calculate song divergence (DKL estimate)
-    DKL_PQ = np.log2(np.e) * ((np.mean(p_hat_p)) - (np.mean(q_hat_p)))
-    DKL_QP = np.log2(np.e) * ((np.mean(q_hat_q)) - (np.mean(p_hat_q)))
 
-    DKL_PQ = DKL_PQ / len(basis_set)
-    DKL_QP = DKL_QP / len(basis_set)
-
-    n_psds_ref = len(psds_ref)
-    n_psds_compare = len(psds_compare)
-
-    return DKL_PQ, DKL_QP, n_psds_ref, n_psds_compare
+    Notes
+    -----
+    Computed by ``calculate_many`` with a single comparison bird,
+    and ``normalize='pair'``.
+    """
+    DKL_PQ, DKL_QP, n_psds_ref, n_psds_compare = calculate_many(psds_ref,
+                                                                [psds_compare],
+                                                                k_ref,
+                                                                [k_compare],
+                                                                n_basis,
+                                                                basis,
+                                                                gmm_kwargs,
+                                                                dtype,
+                                                                normalize='pair')
+    return DKL_PQ[0], DKL_QP[0], n_psds_ref, n_psds_compare[0]
 
 
 def calculate_from_path(ref_path: str | pathlib.Path,
@@ -177,7 +171,13 @@ def calculate_from_path(ref_path: str | pathlib.Path,
                         max_num_psds: int = 10000,
                         n_basis: int = 50,
                         basis: str = 'first',
-                        gmm_kwargs: DEFAULT_GMM_KWARGS | dict = DEFAULT_GMM_KWARGS
+                        gmm_kwargs: DEFAULT_GMM_KWARGS | dict = DEFAULT_GMM_KWARGS,
+                        cache_dir: str | pathlib.Path | None = None,
+                        cache_max_size: int | None = None,
+                        freq_range: tuple[float, float] = DEFAULT_FREQ_RANGE,
+                        rows: slice | np.ndarray | None = None,
+                        dtype: str = 'float64',
+                        threshold: str | float | int = 'half-otsu',
                         ) -> Tuple[Union[float, Any], Union[float, Any], int, int]:
     """Calculate :math:`\text{Song }D_{KL}` metric.
 
@@ -218,6 +218,35 @@ def calculate_from_path(ref_path: str | pathlib.Path,
         as one of the ``gmm_kwargs`` will raise an
         error since those are specified as the ``k_ref``
         and ``k_compare`` arguments to this function.
+    cache_dir : str, pathlib.Path
+        Directory where PSDs prepared from .wav files are cached.
+        Default is None, in which case the environment variable
+        ``SONGDKL_CACHE_DIR`` is used if set, and otherwise no cache is used.
+        See ``songdkl.load.load_or_prep``.
+    cache_max_size : int
+        Maximum size of the cache in bytes.
+        Default is None, in which case
+        ``songdkl.cache.DEFAULT_CACHE_MAX_SIZE`` is used.
+    freq_range : tuple
+        Of two numbers, the lowest and highest frequency in Hz
+        of PSDs computed from syllables, when preparing
+        PSDs from .wav files. Default is (600, 16000).
+    rows : slice, numpy.ndarray
+        Rows of PSDs to use from each bird, either a slice,
+        e.g. ``slice(0, 20000)`` or ``slice(None, None, 10)``,
+        or an array of row indices, e.g. returned by ``songdkl.load.subsample_rows``.
+        Default is None, in which case all rows are used.
+        See ``songdkl.load.load``.
+    dtype : str
+        Data type of PSDs, distances and similarities,
+        one of {'float64', 'float32'}.
+        Using 'float32' halves the memory used,
+        but results can differ slightly from those computed with 'float64'.
+        Default is 'float64'.
+    threshold : str, float
+        Method used to find the threshold that segments syllables,
+        when preparing PSDs from .wav files, or a number to use as the threshold.
+        Default is 'half-otsu'. See ``songdkl.load.load_or_prep``.
 
     Returns
     -------
@@ -240,17 +269,681 @@ def calculate_from_path(ref_path: str | pathlib.Path,
         level=logging.INFO
     )
 
-    segedpsds_ref = load_or_prep(ref_path, max_wavs, max_num_psds)
+    # PSDs saved in .zarr files are read lazily, in chunks, so they are never all in memory
+    segedpsds_ref = load_or_prep(ref_path, max_wavs, max_num_psds, cache_dir, cache_max_size, freq_range,
+                                 rows, lazy=True, dtype=dtype, threshold=threshold)
 
     logger.log(
         msg=f'Getting PSDs from compare_path: {compare_path}',
         level=logging.INFO
     )
-    segedpsds_compare = load_or_prep(compare_path, max_wavs, max_num_psds)
+    segedpsds_compare = load_or_prep(compare_path, max_wavs, max_num_psds, cache_dir, cache_max_size, freq_range,
+                                     rows, lazy=True, dtype=dtype, threshold=threshold)
     return calculate(segedpsds_ref,
                      segedpsds_compare,
                      k_ref,
                      k_compare,
                      n_basis,
                      basis,
-                     gmm_kwargs)
+                     gmm_kwargs,
+                     dtype)
+
+
+def _calculate_many(D_ref_all: np.ndarray,
+                    D_compares_all: list[np.ndarray],
+                    k_ref: int,
+                    k_compares: list[int],
+                    n_basis: int,
+                    gmm_kwargs: dict,
+                    normalize: str,
+                    ref_models: dict | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """Helper function that computes song divergences for ``calculate_many``,
+    from the distances of the reference and of each bird compared with it to the basis set.
+
+    ``ref_models`` maps a maximum distance to a model of the reference
+    already fit to similarities computed with that maximum, e.g. loaded by
+    ``songdkl.model.load_model``. Models of the reference that need to be fit
+    are added to it.
+    """
+    len_ref_half = int(len(D_ref_all) / 2)
+    D_ref, D_ref_2 = D_ref_all[:len_ref_half], D_ref_all[len_ref_half:]
+
+    mx_ref = np.max(D_ref_all)
+    if normalize == 'pair':
+        mxs = [np.max([mx_ref, np.max(D_compare_all)]) for D_compare_all in D_compares_all]
+    elif normalize == 'ref':
+        mxs = [mx_ref] * len(D_compares_all)
+    elif normalize == 'all':
+        mx = np.max([mx_ref] + [np.max(D_compare_all) for D_compare_all in D_compares_all])
+        mxs = [mx] * len(D_compares_all)
+
+    # the model for the reference only depends on the bird compared with it
+    # through the maximum distance, so we fit it once for each maximum
+    if ref_models is None:
+        ref_models = {}
+    ref_scored = {}
+
+    DKL_PQ = np.zeros(len(D_compares_all))
+    DKL_QP = np.zeros(len(D_compares_all))
+    for compare_ind, (D_compare_all, k_compare, mx) in enumerate(zip(D_compares_all, k_compares, mxs)):
+        logger.log(
+            msg=f'Calculating Song_D_KL for comparison {compare_ind + 1} of {len(D_compares_all)}',
+            level=logging.INFO
+        )
+        if mx not in ref_scored:
+            # convert to similarity matrices. These are converted to float64 if they are not already,
+            # because fitting GMMs with float32 can fail when covariances are not positive definite
+            s_ref_2 = (1 - (D_ref_2 / mx)).astype(np.float64, copy=False)
+            if mx in ref_models:
+                P = ref_models[mx]
+            else:
+                s_ref = (1 - (D_ref / mx)).astype(np.float64, copy=False)
+                P = GaussianMixture(n_components=k_ref, **gmm_kwargs)
+                P.fit(s_ref)
+                ref_models[mx] = P
+            ref_scored[mx] = (P, s_ref_2, P.score(s_ref_2))
+        P, s_ref_2, p_hat_p = ref_scored[mx]
+
+        len_compare_half = int(len(D_compare_all) / 2)
+        s_compare = (1 - (D_compare_all[:len_compare_half] / mx)).astype(np.float64, copy=False)
+        s_compare_2 = (1 - (D_compare_all[len_compare_half:] / mx)).astype(np.float64, copy=False)
+
+        Q = GaussianMixture(n_components=k_compare, **gmm_kwargs)
+        Q.fit(s_compare)
+
+        # calculate likelihoods for held out data
+        q_hat_p = Q.score(s_ref_2)
+        p_hat_q = P.score(s_compare_2)
+        q_hat_q = Q.score(s_compare_2)
+
+        # calculate song divergence (DKL estimate)
+        DKL_PQ[compare_ind] = np.log2(np.e) * ((np.mean(p_hat_p)) - (np.mean(q_hat_p))) / n_basis
+        DKL_QP[compare_ind] = np.log2(np.e) * ((np.mean(q_hat_q)) - (np.mean(p_hat_q))) / n_basis
+
+    return DKL_PQ, DKL_QP
+
+
+def calculate_many(psds_ref: np.ndarray,
+                   psds_compares: list[np.ndarray],
+                   k_ref: int,
+                   k_compares: list[int],
+                   n_basis: int = 50,
+                   basis: str = 'first',
+                   gmm_kwargs: DEFAULT_GMM_KWARGS | dict = DEFAULT_GMM_KWARGS,
+                   dtype: str = 'float64',
+                   normalize: str = 'pair',
+                   ) -> tuple[np.ndarray, np.ndarray, int, list[int]]:
+    """Calculate :math:`\text{Song }D_{KL}` metric
+    between one reference bird and many birds compared with it,
+    e.g. a tutor and its pupils.
+
+    Computes the same quantities as calling ``songdkl.songdkl.calculate``
+    once for each bird compared with the reference,
+    but the work that only depends on the reference is done once:
+    the basis set is selected and the distances from the reference
+    to the basis set are computed only once,
+    and the Gaussian Mixture Model for the reference, :math:`\hat{P}`,
+    is only fit again when the similarities it is fit to change.
+    For each bird compared with the reference,
+    only the distances to the basis set are computed
+    and the model :math:`\hat{Q}` is fit.
+
+    Parameters
+    ----------
+    psds_ref : numpy.ndarray, zarr.Array
+        Array of PSDs from bird that should be used as reference.
+        Can be an array that is read lazily from disk, as for ``calculate``.
+    psds_compares : list
+        Of ``numpy.ndarray``, arrays of PSDs,
+        one for each bird that should be compared with reference.
+        Can also be read lazily from disk.
+    k_ref : int
+        Number of syllable classes in song of bird used as reference.
+    k_compares : list
+        Of int, number of syllable classes in song of each bird
+        compared with reference. Must be the same length as ``psds_compares``.
+    n_basis : int
+        Number of syllables to use as basis set. Default is 50.
+    basis : str
+        One of {'first', 'random'}.
+        Controls which syllables are used as the basis set.
+        If 'first', use the first `n_basis` syllables.
+        If `random`, grab a random set of size `n_basis`.
+        Default is 'first'.
+    gmm_kwargs : dict, DefaultGaussianMixtureKwargs
+        Optional dict with keyword argument to pass into
+        ``sklearn.GaussianMixtureModel`` when instantiating.
+        If not supplied, the defaults are used,
+        that are represented by a dataclass,
+        ``songdkl.constants.DefaultGaussianMixtureKwargs``.
+        Note that specifying ``n_components``
+        as one of the ``gmm_kwargs`` will raise an
+        error since those are specified as the ``k_ref``
+        and ``k_compares`` arguments to this function.
+    dtype : str
+        Data type of PSDs, distances and similarities,
+        one of {'float64', 'float32'}.
+        Using 'float32' halves the memory used,
+        but results can differ slightly from those computed with 'float64'.
+        Default is 'float64'.
+    normalize : str
+        One of {'pair', 'ref', 'all'}.
+        Controls which maximum distance to the basis set
+        is used to convert distances to similarities.
+        If 'pair', use the maximum across the reference
+        and the bird compared with it, as ``calculate`` does,
+        so that results are the same as calling ``calculate`` for each bird.
+        The model for the reference is fit again
+        for each bird whose maximum distance is larger than the reference's.
+        If 'ref', use the maximum across the reference only,
+        so that the result for each bird does not depend
+        on which other birds are compared with the reference.
+        If 'all', use the maximum across the reference
+        and all birds compared with it, as ``calculate_matrix`` does.
+        With 'ref' and 'all', the model for the reference is fit only once,
+        but results can differ slightly from those returned by ``calculate``.
+        Default is 'pair'.
+
+    Returns
+    -------
+    DKL_PQ : numpy.ndarray
+        Of :math:`D_{KL}(\hat{P}||\hat{Q}`, one for each bird
+        compared with reference, in the same order as ``psds_compares``.
+    DKL_QP : numpy.ndarray
+        Same computation as ``DKL_PQ``,
+        but in the opposite direction:
+        Q with respect to P.
+    n_psds_ref : int
+        Number of PSDs used from reference data set.
+    n_psds_compare : list
+        Of int, number of PSDs used from each comparison data set.
+    """
+    if len(psds_compares) != len(k_compares):
+        raise ValueError(
+            f'Number of arrays in `psds_compares` ({len(psds_compares)}) did not match '
+            f'number of values in `k_compares` ({len(k_compares)}).'
+        )
+    if len(psds_compares) == 0:
+        raise ValueError(
+            '`psds_compares` must have at least one array of PSDs'
+        )
+    gmm_kwargs = _validate_gmm_kwargs(gmm_kwargs)
+    if dtype not in DTYPES:
+        raise ValueError(
+            f'`dtype` must be one of {DTYPES}, but was: {dtype}'
+        )
+    if normalize not in NORMALIZE:
+        raise ValueError(
+            f'`normalize` must be one of {NORMALIZE}, but was: {normalize}'
+        )
+
+    logger.log(
+        msg=(f'Calculating songdkl with psds_ref (shape: {psds_ref.shape}) '
+             f'and {len(psds_compares)} psds_compares (shapes: {[psds.shape for psds in psds_compares]}), '
+             f'and parameters k_ref={k_ref}, k_compares={k_compares}, n_basis={n_basis}, basis={basis}, '
+             f'dtype={dtype}, normalize={normalize}.'),
+        level=logging.INFO
+    )
+
+    basis_set = get_basis_set(psds_ref, n_basis, basis).astype(dtype, copy=False)
+
+    logger.log(
+        msg=f'Calculating distance matrices',
+        level=logging.INFO
+    )
+    # calculate distance matrices, for both halves of each bird at once.
+    # Distances from the reference are only computed once, for all birds compared with it
+    basis_sq_norms = sq_norms(basis_set)
+    D_ref_all = distances_to_basis(psds_ref, basis_set, basis_sq_norms=basis_sq_norms)
+    D_compares_all = [
+        distances_to_basis(psds_compare, basis_set, basis_sq_norms=basis_sq_norms)
+        for psds_compare in psds_compares
+    ]
+    DKL_PQ, DKL_QP = _calculate_many(D_ref_all, D_compares_all, k_ref, k_compares, len(basis_set),
+                                     gmm_kwargs, normalize)
+
+    n_psds_ref = len(psds_ref)
+    n_psds_compare = [len(psds_compare) for psds_compare in psds_compares]
+    return DKL_PQ, DKL_QP, n_psds_ref, n_psds_compare
+
+
+def calculate_many_from_path(ref_path: str | pathlib.Path,
+                             compare_paths: list[str | pathlib.Path],
+                             k_ref: int,
+                             k_compares: list[int],
+                             max_wavs: int = 120,
+                             max_num_psds: int = 10000,
+                             n_basis: int = 50,
+                             basis: str = 'first',
+                             gmm_kwargs: DEFAULT_GMM_KWARGS | dict = DEFAULT_GMM_KWARGS,
+                             cache_dir: str | pathlib.Path | None = None,
+                             cache_max_size: int | None = None,
+                             freq_range: tuple[float, float] = DEFAULT_FREQ_RANGE,
+                             rows: slice | np.ndarray | None = None,
+                             dtype: str = 'float64',
+                             threshold: str | float | int = 'half-otsu',
+                             normalize: str = 'pair',
+                             ) -> tuple[np.ndarray, np.ndarray, int, list[int]]:
+    """Calculate :math:`\text{Song }D_{KL}` metric
+    between one reference bird and many birds compared with it,
+    loading or preparing the data from the reference only once.
+
+    Parameters
+    ----------
+    ref_path : str
+        Path to data from bird that should be used as reference.
+        Either a path to a directory with .wav files of songs,
+        or a path to a .songdkl.zarr file generated by songdkl prep.
+    compare_paths : list
+        Of str or pathlib.Path, paths to data from each bird
+        that should be compared with reference.
+        Each is either a path to a directory with .wav files of songs,
+        or a path to a .songdkl.zarr file generated by songdkl prep.
+    k_ref : int
+        Number of syllable classes in song of bird used as reference.
+    k_compares : list
+        Of int, number of syllable classes in song of each bird
+        compared with reference. Must be the same length as ``compare_paths``.
+    max_wavs : int
+        Maximum number of wav files to use. Default is 120.
+    max_num_psds : int
+        Maximum number of power spectral densities (PSDs) to calculate.
+        Default is 10000.
+    n_basis : int
+        Number of syllables to use as basis set. Default is 50.
+    basis : str
+        One of {'first', 'random'}.
+        Controls which syllables are used as the basis set.
+        If 'first', use the first `n_basis` syllables.
+        If `random`, grab a random set of size `n_basis`.
+        Default is 'first'.
+    gmm_kwargs : dict, DefaultGaussianMixtureKwargs
+        Optional dict with keyword argument to pass into
+        ``sklearn.GaussianMixtureModel`` when instantiating.
+        If not supplied, the defaults are used,
+        that are represented by a dataclass,
+        ``songdkl.constants.DefaultGaussianMixtureKwargs``.
+    cache_dir : str, pathlib.Path
+        Directory where PSDs prepared from .wav files are cached.
+        Default is None, in which case the environment variable
+        ``SONGDKL_CACHE_DIR`` is used if set, and otherwise no cache is used.
+        See ``songdkl.load.load_or_prep``.
+    cache_max_size : int
+        Maximum size of the cache in bytes.
+        Default is None, in which case
+        ``songdkl.cache.DEFAULT_CACHE_MAX_SIZE`` is used.
+    freq_range : tuple
+        Of two numbers, the lowest and highest frequency in Hz
+        of PSDs computed from syllables, when preparing
+        PSDs from .wav files. Default is (600, 16000).
+    rows : slice, numpy.ndarray
+        Rows of PSDs to use from each bird, either a slice,
+        e.g. ``slice(0, 20000)`` or ``slice(None, None, 10)``,
+        or an array of row indices, e.g. returned by ``songdkl.load.subsample_rows``.
+        Default is None, in which case all rows are used.
+        See ``songdkl.load.load``.
+    dtype : str
+        Data type of PSDs, distances and similarities,
+        one of {'float64', 'float32'}.
+        Default is 'float64'.
+    threshold : str, float
+        Method used to find the threshold that segments syllables,
+        when preparing PSDs from .wav files, or a number to use as the threshold.
+        Default is 'half-otsu'. See ``songdkl.load.load_or_prep``.
+    normalize : str
+        One of {'pair', 'ref', 'all'}.
+        Controls which maximum distance to the basis set
+        is used to convert distances to similarities.
+        Default is 'pair'. See ``calculate_many``.
+
+    Returns
+    -------
+    DKL_PQ : numpy.ndarray
+        Of :math:`D_{KL}(\hat{P}||\hat{Q}`, one for each bird
+        compared with reference, in the same order as ``compare_paths``.
+    DKL_QP : numpy.ndarray
+        Same computation as ``DKL_PQ``,
+        but in the opposite direction:
+        Q with respect to P.
+    n_psds_ref : int
+        Number of PSDs used from reference data set.
+    n_psds_compare : list
+        Of int, number of PSDs used from each comparison data set.
+    """
+    logger.log(
+        msg=f'Getting PSDs from ref_path: {ref_path}',
+        level=logging.INFO
+    )
+    # PSDs saved in .zarr files are read lazily, in chunks, so they are never all in memory
+    segedpsds_ref = load_or_prep(ref_path, max_wavs, max_num_psds, cache_dir, cache_max_size, freq_range,
+                                 rows, lazy=True, dtype=dtype, threshold=threshold)
+
+    segedpsds_compares = []
+    for compare_path in compare_paths:
+        logger.log(
+            msg=f'Getting PSDs from compare_path: {compare_path}',
+            level=logging.INFO
+        )
+        segedpsds_compares.append(
+            load_or_prep(compare_path, max_wavs, max_num_psds, cache_dir, cache_max_size, freq_range,
+                         rows, lazy=True, dtype=dtype, threshold=threshold)
+        )
+    return calculate_many(segedpsds_ref,
+                          segedpsds_compares,
+                          k_ref,
+                          k_compares,
+                          n_basis,
+                          basis,
+                          gmm_kwargs,
+                          dtype,
+                          normalize)
+
+
+def calculate_matrix(psds: list[np.ndarray],
+                     ks: list[int],
+                     n_basis: int = 50,
+                     basis: str = 'first',
+                     gmm_kwargs: DEFAULT_GMM_KWARGS | dict = DEFAULT_GMM_KWARGS,
+                     dtype: str = 'float64',
+                     ) -> tuple[np.ndarray, np.ndarray, list[int]]:
+    """Calculate :math:`\text{Song }D_{KL}` metric for all pairs of birds.
+
+    Computes the same quantities as ``songdkl.songdkl.calculate``,
+    for every ordered pair of birds,
+    but only does the work that is specific to a pair once per bird.
+    For each bird used as the reference, the basis set is taken from
+    that bird and distances to the basis set are computed for all birds.
+    A Gaussian Mixture Model is then fit once to each bird's data
+    in that basis set, and for each pair only the cheap
+    ``GaussianMixture.score`` calls are done.
+    This reduces the number of fits from
+    :math:`2 N^2` (when calling ``calculate`` for each pair)
+    to :math:`N^2`.
+
+    Parameters
+    ----------
+    psds : list
+        Of ``numpy.ndarray``, arrays of PSDs, one per bird.
+        Arrays can be read lazily from disk, as for ``calculate``.
+    ks : list
+        Of int, number of syllable classes in song of each bird,
+        used as the number of components for the Gaussian Mixture Model
+        fit to the data from that bird. Must be the same length as ``psds``.
+    n_basis : int
+        Number of syllables to use as basis set. Default is 50.
+    basis : str
+        One of {'first', 'random'}.
+        Controls which syllables are used as the basis set.
+        If 'first', use the first `n_basis` syllables.
+        If `random`, grab a random set of size `n_basis`.
+        Default is 'first'.
+    gmm_kwargs : dict, DefaultGaussianMixtureKwargs
+        Optional dict with keyword argument to pass into
+        ``sklearn.GaussianMixtureModel`` when instantiating.
+        If not supplied, the defaults are used,
+        that are represented by a dataclass,
+        ``songdkl.constants.DefaultGaussianMixtureKwargs``.
+        Note that specifying ``n_components``
+        as one of the ``gmm_kwargs`` will raise an
+        error since those are specified by ``ks``.
+    dtype : str
+        Data type of PSDs, distances and similarities,
+        one of {'float64', 'float32'}.
+        Using 'float32' halves the memory used,
+        but results can differ slightly from those computed with 'float64'.
+        Default is 'float64'.
+
+    Returns
+    -------
+    DKL_PQ : numpy.ndarray
+        Matrix with shape (n_birds, n_birds),
+        where ``DKL_PQ[i, j]`` is :math:`D_{KL}(\hat{P}||\hat{Q}`
+        with bird ``i`` used as the reference
+        and bird ``j`` compared with the reference.
+    DKL_QP : numpy.ndarray
+        Matrix with shape (n_birds, n_birds),
+        same computation as ``DKL_PQ``,
+        but in the opposite direction:
+        Q with respect to P.
+    n_psds : list
+        Of int, number of PSDs used from each bird.
+
+    Notes
+    -----
+    Distances are converted to similarities by normalizing
+    with the maximum distance to the basis set.
+    For the basis set of each reference bird, this function
+    takes that maximum across **all** birds, instead of across
+    only the two birds being compared as ``calculate`` does,
+    so that each bird's model can be fit once and reused for all pairs.
+    Because of this, values may differ slightly
+    from those returned by ``calculate``.
+    """
+    if len(psds) != len(ks):
+        raise ValueError(
+            f'Number of arrays in `psds` ({len(psds)}) did not match number of values in `ks` ({len(ks)}).'
+        )
+    gmm_kwargs = _validate_gmm_kwargs(gmm_kwargs)
+    if dtype not in DTYPES:
+        raise ValueError(
+            f'`dtype` must be one of {DTYPES}, but was: {dtype}'
+        )
+
+    n_birds = len(psds)
+    logger.log(
+        msg=(f'Calculating songdkl matrix for {n_birds} birds, '
+             f'with parameters ks={ks}, n_basis={n_basis}, basis={basis}, dtype={dtype}.'),
+        level=logging.INFO
+    )
+
+    len_halves = [int(len(psds_bird) / 2) for psds_bird in psds]
+
+    DKL_PQ = np.zeros((n_birds, n_birds))
+    DKL_QP = np.zeros((n_birds, n_birds))
+    for ref_ind in rich.progress.track(range(n_birds), 'Calculating for each reference'):
+        basis_set = get_basis_set(psds[ref_ind], n_basis, basis).astype(dtype, copy=False)
+
+        # calculate distance matrices for all birds, using basis set from reference
+        basis_sq_norms = sq_norms(basis_set)
+        D = []
+        for psds_bird, len_half in zip(psds, len_halves):
+            D_bird = distances_to_basis(psds_bird, basis_set, basis_sq_norms=basis_sq_norms)
+            D.append(
+                (D_bird[:len_half], D_bird[len_half:])
+            )
+        mx = np.max([np.max(D_half) for D_halves in D for D_half in D_halves])
+        # convert to similarity matrices, in float64 to fit GMMs (see ``calculate``)
+        S = [
+            ((1 - (D_1 / mx)).astype(np.float64, copy=False), (1 - (D_2 / mx)).astype(np.float64, copy=False))
+            for D_1, D_2 in D
+        ]
+
+        # estimate GMMs, one per bird
+        models = []
+        for k, (s_1, _) in zip(ks, S):
+            gmm = GaussianMixture(n_components=k, **gmm_kwargs)
+            gmm.fit(s_1)
+            models.append(gmm)
+
+        # calculate likelihoods for held out data
+        P = models[ref_ind]
+        s_ref_2 = S[ref_ind][1]
+        p_hat_p = P.score(s_ref_2)
+        for compare_ind in range(n_birds):
+            if compare_ind == ref_ind:
+                continue
+            Q = models[compare_ind]
+            s_compare_2 = S[compare_ind][1]
+            q_hat_p = Q.score(s_ref_2)
+            p_hat_q = P.score(s_compare_2)
+            q_hat_q = Q.score(s_compare_2)
+            DKL_PQ[ref_ind, compare_ind] = np.log2(np.e) * (p_hat_p - q_hat_p) / len(basis_set)
+            DKL_QP[ref_ind, compare_ind] = np.log2(np.e) * (q_hat_q - p_hat_q) / len(basis_set)
+
+    n_psds = [len(psds_bird) for psds_bird in psds]
+    return DKL_PQ, DKL_QP, n_psds
+
+
+def calculate_matrix_from_path(paths: list[str | pathlib.Path],
+                               ks: list[int],
+                               output_path: str | pathlib.Path | None = None,
+                               max_wavs: int = 120,
+                               max_num_psds: int = 10000,
+                               n_basis: int = 50,
+                               basis: str = 'first',
+                               gmm_kwargs: DEFAULT_GMM_KWARGS | dict = DEFAULT_GMM_KWARGS,
+                               cache_dir: str | pathlib.Path | None = None,
+                               cache_max_size: int | None = None,
+                               freq_range: tuple[float, float] = DEFAULT_FREQ_RANGE,
+                               rows: slice | np.ndarray | None = None,
+                               dtype: str = 'float64',
+                               threshold: str | float | int = 'half-otsu',
+                               ) -> tuple[np.ndarray, np.ndarray, list[int]]:
+    """Calculate :math:`\text{Song }D_{KL}` metric for all pairs of birds,
+    loading or preparing the data from each bird only once.
+
+    Parameters
+    ----------
+    paths : list
+        Of str or pathlib.Path, paths to data from each bird.
+        Each is either a path to a directory with .wav files of songs,
+        or a path to a .songdkl.zarr file generated by songdkl prep.
+    ks : list
+        Of int, number of syllable classes in song of each bird.
+        Must be the same length as ``paths``.
+    output_path : str, pathlib.Path
+        Path where matrices should be saved, in a .zarr file.
+        Default is None, in which case the matrices are only returned.
+    max_wavs : int
+        Maximum number of wav files to use. Default is 120.
+    max_num_psds : int
+        Maximum number of power spectral densities (PSDs) to calculate.
+        Default is 10000.
+    n_basis : int
+        Number of syllables to use as basis set. Default is 50.
+    basis : str
+        One of {'first', 'random'}.
+        Controls which syllables are used as the basis set.
+        If 'first', use the first `n_basis` syllables.
+        If `random`, grab a random set of size `n_basis`.
+        Default is 'first'.
+    gmm_kwargs : dict, DefaultGaussianMixtureKwargs
+        Optional dict with keyword argument to pass into
+        ``sklearn.GaussianMixtureModel`` when instantiating.
+        If not supplied, the defaults are used,
+        that are represented by a dataclass,
+        ``songdkl.constants.DefaultGaussianMixtureKwargs``.
+    cache_dir : str, pathlib.Path
+        Directory where PSDs prepared from .wav files are cached.
+        Default is None, in which case the environment variable
+        ``SONGDKL_CACHE_DIR`` is used if set, and otherwise no cache is used.
+        See ``songdkl.load.load_or_prep``.
+    cache_max_size : int
+        Maximum size of the cache in bytes.
+        Default is None, in which case
+        ``songdkl.cache.DEFAULT_CACHE_MAX_SIZE`` is used.
+    freq_range : tuple
+        Of two numbers, the lowest and highest frequency in Hz
+        of PSDs computed from syllables, when preparing
+        PSDs from .wav files. Default is (600, 16000).
+    rows : slice, numpy.ndarray
+        Rows of PSDs to use from each bird, either a slice,
+        e.g. ``slice(0, 20000)`` or ``slice(None, None, 10)``,
+        or an array of row indices, e.g. returned by ``songdkl.load.subsample_rows``.
+        Default is None, in which case all rows are used.
+        See ``songdkl.load.load``.
+    dtype : str
+        Data type of PSDs, distances and similarities,
+        one of {'float64', 'float32'}.
+        Using 'float32' halves the memory used,
+        but results can differ slightly from those computed with 'float64'.
+        Default is 'float64'.
+    threshold : str, float
+        Method used to find the threshold that segments syllables,
+        when preparing PSDs from .wav files, or a number to use as the threshold.
+        Default is 'half-otsu'. See ``songdkl.load.load_or_prep``.
+
+    Returns
+    -------
+    DKL_PQ : numpy.ndarray
+        Matrix with shape (n_birds, n_birds),
+        where ``DKL_PQ[i, j]`` is :math:`D_{KL}(\hat{P}||\hat{Q}`
+        with bird ``i`` used as the reference
+        and bird ``j`` compared with the reference.
+    DKL_QP : numpy.ndarray
+        Same computation as ``DKL_PQ``,
+        but in the opposite direction:
+        Q with respect to P.
+    n_psds : list
+        Of int, number of PSDs used from each bird.
+    """
+    psds = []
+    for path in paths:
+        logger.log(
+            msg=f'Getting PSDs from path: {path}',
+            level=logging.INFO
+        )
+        psds.append(
+            # we load all PSDs into memory since they are used once for each reference bird
+            load_or_prep(path, max_wavs, max_num_psds, cache_dir, cache_max_size, freq_range, rows, dtype=dtype,
+                         threshold=threshold)
+        )
+
+    DKL_PQ, DKL_QP, n_psds = calculate_matrix(psds, ks, n_basis, basis, gmm_kwargs, dtype)
+
+    if output_path is not None:
+        logger.log(
+            msg=f'Saving matrices to: {output_path}',
+            level=logging.INFO
+        )
+        save_matrix(output_path, DKL_PQ, DKL_QP, paths, ks, n_psds, n_basis, basis)
+
+    return DKL_PQ, DKL_QP, n_psds
+
+
+def save_matrix(output_path: str | pathlib.Path,
+                DKL_PQ: np.ndarray,
+                DKL_QP: np.ndarray,
+                paths: list[str | pathlib.Path],
+                ks: list[int],
+                n_psds: list[int],
+                n_basis: int,
+                basis: str) -> None:
+    """Save matrices returned by ``calculate_matrix`` in a .zarr file.
+
+    The matrices are saved as arrays named "DKL_PQ" and "DKL_QP"
+    in a ``zarr.Group``. The paths to the data from each bird,
+    the values for ``ks``, ``n_psds``, ``n_basis`` and ``basis``
+    are saved as attributes of the group,
+    so that the rows and columns of the matrices can be identified.
+
+    Parameters
+    ----------
+    output_path : str, pathlib.Path
+        Path where .zarr file should be saved.
+    DKL_PQ : numpy.ndarray
+    DKL_QP : numpy.ndarray
+    paths : list
+        Of str or pathlib.Path, paths to data from each bird,
+        in the order of the rows and columns of the matrices.
+    ks : list
+        Of int, number of syllable classes in song of each bird.
+    n_psds : list
+        Of int, number of PSDs used from each bird.
+    n_basis : int
+        Number of syllables used as basis set.
+    basis : str
+        How basis set was selected.
+    """
+    root = zarr.open_group(str(output_path), mode='w')
+    root.array('DKL_PQ', DKL_PQ)
+    root.array('DKL_QP', DKL_QP)
+    root.attrs.update(
+        {
+            'paths': [str(path) for path in paths],
+            'ks': [int(k) for k in ks],
+            'n_psds': [int(n) for n in n_psds],
+            'n_basis': n_basis,
+            'basis': basis,
+        }
+    )
@@ -4,15 +4,26 @@ power spectral densities (PSDs).
 Used by both ``songdkl`` and ``numsyls`` modules.
 """
 from __future__ import annotations
+import concurrent.futures
+import contextlib
 import dataclasses
+import os
 import pathlib
+from typing import Iterator
 
 import dask.bag
 import dask.diagnostics.progress
-import matplotlib.mlab
 import numpy as np
+import rich.progress
 
 from . import audio
+from .constants import DEFAULT_FREQ_RANGE, THRESHOLDS
+from .psd import band_bins, welch_psd
+
+
+# schedulers that ``dask`` can use to segment .wav files and compute PSDs;
+# 'distributed' starts a local cluster and requires the optional ``distributed`` package
+SCHEDULERS = ('threads', 'processes', 'synchronous', 'distributed')
 
 
 def norm(arr: np.ndarray) -> np.ndarray:
@@ -44,9 +55,11 @@ class SyllablesFromWav:
 
     Attributes
     ----------
-    syls : list
+    syls : list, None
         Of ``numpy.ndarray``, syllables
-        returned by ``songdkl.audio.getsyls``
+        returned by ``songdkl.audio.get_syllable_clips_from_audio``.
+        None if the syllables were not kept,
+        e.g. when only their PSDs are needed, see ``iter_syls_and_psds``.
     slices: list
         Of ``slice`` objects,
         returned by ``audio.get_syllable_clips_from_audio``
@@ -58,21 +71,352 @@ class SyllablesFromWav:
     rate : int
         Sampling rate of .wav file.
     """
-    syls: list[np.ndarray]
+    syls: list[np.ndarray] | None
     slices: list[slice]
     threshold: float
     wav_path: str | pathlib.Path
     rate: int
 
 
+@contextlib.contextmanager
+def dask_scheduler(scheduler: str | None = None, n_workers: int | None = None) -> Iterator[None]:
+    """Context manager that sets the scheduler and number of workers
+    that ``dask`` uses to segment .wav files and compute PSDs,
+    for all computations inside the context.
+
+    If ``scheduler`` is 'distributed', a local cluster is started
+    with ``n_workers`` worker processes, one thread each,
+    and closed when the context exits.
+    This requires the ``distributed`` package, that can be installed
+    with ``pip install songdkl[distributed]``.
+    For other schedulers, ``dask.config.set`` is used.
+    If neither ``scheduler`` nor ``n_workers`` is specified,
+    the configuration of ``dask`` is not changed.
+
+    Parameters
+    ----------
+    scheduler : str
+        One of {'threads', 'processes', 'synchronous', 'distributed'}.
+        Default is None, in which case the scheduler already configured
+        for ``dask`` is used, that is 'processes' unless it was changed,
+        or 'synchronous' if ``n_workers`` is 1.
+    n_workers : int
+        Number of workers. If -1, use one worker per CPU.
+        Default is None, in which case the number of workers
+        already configured for ``dask`` is used, that is one per CPU unless it was changed.
+    """
+    if scheduler is not None and scheduler not in SCHEDULERS:
+        raise ValueError(
+            f'`scheduler` must be one of {SCHEDULERS}, but was: {scheduler}'
+        )
+    if n_workers == -1:
+        n_workers = os.cpu_count()
+    elif n_workers is not None and n_workers < 1:
+        raise ValueError(
+            f'`n_workers` must be a positive integer or -1, but was: {n_workers}'
+        )
+
+    if scheduler == 'distributed':
+        try:
+            import distributed
+        except ImportError as e:
+            raise ImportError(
+                "The 'distributed' scheduler requires the `distributed` package, "
+                "that can be installed with `pip install songdkl[distributed]`"
+            ) from e
+        with distributed.LocalCluster(n_workers=n_workers, threads_per_worker=1,
+                                      dashboard_address=None) as cluster:
+            # the client sets itself as the default scheduler until it is closed
+            with distributed.Client(cluster):
+                yield
+        return
+
+    if scheduler is None and n_workers == 1:
+        # don't start a pool with one worker, just run in this process
+        scheduler = 'synchronous'
+    config = {}
+    if scheduler is not None:
+        config['scheduler'] = scheduler
+    if n_workers is not None:
+        config['num_workers'] = n_workers
+    with dask.config.set(config):
+        yield
+
+
+def _from_sequence(seq: list, partition_size: int | None = None) -> dask.bag.Bag:
+    """Helper function that makes a ``dask.bag`` from a sequence,
+    with ``partition_size`` elements in each partition"""
+    if partition_size is not None and partition_size < 1:
+        raise ValueError(
+            f'`partition_size` must be a positive integer, but was: {partition_size}'
+        )
+    return dask.bag.from_sequence(seq, partition_size=partition_size)
+
+
+def _pooled_method(threshold: str | float | int) -> str | None:
+    """Helper function that validates ``threshold``, and returns
+    the method used to compute a pooled threshold, e.g. 'half-otsu' for 'pooled-half-otsu',
+    or None if ``threshold`` is not pooled"""
+    if isinstance(threshold, str):
+        if threshold not in THRESHOLDS:
+            raise ValueError(
+                f'If `threshold` is a string, it must be one of {THRESHOLDS}, but was: {threshold}'
+            )
+        if threshold.startswith('pooled-'):
+            return threshold[len('pooled-'):]
+        return None
+    elif isinstance(threshold, bool) or not isinstance(threshold, (float, int)):
+        raise ValueError(
+            f'`threshold` must be one of {THRESHOLDS} or a float or int value, but was: {threshold}'
+        )
+    return None
+
+
+def resolve_threshold(wav_paths: list[str] | list[pathlib.Path],
+                      threshold: str | float | int = 'half-otsu') -> str | float | int:
+    """Resolve the threshold used to segment a list of .wav files,
+    e.g. all the songs recorded from one bird.
+
+    If ``threshold`` is 'pooled-half-otsu' or 'pooled-half-average',
+    one threshold is computed for all the files with ``audio.threshold_from_wavs``,
+    from a histogram of the amplitude envelope pooled across files,
+    and that value is returned. Otherwise ``threshold`` is returned unchanged,
+    and a threshold is found for each file when it is segmented.
+    To save a pooled threshold so it is not computed again,
+    see ``songdkl.cache.threshold_with_cache``.
+
+    Parameters
+    ----------
+    wav_paths : list
+        Of str or pathlib.Path, paths to .wav files.
+    threshold : str, float, int
+        One of {'half-otsu', 'half-average', 'pooled-half-otsu', 'pooled-half-average'},
+        or a float or int value. Default is 'half-otsu'.
+
+    Returns
+    -------
+    threshold : str, float, int
+        Either the threshold value computed for all the files,
+        or ``threshold`` unchanged.
+    """
+    method = _pooled_method(threshold)
+    if method is None:
+        return threshold
+    return audio.threshold_from_wavs(wav_paths, method)
+
+
+def _syllabify(wav_path: str | pathlib.Path) -> SyllablesFromWav:
+    """Helper function that loads a .wav file and segments it into syllables"""
+    rate, data = audio.load_wav(wav_path)
+    syls_this_wav, slices_this_wav, threshold_value = audio.get_syllable_clips_from_audio(data, rate)
+    return SyllablesFromWav(syls=syls_this_wav, slices=slices_this_wav, threshold=threshold_value,
+                            wav_path=wav_path, rate=rate)
+
+
+def _psds(signals: list[np.ndarray],
+          rate: int,
+          freq_range: tuple[float, float] = DEFAULT_FREQ_RANGE) -> np.ndarray:
+    """Helper function that computes normalized PSDs of signals,
+    e.g. all the syllables from one .wav file,
+    returned as an array with one row per signal.
+    Signals are normalized as they are copied into frames for the FFT,
+    so they can be views into the audio from a .wav file"""
+    nfft = int(round(2 ** 14 / 32000.0 * rate))
+    bins = band_bins(freq_range, nfft, rate)
+    # compute PSDs of all syllables at once, equivalent to calling ``matplotlib.mlab.psd`` on each,
+    # but only for the frequency bins we keep
+    psds = welch_psd(signals, nfft=nfft, fs=rate, bins=bins, normalize=True)
+    for row in range(len(psds)):
+        psds[row] = norm(psds[row])
+    return psds
+
+
+def _syls_to_psds(syls_from_wav: SyllablesFromWav,
+                  freq_range: tuple[float, float] = DEFAULT_FREQ_RANGE) -> np.ndarray:
+    """Helper function that computes normalized PSDs
+    of all syllables from one .wav file,
+    returned as an array with one row per syllable"""
+    return _psds(syls_from_wav.syls, syls_from_wav.rate, freq_range)
+
+
+def _syllabify_and_convert(wav_path: str | pathlib.Path,
+                           freq_range: tuple[float, float],
+                           keep_syls: bool = True,
+                           threshold: str | float | int = 'half-otsu') -> tuple[SyllablesFromWav, np.ndarray]:
+    """Helper function that segments a .wav file and computes PSDs of its syllables in one step.
+
+    The .wav file is memory-mapped. Files with more than ``audio.SEGMENT_BLOCKED_MIN_SAMPLES`` samples
+    are segmented in blocks of at most ``audio.SEGMENT_BLOCK_SIZE`` samples,
+    so that only one block at a time is converted to float, however long the file is.
+    Shorter files are segmented all at once, since segmenting in blocks filters the audio up to three times.
+    PSDs are computed from views into the memory-mapped audio, so syllables are never copied.
+    If ``keep_syls`` is False, the returned ``SyllablesFromWav`` has only
+    the slices and metadata, with ``syls=None``, so that the audio
+    is not sent back from the worker.
+    If ``threshold`` is a number, e.g. one computed for all files
+    with ``audio.threshold_from_wavs``, it is used instead of computing a threshold for this file"""
+    try:
+        rate, data = audio.load_wav(wav_path, mmap=True)
+    except ValueError:
+        # some .wav files can't be memory-mapped, e.g. 24-bit files, or files shorter than their header says
+        rate, data = audio.load_wav(wav_path)
+    # only segment in blocks when a file is long enough that segmenting it all at once would use a lot of memory
+    block_size = audio.SEGMENT_BLOCK_SIZE if len(data) > audio.SEGMENT_BLOCKED_MIN_SAMPLES else None
+    slices, threshold_value = audio.get_syllable_slices_from_audio(data, rate, threshold=threshold,
+                                                                   block_size=block_size)
+    syls = [data[slice_] for slice_ in slices]
+    psds = _psds(syls, rate, freq_range)
+    if keep_syls:
+        # copy syllables out of the memory-mapped file, so they can be kept after it is closed
+        syls = [np.array(syl) for syl in syls]
+    syls_from_wav = SyllablesFromWav(syls=syls if keep_syls else None, slices=slices, threshold=threshold_value,
+                                     wav_path=wav_path, rate=rate)
+    return syls_from_wav, psds
+
+
+def _wav_to_psds(wav_path: str | pathlib.Path,
+                 freq_range: tuple[float, float],
+                 threshold: str | float | int = 'half-otsu') -> np.ndarray:
+    """Helper function that segments a .wav file and computes PSDs of its syllables in one step,
+    returning only the PSDs, so the syllable clips are never sent between workers"""
+    _, psds = _syllabify_and_convert(wav_path, freq_range, keep_syls=False, threshold=threshold)
+    return psds
+
+
+def iter_syls_and_psds(wav_paths: list[str] | list[pathlib.Path],
+                       max_num_psds: int | None = None,
+                       freq_range: tuple[float, float] = DEFAULT_FREQ_RANGE,
+                       batch_size: int | None = None,
+                       n_workers: int | None = None,
+                       scheduler: str | None = None,
+                       partition_size: int | None = None,
+                       keep_syls: bool = True,
+                       threshold: str | float | int = 'half-otsu',
+                       ) -> Iterator[tuple[SyllablesFromWav, np.ndarray]]:
+    """Generator that segments .wav files into syllables
+    and computes PSDs of those syllables,
+    yielding the results one .wav file at a time.
+
+    The .wav files are processed in parallel with ``dask``,
+    in batches of ``batch_size`` files.
+    While the results from one batch are yielded,
+    e.g. to be written to disk, the next batch is computed
+    in the background, so at most two batches
+    of audio and syllables are held in memory at a time.
+    Once ``max_num_psds`` PSDs have been computed,
+    no more .wav files are read.
 
-def get_all_syls(wav_paths: list[str] | list[pathlib.Path]) -> list[SyllablesFromWav]:
+    Parameters
+    ----------
+    wav_paths : list
+        Of str or pathlib.Path, paths to .wav files.
+    max_num_psds : int
+        Maximum number of PSDs to compute.
+        Default is None, in which case
+        PSDs will be computed for all syllables.
+        When this number is reached, the PSDs from
+        the last .wav file are truncated, and iteration stops.
+    freq_range : tuple
+        Of two numbers, the lowest and highest frequency in Hz
+        of the PSDs. Default is (600, 16000).
+    batch_size : int
+        Number of .wav files to process in parallel at a time.
+        Default is None, in which case it is four times the number of workers.
+    n_workers : int
+        Number of workers used by ``dask`` to process .wav files.
+        If 1, files are processed in this process, without starting any workers.
+        Default is None, in which case ``dask`` uses one worker per CPU.
+    scheduler : str
+        Scheduler used by ``dask``, one of
+        {'threads', 'processes', 'synchronous', 'distributed'}.
+        Default is None, in which case the scheduler configured for ``dask`` is used.
+        See ``dask_scheduler``.
+    partition_size : int
+        Number of .wav files in each partition of the ``dask.bag``,
+        i.e., processed by one task. Default is None,
+        in which case ``dask`` chooses the partition size.
+    keep_syls : bool
+        If True, the default, the audio of each syllable
+        is returned from the workers as the ``syls`` attribute
+        of each ``SyllablesFromWav``. If False, ``syls`` is None,
+        and only the PSDs, the slices that segment syllables,
+        and other metadata are returned, which avoids sending
+        the audio of all syllables between processes.
+    threshold : str, float, int
+        Thresholding method used to segment each .wav file.
+        If 'half-otsu' or 'half-average', a threshold is computed for each file.
+        See ``audio.get_syllable_clips_from_audio``.
+        If 'pooled-half-otsu' or 'pooled-half-average', one threshold is computed
+        for all files before any are segmented, see ``resolve_threshold``.
+        If a number, it is used to segment all files, e.g.
+        a threshold computed once for all the files from one bird
+        with ``audio.threshold_from_wavs``.
+        Default is 'half-otsu'.
+
+    Yields
+    ------
+    syls_from_wav : SyllablesFromWav
+        Syllables segmented from one .wav file.
+    psds : numpy.ndarray
+        PSDs of the syllables, one row per syllable.
+    """
+    if batch_size is None:
+        if n_workers is None or n_workers == -1:
+            # use number of workers configured for ``dask``, e.g. by an enclosing ``dask_scheduler``
+            n_workers_ = dask.config.get('num_workers', None) if n_workers is None else None
+        else:
+            n_workers_ = n_workers
+        batch_size = 4 * (n_workers_ or os.cpu_count() or 1)
+    batches = [wav_paths[start:start + batch_size] for start in range(0, len(wav_paths), batch_size)]
+    threshold = resolve_threshold(wav_paths, threshold) if wav_paths else threshold
+
+    def _compute(batch):
+        bag = _from_sequence(batch, partition_size)
+        return bag.map(_syllabify_and_convert, freq_range=freq_range, keep_syls=keep_syls,
+                       threshold=threshold).compute()
+
+    n_psds = 0
+    with dask_scheduler(scheduler, n_workers), rich.progress.Progress() as progress, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=1) as prefetcher:
+        task = progress.add_task('Computing PSDs from .wav files', total=len(wav_paths))
+        future = prefetcher.submit(_compute, batches[0]) if batches else None
+        for batch_ind in range(len(batches)):
+            results = future.result()
+            progress.advance(task, len(results))
+            n_psds_batch = sum(len(psds) for _, psds in results)
+            if batch_ind + 1 < len(batches) and not (max_num_psds and n_psds + n_psds_batch >= max_num_psds):
+                # compute the next batch while results from this one are used
+                future = prefetcher.submit(_compute, batches[batch_ind + 1])
+            for syls_from_wav, psds in results:
+                if max_num_psds:
+                    psds = psds[:max_num_psds - n_psds]
+                n_psds += len(psds)
+                yield syls_from_wav, psds
+                if max_num_psds and n_psds >= max_num_psds:
+                    return
+
+
+def get_all_syls(wav_paths: list[str] | list[pathlib.Path],
+                 scheduler: str | None = None,
+                 n_workers: int | None = None,
+                 partition_size: int | None = None) -> list[SyllablesFromWav]:
     """Get all syllables from a list of .wav files.
 
     Parameters
     ----------
     wav_paths : list
         Of str, absolute paths to .wav files
+    scheduler : str
+        Scheduler used by ``dask``, one of
+        {'threads', 'processes', 'synchronous', 'distributed'}.
+        Default is None, in which case the scheduler configured for ``dask`` is used.
+        See ``dask_scheduler``.
+    n_workers : int
+        Number of workers used by ``dask``. If -1, use one worker per CPU.
+        Default is None, in which case the number configured for ``dask`` is used.
+    partition_size : int
+        Number of .wav files in each partition of the ``dask.bag``.
+        Default is None, in which case ``dask`` chooses the partition size.
 
     Returns
     -------
@@ -86,25 +430,27 @@ def get_all_syls(wav_paths: list[str] | list[pathlib.Path]) -> list[SyllablesFro
         for the .wav file the syllables
         are taken from.
     """
-    bag = dask.bag.from_sequence(wav_paths)
+    bag = _from_sequence(wav_paths, partition_size)
 
-    def _syllabify(wav_path):
-        rate, data = audio.load_wav(wav_path)
-        syls_this_wav, slices_this_wav, threshold_value = audio.get_syllable_clips_from_audio(data, rate)
-        return SyllablesFromWav(syls=syls_this_wav, slices=slices_this_wav, threshold=threshold_value,
-                                wav_path=wav_path, rate=rate)
-
-    with dask.diagnostics.progress.ProgressBar():
+    with dask_scheduler(scheduler, n_workers), dask.diagnostics.progress.ProgressBar():
         syls_from_wavs = bag.map(_syllabify).compute()
 
     return syls_from_wavs
 
 
 def convert_syl_to_psd(syls_from_wavs: list[SyllablesFromWav],
-                       max_num_psds: int | None = None
+                       max_num_psds: int | None = None,
+                       freq_range: tuple[float, float] = DEFAULT_FREQ_RANGE,
+                       scheduler: str | None = None,
+                       n_workers: int | None = None,
+                       partition_size: int | None = None,
                        ) -> list[np.ndarray]:
     """Convert syllable segments to power spectral densities (PSDs).
 
+    Note that this sends the audio of all syllables to the workers;
+    to segment .wav files and compute PSDs without
+    sending syllables between workers, use ``get_all_psds``.
+
     Parameters
     ----------
     syls_from_wavs : list
@@ -114,6 +460,21 @@ def convert_syl_to_psd(syls_from_wavs: list[SyllablesFromWav],
         Maximum number of PSDs to calculate.
         Default is None, in which case
         PSDs will be computed for all syllables.
+    freq_range : tuple
+        Of two numbers, the lowest and highest frequency in Hz
+        of the PSDs. Only frequency bins in this range
+        are computed and returned. Default is (600, 16000).
+    scheduler : str
+        Scheduler used by ``dask``, one of
+        {'threads', 'processes', 'synchronous', 'distributed'}.
+        Default is None, in which case the scheduler configured for ``dask`` is used.
+        See ``dask_scheduler``.
+    n_workers : int
+        Number of workers used by ``dask``. If -1, use one worker per CPU.
+        Default is None, in which case the number configured for ``dask`` is used.
+    partition_size : int
+        Number of ``SyllablesFromWav`` in each partition of the ``dask.bag``.
+        Default is None, in which case ``dask`` chooses the partition size.
 
     Returns
     -------
@@ -121,22 +482,10 @@ def convert_syl_to_psd(syls_from_wavs: list[SyllablesFromWav],
         Of ``numpy.ndarray``,
         PSDs from segmented syllables.
     """
-    bag = dask.bag.from_sequence(syls_from_wavs)
-
-    def _to_psd(syls_from_wav):
-        fs = syls_from_wav.rate
-        nfft = int(round(2 ** 14 / 32000.0 * fs))
-        segstart = int(round(600 / (fs / float(nfft))))
-        segend = int(round(16000 / (fs / float(nfft))))
-        psds = []
-        for syl in syls_from_wav.syls:
-            Pxx, _ = matplotlib.mlab.psd(norm(syl), NFFT=nfft, Fs=fs)
-            psds.append(Pxx)
-        spsds = [norm(psd[segstart:segend]) for psd in psds]
-        return spsds
-
-    with dask.diagnostics.progress.ProgressBar():
-        segedpsds = bag.map(_to_psd).compute()
+    bag = _from_sequence(syls_from_wavs, partition_size)
+
+    with dask_scheduler(scheduler, n_workers), dask.diagnostics.progress.ProgressBar():
+        segedpsds = bag.map(_syls_to_psds, freq_range=freq_range).compute()
     segedpsds = [
         psd
         for psd_list in segedpsds
@@ -146,3 +495,68 @@ def convert_syl_to_psd(syls_from_wavs: list[SyllablesFromWav],
         # since we are likely over `max_num_psds` even after `break` above
         segedpsds = segedpsds[:max_num_psds]
     return segedpsds
+
+
+def get_all_psds(wav_paths: list[str] | list[pathlib.Path],
+                 max_num_psds: int | None = None,
+                 freq_range: tuple[float, float] = DEFAULT_FREQ_RANGE,
+                 scheduler: str | None = None,
+                 n_workers: int | None = None,
+                 partition_size: int | None = None,
+                 threshold: str | float | int = 'half-otsu') -> list[np.ndarray]:
+    """Segment .wav files into syllables and compute
+    power spectral densities (PSDs) of those syllables.
+
+    Returns the same PSDs as ``convert_syl_to_psd(get_all_syls(wav_paths))``,
+    but each .wav file is segmented and converted to PSDs in one task,
+    so only the PSDs are returned from the workers,
+    instead of sending the audio of all syllables back from the workers
+    and then out to them again to compute PSDs.
+
+    Parameters
+    ----------
+    wav_paths : list
+        Of str or pathlib.Path, paths to .wav files.
+    max_num_psds : int
+        Maximum number of PSDs to return.
+        Default is None, in which case
+        PSDs are returned for all syllables.
+    freq_range : tuple
+        Of two numbers, the lowest and highest frequency in Hz
+        of the PSDs. Default is (600, 16000).
+    scheduler : str
+        Scheduler used by ``dask``, one of
+        {'threads', 'processes', 'synchronous', 'distributed'}.
+        Default is None, in which case the scheduler configured for ``dask`` is used.
+        See ``dask_scheduler``.
+    n_workers : int
+        Number of workers used by ``dask``. If -1, use one worker per CPU.
+        Default is None, in which case the number configured for ``dask`` is used.
+    partition_size : int
+        Number of .wav files in each partition of the ``dask.bag``.
+        Default is None, in which case ``dask`` chooses the partition size.
+    threshold : str, float, int
+        Thresholding method used to segment each .wav file.
+        A pooled threshold, e.g. 'pooled-half-otsu', is computed once
+        for all files before any are segmented, see ``resolve_threshold``.
+        See ``iter_syls_and_psds``. Default is 'half-otsu'.
+
+    Returns
+    -------
+    segedpsds : list
+        Of ``numpy.ndarray``,
+        PSDs from segmented syllables.
+    """
+    bag = _from_sequence(wav_paths, partition_size)
+    threshold = resolve_threshold(wav_paths, threshold) if wav_paths else threshold
+
+    with dask_scheduler(scheduler, n_workers), dask.diagnostics.progress.ProgressBar():
+        psds_per_wav = bag.map(_wav_to_psds, freq_range=freq_range, threshold=threshold).compute()
+    segedpsds = [
+        psd
+        for psds in psds_per_wav
+        for psd in psds
+    ]
+    if max_num_psds:
+        segedpsds = segedpsds[:max_num_psds]
+    return segedpsds
@@ -1,17 +1,23 @@
 import numpy as np
+import scipy.signal
+from scipy import ndimage
 import songdkl
 
 import pytest
 
 
 @pytest.mark.smoke
-def test_load_wav(wav_path):
+@pytest.mark.parametrize('mmap', [False, True])
+def test_load_wav(wav_path, mmap):
     """Test that ``load_wav`` returns expected objects"""
-    out = songdkl.audio.load_wav(wav_path)
+    out = songdkl.audio.load_wav(wav_path, mmap=mmap)
     assert len(out) == 2
     samp_freq, data = out
     assert isinstance(samp_freq, int)
     assert isinstance(data, np.ndarray)
+    assert isinstance(data, np.memmap) == mmap
+    if mmap:
+        np.testing.assert_array_equal(data, songdkl.audio.load_wav(wav_path)[1])
 
 
 @pytest.mark.smoke
@@ -22,6 +28,43 @@ def test_filtersong(wav_data):
     # TODO: actually test that filtering worked somehow
 
 
+def test_filtersong_matches_filtfilt(samp_freq_and_wav_data):
+    """Test that filtering with second-order sections gives the same result
+    as filtering with the transfer function, as ``filtersong`` did previously"""
+    samp_freq, data = samp_freq_and_wav_data
+    b, a = scipy.signal.iirdesign(wp=0.04, ws=0.02, gpass=1, gstop=60, ftype='ellip')
+    expected = scipy.signal.filtfilt(b, a, data)
+    filtered = songdkl.audio.filtersong(data, samp_freq)
+    np.testing.assert_allclose(filtered, expected, rtol=0, atol=1e-9 * np.abs(expected).max())
+    np.testing.assert_array_equal(filtered, songdkl.audio.filtersong(data))
+    np.testing.assert_array_equal(filtered, songdkl.audio.filtersong(data, samp_freq, cutoff=samp_freq * 0.02))
+
+
+def test_filtersong_cutoff(samp_freq_and_wav_data):
+    samp_freq, data = samp_freq_and_wav_data
+    sos = songdkl.audio.highpass_sos(2000., float(samp_freq))
+    _, response = scipy.signal.sosfreqz(sos, worN=[500., 1000., 2000., 4000.], fs=samp_freq)
+    gain_db = 20 * np.log10(np.abs(response))
+    # stopband edge is half the cutoff, and passband ripple is 1 dB
+    assert np.all(gain_db[:2] <= -60 + 1e-6)
+    assert np.all(gain_db[2:] >= -1 - 1e-6)
+    filtered = songdkl.audio.filtersong(data, samp_freq, cutoff=2000.)
+    np.testing.assert_array_equal(filtered, scipy.signal.sosfiltfilt(sos, data))
+
+
+def test_highpass_sos_cached():
+    songdkl.audio.highpass_sos.cache_clear()
+    sos = songdkl.audio.highpass_sos(640., 32000.)
+    assert songdkl.audio.highpass_sos(640., 32000.) is sos
+    assert songdkl.audio.highpass_sos.cache_info().hits == 1
+
+
+@pytest.mark.parametrize('cutoff', [0., -100., 16000., 20000.])
+def test_highpass_sos_raises(cutoff):
+    with pytest.raises(ValueError):
+        songdkl.audio.highpass_sos(cutoff, 32000.)
+
+
 @pytest.mark.smoke
 @pytest.mark.parametrize(
     'window',
@@ -36,6 +79,50 @@ def test_smoothrect(samp_freq_and_wav_data, window):
     # TODO: actually test that smoothing works somehow
 
 
+@pytest.mark.parametrize('n', [1, 2, 100, 320, 5000])
+@pytest.mark.parametrize(
+    'window, rate',
+    [
+        (2, 32000),
+        (10, 32000),
+        (10, 44100),
+        (1, 1000),
+    ]
+)
+def test_smoothrect_matches_convolve(n, window, rate):
+    """test that computing the moving average with a cumulative sum
+    gives the same result as convolving with a boxcar, as ``smoothrect`` did previously"""
+    audio_arr = np.random.default_rng(42).standard_normal(n) * 1000
+    le = int(round(rate * window / 1000))
+    expected = np.convolve(np.ones(le) / le, abs(audio_arr))
+    offset = int(round((len(expected) - len(audio_arr)) / 2))
+    expected = expected[(1 + offset):(len(audio_arr) + offset)]
+    out = songdkl.audio.smoothrect(audio_arr, window, rate)
+    assert out.shape == expected.shape
+    np.testing.assert_allclose(out, expected, rtol=1e-9, atol=1e-12 * np.abs(audio_arr).sum())
+
+
+@pytest.mark.parametrize('size', [1, 511, 512])
+@pytest.mark.parametrize('p', [0.001, 0.01, 0.5])
+def test_pad_mask(size, p):
+    mask = np.random.default_rng(42).random(5000) < p
+    expected = ndimage.convolve(np.where(mask, 1., 0.), np.ones(size)) > 0.5
+    np.testing.assert_array_equal(songdkl.audio.pad_mask(mask, size), expected)
+
+
+@pytest.mark.parametrize('scale', [1., 1 / 32768])
+def test_threshold_and_pad_below_half(scale, samp_freq_and_wav_data):
+    """test that padding is the same as convolving with a window of ones
+    when the threshold is less than 0.5, e.g. for floating point audio"""
+    samp_freq, data = samp_freq_and_wav_data
+    # scale of 1 / 32768 is the same as floating point audio in the range [-1.0, 1.0]
+    envelope = songdkl.audio.smoothrect(songdkl.audio.filtersong(data * scale, samp_freq), 10, samp_freq)
+    threshold_val = min(songdkl.audio.threshold_otsu(envelope) / 2, 0.3)
+    thresholded = songdkl.audio.apply_threshold(envelope, threshold_val)
+    expected = ndimage.convolve(thresholded, np.ones(songdkl.audio.PAD_SIZE)) > 0.5
+    np.testing.assert_array_equal(songdkl.audio._threshold_and_pad(envelope, threshold_val), expected)
+
+
 WINDOW_FOR_FINDOBJ = 2
 
 
@@ -50,6 +137,54 @@ def test_segment_audio(samp_freq_and_wav_data):
     )
 
 
+def test_segment_audio_matches_label(samp_freq_and_wav_data):
+    """test that segments are the same as those found with
+    ``scipy.ndimage.label`` and ``scipy.ndimage.find_objects``,
+    as ``segment_audio`` did previously"""
+    samp_freq, data = samp_freq_and_wav_data
+    smoothrect = songdkl.audio.smoothrect(data, WINDOW_FOR_FINDOBJ, samp_freq)
+    thresholded = songdkl.audio.apply_threshold(smoothrect)
+    label, _ = ndimage.label(thresholded)
+    expected = [slice_tup[0] for slice_tup in ndimage.find_objects(label)]
+    assert songdkl.audio.segment_audio(thresholded) == expected
+    assert songdkl.audio.segment_audio(thresholded != 0) == expected
+
+
+@pytest.mark.parametrize('n', [0, 1, 2, 1000])
+@pytest.mark.parametrize('p', [0., 0.1, 0.5, 0.9, 1.])
+@pytest.mark.parametrize('min_length', [0, 2, 5.5])
+def test_find_segments(n, p, min_length):
+    mask = np.random.default_rng(42).random(n) < p
+    onsets, offsets = songdkl.audio.find_segments(mask, min_length)
+    label, _ = ndimage.label(mask)
+    expected = [slice_tup[0] for slice_tup in ndimage.find_objects(label)] if n else []
+    expected = [slice_ for slice_ in expected if slice_.stop - slice_.start > min_length]
+    np.testing.assert_array_equal(onsets, [slice_.start for slice_ in expected])
+    np.testing.assert_array_equal(offsets, [slice_.stop for slice_ in expected])
+
+
+@pytest.mark.parametrize('p', [0.1, 0.5, 0.95])
+@pytest.mark.parametrize('min_length', [0, 3])
+def test_segment_detector(p, min_length):
+    rng = np.random.default_rng(42)
+    mask = rng.random(2000) < p
+    expected = songdkl.audio.find_segments(mask, min_length)
+    # split into chunks of random size, including empty chunks and chunks of one sample
+    bounds = np.sort(np.concatenate(([0, 0, 1, 1000, 1000, 2000], rng.integers(0, 2000, size=50))))
+    detector = songdkl.audio.SegmentDetector(min_length)
+    onsets, offsets = [], []
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        onsets_chunk, offsets_chunk = detector.update(mask[start:stop])
+        onsets.append(onsets_chunk)
+        offsets.append(offsets_chunk)
+    onsets_chunk, offsets_chunk = detector.close()
+    onsets.append(onsets_chunk)
+    offsets.append(offsets_chunk)
+    assert detector.n_samples == mask.size
+    np.testing.assert_array_equal(np.concatenate(onsets), expected[0])
+    np.testing.assert_array_equal(np.concatenate(offsets), expected[1])
+
+
 @pytest.mark.smoke
 def test_get_syllable_clips_from_audio(samp_freq_and_wav_data):
     samp_freq, data = samp_freq_and_wav_data
@@ -69,6 +204,126 @@ def test_get_syllable_clips_from_audio(samp_freq_and_wav_data):
     assert isinstance(threshold_value, float)
 
 
+@pytest.mark.parametrize('threshold', ['half-otsu', 'half-average', 1000.])
+def test_get_syllable_slices_from_audio(threshold, samp_freq_and_wav_data):
+    samp_freq, data = samp_freq_and_wav_data
+    slices, threshold_value = songdkl.audio.get_syllable_slices_from_audio(data, samp_freq, threshold=threshold)
+    syllables, expected_slices, expected_threshold_value = songdkl.audio.get_syllable_clips_from_audio(
+        data, samp_freq, threshold=threshold
+    )
+    assert slices == expected_slices
+    assert threshold_value == expected_threshold_value
+
+
+@pytest.mark.parametrize('threshold', ['half-otsu', 'half-average', 1000.])
+@pytest.mark.parametrize('block_size', [5000, songdkl.audio.SEGMENT_BLOCK_SIZE])
+def test_get_syllable_slices_from_audio_block_size(threshold, block_size, wav_path):
+    rate, data = songdkl.audio.load_wav(wav_path)
+    expected_slices, expected_threshold_value = songdkl.audio.get_syllable_slices_from_audio(
+        data, rate, threshold=threshold
+    )
+    rate, data = songdkl.audio.load_wav(wav_path, mmap=True)
+    slices, threshold_value = songdkl.audio.get_syllable_slices_from_audio(
+        data, rate, threshold=threshold, block_size=block_size
+    )
+    assert slices == expected_slices
+    assert threshold_value == pytest.approx(expected_threshold_value, rel=1e-10)
+
+
+@pytest.mark.parametrize('threshold', ['half-otsu', 'half-average', 0.3, 1000.])
+@pytest.mark.parametrize('block_size', [5000, songdkl.audio.SEGMENT_BLOCK_SIZE])
+def test_iter_syllable_slices_from_wav(threshold, block_size, wav_path):
+    rate, data = songdkl.audio.load_wav(wav_path)
+    expected_slices, expected_threshold_value = songdkl.audio.get_syllable_slices_from_audio(
+        data, rate, threshold=threshold
+    )
+    threshold_value = songdkl.audio.threshold_from_wav(wav_path, threshold, block_size)
+    assert threshold_value == pytest.approx(expected_threshold_value, rel=1e-10)
+    slices = list(
+        songdkl.audio.iter_syllable_slices_from_wav(wav_path, threshold=threshold, block_size=block_size)
+    )
+    assert slices == expected_slices
+
+
+@pytest.mark.parametrize('max_blocks', [1, 3, 1000])
+def test_threshold_from_wav_max_blocks(max_blocks, wav_path):
+    threshold_value = songdkl.audio.threshold_from_wav(wav_path, block_size=5000, max_blocks=max_blocks)
+    assert isinstance(threshold_value, float)
+    assert threshold_value > 0.
+    if max_blocks == 1000:
+        # more blocks than in file, so all are used
+        assert threshold_value == songdkl.audio.threshold_from_wav(wav_path, block_size=5000)
+
+
+@pytest.mark.parametrize(
+    'kwargs',
+    [
+        dict(threshold='otsu'),
+        dict(threshold=None),
+        dict(block_size=0),
+        dict(block_size=1.5),
+        dict(max_blocks=0),
+    ]
+)
+def test_threshold_from_wav_raises(kwargs, wav_path):
+    with pytest.raises(ValueError):
+        songdkl.audio.threshold_from_wav(wav_path, **kwargs)
+
+
+@pytest.mark.parametrize('threshold', ['half-otsu', 'half-average'])
+def test_envelope_histogram(threshold, wav_path):
+    rate, data = songdkl.audio.load_wav(wav_path)
+    envelope = songdkl.audio.smoothrect(songdkl.audio.filtersong(data, rate), 10, rate)
+    _, expected_threshold_value = songdkl.audio.get_syllable_slices_from_audio(data, rate, threshold=threshold)
+
+    histogram = songdkl.audio.EnvelopeHistogram(songdkl.audio.envelope_max(data.dtype))
+    # add envelope in chunks, and check that merging histograms gives the same counts
+    other = songdkl.audio.EnvelopeHistogram(songdkl.audio.envelope_max(data.dtype))
+    half = len(envelope) // 2
+    for start in range(0, half, 5000):
+        histogram.update(envelope[start:min(start + 5000, half)])
+    other.update(envelope[half:])
+    histogram.merge(other)
+    assert histogram.counts.sum() == histogram.n_values == len(envelope)
+
+    threshold_value = histogram.threshold(threshold)
+    if threshold == 'half-average':
+        assert threshold_value == pytest.approx(expected_threshold_value, rel=1e-10)
+    else:
+        # computed from different bins than ``threshold_otsu``, so only approximately the same
+        assert threshold_value == pytest.approx(expected_threshold_value, rel=0.05)
+
+
+def test_envelope_histogram_raises():
+    with pytest.raises(ValueError):
+        songdkl.audio.EnvelopeHistogram(0.)
+    with pytest.raises(ValueError):
+        songdkl.audio.EnvelopeHistogram(1., n_bins=1)
+    histogram = songdkl.audio.EnvelopeHistogram(1.)
+    with pytest.raises(ValueError):
+        # no values yet
+        histogram.threshold()
+    histogram.update(np.array([0.5]))
+    with pytest.raises(ValueError):
+        histogram.threshold('otsu')
+    with pytest.raises(ValueError):
+        histogram.merge(songdkl.audio.EnvelopeHistogram(2.))
+
+
+@pytest.mark.parametrize('threshold', ['half-otsu', 'half-average'])
+def test_threshold_from_wavs(threshold, list_of_wav_paths):
+    threshold_value = songdkl.audio.threshold_from_wavs(list_of_wav_paths, threshold, block_size=5000)
+    expected = songdkl.audio.envelope_histogram_from_wav(list_of_wav_paths[0], block_size=5000)
+    for wav_path in list_of_wav_paths[1:]:
+        expected.merge(songdkl.audio.envelope_histogram_from_wav(wav_path, block_size=5000))
+    assert threshold_value == expected.threshold(threshold)
+    if threshold == 'half-average':
+        # average is exact, so for one file it is the same as the threshold for that file
+        assert songdkl.audio.threshold_from_wavs(list_of_wav_paths[:1], threshold) == pytest.approx(
+            songdkl.audio.threshold_from_wav(list_of_wav_paths[0], threshold), rel=1e-10
+        )
+
+
 @pytest.mark.parametrize(
     'threshold_method',
     [
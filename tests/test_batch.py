@@ -0,0 +1,147 @@
+import io
+import multiprocessing
+import os
+
+import dask
+import numpy as np
+import pytest
+
+import songdkl.batch
+
+
+ZARR_PATHS = {
+    'bk1bk3': './tests/data-for-tests/generated/song_data/bk1bk3-small/bk1bk3-small.songdkl.zarr',
+    'bk1bk9': './tests/data-for-tests/generated/song_data/bk1bk9-small/bk1bk9-small.songdkl.zarr',
+}
+
+JOBS = [
+    songdkl.batch.CalculateJob(ZARR_PATHS['bk1bk3'], ZARR_PATHS['bk1bk9'], 6, 9),
+    songdkl.batch.CalculateJob(ZARR_PATHS['bk1bk9'], ZARR_PATHS['bk1bk3'], 9, 6),
+]
+
+
+@pytest.mark.parametrize(
+    'header',
+    [
+        True,
+        False,
+    ]
+)
+def test_read_manifest(header, tmp_path):
+    manifest_path = tmp_path / 'manifest.tsv'
+    lines = []
+    if header:
+        lines.append('\t'.join(songdkl.batch.MANIFEST_COLUMNS))
+    lines.append('# a comment')
+    for job in JOBS:
+        lines.append(f'{job.ref_path}\t{job.compare_path}\t{job.k_ref}\t{job.k_compare}')
+    manifest_path.write_text('\n'.join(lines) + '\n')
+
+    jobs = songdkl.batch.read_manifest(manifest_path)
+    assert jobs == JOBS
+
+
+def test_read_manifest_raises(tmp_path):
+    manifest_path = tmp_path / 'manifest.tsv'
+    manifest_path.write_text(f'{ZARR_PATHS["bk1bk3"]}\t{ZARR_PATHS["bk1bk9"]}\t6\n')
+    with pytest.raises(ValueError):
+        songdkl.batch.read_manifest(manifest_path)
+
+
+def test_estimate_n_psds():
+    array_len = len(songdkl.load.load(ZARR_PATHS['bk1bk3']))
+    assert songdkl.batch.estimate_n_psds(ZARR_PATHS['bk1bk3']) == array_len
+    assert songdkl.batch.estimate_n_psds('./tests/data-for-tests/source/song_data/bk1bk3-small', 100) == 100
+
+
+@pytest.mark.smoke
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_calculate_batch(n_jobs):
+    output = io.StringIO()
+    results = songdkl.batch.calculate_batch(JOBS, n_jobs=n_jobs, output=output,
+                                            max_wavs=None, max_num_psds=None)
+    assert len(results) == len(JOBS)
+    for job, result in zip(JOBS, results):
+        assert isinstance(result, songdkl.batch.CalculateResult)
+        assert result.job == job
+        assert result.error is None
+        assert isinstance(result.DKL_PQ, float)
+        assert isinstance(result.DKL_QP, float)
+    rows = output.getvalue().splitlines()
+    assert len(rows) == len(JOBS)
+    assert sorted(rows) == sorted([result.to_tsv_row(n_basis=50) for result in results])
+
+
+def _crashing_run_job(job_ind, job, calculate_kwargs, scheduler=None, n_workers=None):
+    """replaces ``songdkl.batch._run_job`` in worker processes,
+    to test that we recover when one crashes"""
+    if songdkl.batch._STARTED_QUEUE is not None:
+        songdkl.batch._STARTED_QUEUE.put(job_ind)
+    if job.ref_path == 'crash':
+        os._exit(1)
+    if job.ref_path == 'raise':
+        raise ValueError('job failed')
+    return 0.5, 0.5, 100, 100
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                    reason='relies on monkeypatched function being inherited by forked worker processes')
+def test_calculate_batch_survives_crash(monkeypatch):
+    monkeypatch.setattr(songdkl.batch, '_run_job', _crashing_run_job)
+    jobs = [
+        songdkl.batch.CalculateJob(f'ref{ind}', f'compare{ind}', 6, 9)
+        for ind in range(6)
+    ]
+    jobs.insert(2, songdkl.batch.CalculateJob('crash', 'compare', 6, 9))
+    jobs.insert(4, songdkl.batch.CalculateJob('raise', 'compare', 6, 9))
+
+    results = songdkl.batch.calculate_batch(jobs, n_jobs=2)
+
+    assert [result.job for result in results] == jobs
+    for result in results:
+        if result.job.ref_path == 'crash':
+            assert result.error == 'worker process crashed'
+            assert np.isnan(result.DKL_PQ)
+        elif result.job.ref_path == 'raise':
+            assert 'job failed' in result.error
+        else:
+            assert result.error is None
+            assert result.DKL_PQ == 0.5
+
+
+def _calculate_from_path_with_scheduler(*args, **kwargs):
+    """replaces ``songdkl.batch.calculate_from_path`` in worker processes,
+    to test that the scheduler is set inside each worker"""
+    return dask.config.get('scheduler', None), dask.config.get('num_workers', None), 100, 100
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                    reason='relies on monkeypatched function being inherited by forked worker processes')
+@pytest.mark.parametrize(
+    'n_jobs, scheduler, n_workers, expected_scheduler',
+    [
+        (1, 'threads', 2, 'threads'),
+        (2, None, None, 'synchronous'),
+        (2, 'threads', 2, 'threads'),
+    ]
+)
+def test_calculate_batch_scheduler(n_jobs, scheduler, n_workers, expected_scheduler, monkeypatch):
+    monkeypatch.setattr(songdkl.batch, 'calculate_from_path', _calculate_from_path_with_scheduler)
+    results = songdkl.batch.calculate_batch(JOBS, n_jobs=n_jobs, scheduler=scheduler, n_workers=n_workers)
+    for result in results:
+        assert result.error is None
+        assert result.DKL_PQ == expected_scheduler
+        assert result.DKL_QP == n_workers
+
+
+@pytest.mark.parametrize(
+    'kwargs',
+    [
+        dict(n_jobs=0),
+        dict(n_jobs=2, scheduler='distributed'),
+        dict(scheduler='foo'),
+    ]
+)
+def test_calculate_batch_raises(kwargs):
+    with pytest.raises(ValueError):
+        songdkl.batch.calculate_batch(JOBS, **kwargs)
@@ -0,0 +1,195 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+import songdkl.audio
+import songdkl.cache
+import songdkl.load
+import songdkl.prep
+
+from .fixtures.data import SONG_DATA_SUBDIRS
+
+SUBDIR_TO_USE = [
+    dir_ for dir_ in SONG_DATA_SUBDIRS if 'bk1bk3' in dir_.name and dir_.name.endswith('-small')
+]
+assert len(SUBDIR_TO_USE) == 1
+SUBDIR_TO_USE = SUBDIR_TO_USE[0]
+
+
+@pytest.fixture
+def wav_dir(tmp_path):
+    """copy of a directory of .wav files that tests can change"""
+    wav_dir = tmp_path / 'wavs'
+    wav_dir.mkdir()
+    for wav_path in sorted(SUBDIR_TO_USE.glob('*.wav')):
+        shutil.copy(wav_path, wav_dir)
+    return wav_dir
+
+
+def _raise(*args, **kwargs):
+    raise AssertionError('should have used PSDs from cache')
+
+
+@pytest.mark.parametrize(
+    'max_wavs, max_num_psds',
+    [
+        (None, None),
+        (None, 10),
+        (2, None),
+    ]
+)
+def test_prep_with_cache(max_wavs, max_num_psds, wav_dir, tmp_path, monkeypatch):
+    _, expected = songdkl.prep.prep(wav_dir, max_wavs, max_num_psds)
+
+    cache = songdkl.cache.PSDCache(tmp_path / 'cache')
+    segedpsds = songdkl.cache.prep_with_cache(wav_dir, cache, max_wavs, max_num_psds)
+    np.testing.assert_array_equal(segedpsds, expected)
+    assert len(list(cache.cache_dir.glob('*.npy'))) > 0
+
+    # second time everything should come from the cache
+    monkeypatch.setattr(songdkl.cache, 'iter_syls_and_psds', _raise)
+    segedpsds = songdkl.cache.prep_with_cache(wav_dir, cache, max_wavs, max_num_psds)
+    np.testing.assert_array_equal(segedpsds, expected)
+
+
+def test_prep_with_cache_changed_file(wav_dir, tmp_path, monkeypatch):
+    cache = songdkl.cache.PSDCache(tmp_path / 'cache')
+    songdkl.cache.prep_with_cache(wav_dir, cache, None, None)
+
+    # replace one file with a different one; only that file should be prepared again
+    wav_paths = sorted(wav_dir.glob('*.wav'))
+    shutil.copy(wav_paths[0], wav_paths[1])
+    prepared = []
+
+    def _iter_syls_and_psds(wav_paths, **kwargs):
+        prepared.extend(wav_paths)
+        return songdkl.syllables.iter_syls_and_psds(wav_paths, **kwargs)
+
+    monkeypatch.setattr(songdkl.cache, 'iter_syls_and_psds', _iter_syls_and_psds)
+    segedpsds = songdkl.cache.prep_with_cache(wav_dir, cache, None, None)
+    # contents of wav_paths[1] are now the same as wav_paths[0], so it is a hit too
+    assert prepared == []
+
+    wav_paths[2].write_bytes(wav_paths[2].read_bytes()[:-1024])
+    segedpsds = songdkl.cache.prep_with_cache(wav_dir, cache, None, None)
+    assert prepared == [wav_paths[2]]
+    _, expected = songdkl.prep.prep(wav_dir, None, None)
+    np.testing.assert_array_equal(segedpsds, expected)
+
+
+def test_cache_key_depends_on_params(wav_dir):
+    wav_path = sorted(wav_dir.glob('*.wav'))[0]
+    params = songdkl.cache.PREP_PARAMS
+    assert songdkl.cache.PSDCache.key(wav_path, params) == songdkl.cache.PSDCache.key(wav_path, dict(params))
+    assert (songdkl.cache.PSDCache.key(wav_path, params) !=
+            songdkl.cache.PSDCache.key(wav_path, dict(params, min_syl_dur=20)))
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = songdkl.cache.PSDCache(tmp_path / 'cache')
+    for mtime, key in enumerate(('a', 'b', 'c')):
+        cache.put(key, np.ones((10, 100)))
+        os.utime(cache.cache_dir / f'{key}.npy', (mtime, mtime))
+    entry_size = (cache.cache_dir / 'a.npy').stat().st_size
+    # using 'a' makes it the most recently used, so 'b' is now the least recently used
+    assert cache.get('a') is not None
+
+    cache.max_size = 2 * entry_size
+    cache.evict()
+    assert cache.size() <= cache.max_size
+    assert cache.get('a') is not None
+    assert cache.get('b') is None
+    assert cache.get('c') is not None
+
+
+def test_cache_put_tracks_size(tmp_path, monkeypatch):
+    cache = songdkl.cache.PSDCache(tmp_path / 'cache')
+    cache.put('a', np.ones((10, 100)))
+    entry_size = (cache.cache_dir / 'a.npy').stat().st_size
+
+    # cache is not full, so adding entries should not scan the cache directory
+    def _size():
+        raise AssertionError('should have used size tracked by cache')
+
+    monkeypatch.setattr(cache, 'size', _size)
+    monkeypatch.setattr(cache, 'evict', _size)
+    cache.put('b', np.ones((10, 100)))
+    cache.put('b', np.ones((10, 100)))  # replacing an entry does not change size
+    assert cache._size == 2 * entry_size
+    monkeypatch.undo()
+
+    cache.max_size = 2 * entry_size
+    cache.put('c', np.ones((10, 100)))
+    assert cache.size() <= cache.max_size
+    assert cache._size == cache.size()
+
+
+def test_cache_raises(tmp_path):
+    with pytest.raises(ValueError):
+        songdkl.cache.PSDCache(tmp_path / 'cache', max_size=-1)
+
+
+def test_get_cache_dir(tmp_path, monkeypatch):
+    monkeypatch.delenv(songdkl.cache.CACHE_DIR_ENV_VAR, raising=False)
+    assert songdkl.cache.get_cache_dir() is None
+    assert songdkl.cache.get_cache_dir(tmp_path) == tmp_path
+    monkeypatch.setenv(songdkl.cache.CACHE_DIR_ENV_VAR, str(tmp_path / 'env'))
+    assert songdkl.cache.get_cache_dir() == tmp_path / 'env'
+
+
+def test_load_or_prep_with_cache(wav_dir, tmp_path, monkeypatch):
+    cache_dir = tmp_path / 'cache'
+    expected = songdkl.load.load_or_prep(wav_dir, cache_dir=cache_dir)
+    monkeypatch.setattr(songdkl.cache, 'iter_syls_and_psds', _raise)
+    monkeypatch.setenv(songdkl.cache.CACHE_DIR_ENV_VAR, str(cache_dir))
+    segedpsds = songdkl.load.load_or_prep(wav_dir)
+    np.testing.assert_array_equal(segedpsds, expected)
+
+
+def test_prep_with_cache_freq_range(wav_dir, tmp_path):
+    cache = songdkl.cache.PSDCache(tmp_path / 'cache')
+    segedpsds = songdkl.cache.prep_with_cache(wav_dir, cache, None, None)
+    n_entries = len(list(cache.cache_dir.glob('*.npy')))
+    segedpsds_band = songdkl.cache.prep_with_cache(wav_dir, cache, None, None, freq_range=(1000, 8000))
+    assert len(list(cache.cache_dir.glob('*.npy'))) == 2 * n_entries
+    assert segedpsds_band.shape[0] == segedpsds.shape[0]
+    assert segedpsds_band.shape[1] < segedpsds.shape[1]
+
+
+def test_threshold_with_cache(wav_dir, tmp_path, monkeypatch):
+    wav_paths = sorted(wav_dir.glob('*.wav'))
+    expected = songdkl.audio.threshold_from_wavs(wav_paths)
+
+    cache = songdkl.cache.PSDCache(tmp_path / 'cache')
+    assert songdkl.cache.threshold_with_cache(wav_paths, cache) == expected
+    assert len(list(cache.cache_dir.glob('*.threshold.json'))) == 1
+
+    # second time threshold should come from the cache, even if files are in a different order
+    monkeypatch.setattr(songdkl.audio, 'threshold_from_wavs', _raise)
+    assert songdkl.cache.threshold_with_cache(wav_paths[::-1], cache) == expected
+
+    cache.clear()
+    assert list(cache.cache_dir.glob('*.threshold.json')) == []
+
+
+def test_prep_with_cache_pooled_threshold(wav_dir, tmp_path, monkeypatch):
+    cache = songdkl.cache.PSDCache(tmp_path / 'cache')
+    segedpsds = songdkl.cache.prep_with_cache(wav_dir, cache, None, None)
+    n_entries = len(list(cache.cache_dir.glob('*.npy')))
+
+    segedpsds_pooled = songdkl.cache.prep_with_cache(wav_dir, cache, None, None, threshold='pooled-half-otsu')
+    _, expected = songdkl.prep.prep(wav_dir, None, None, threshold='pooled-half-otsu')
+    np.testing.assert_array_equal(segedpsds_pooled, expected)
+    # threshold value is part of the key, so PSDs segmented with it are new entries
+    assert len(list(cache.cache_dir.glob('*.npy'))) == 2 * n_entries
+    assert len(list(cache.cache_dir.glob('*.threshold.json'))) == 1
+
+    # second time threshold and PSDs should come from the cache
+    monkeypatch.setattr(songdkl.audio, 'threshold_from_wavs', _raise)
+    monkeypatch.setattr(songdkl.cache, 'iter_syls_and_psds', _raise)
+    np.testing.assert_array_equal(
+        songdkl.cache.prep_with_cache(wav_dir, cache, None, None, threshold='pooled-half-otsu'), expected
+    )
+    np.testing.assert_array_equal(songdkl.cache.prep_with_cache(wav_dir, cache, None, None), segedpsds)
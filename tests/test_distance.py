@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+import scipy.spatial
+import zarr
+
+import songdkl.distance
+
+
+@pytest.mark.parametrize('dtype', ['float64', 'float32'])
+def test_sqeuclidean(dtype):
+    rng = np.random.default_rng(0)
+    X = rng.random((30, 100)).astype(dtype)
+    basis_set = X[:5]
+    expected = scipy.spatial.distance.cdist(X, basis_set, 'sqeuclidean')
+    D = songdkl.distance.sqeuclidean(X, basis_set)
+    assert D.dtype == np.dtype(dtype)
+    # error of expanded form is relative to the squared norms, not the distances
+    atol = 100 * np.finfo(dtype).eps * songdkl.distance.sq_norms(X.astype(np.float64)).max()
+    np.testing.assert_allclose(D, expected, atol=atol)
+    D = songdkl.distance.sqeuclidean(X, basis_set, songdkl.distance.sq_norms(basis_set))
+    np.testing.assert_allclose(D, expected, atol=atol)
+
+
+def test_sqeuclidean_clamped():
+    # rows that are identical to the basis set, with large norms so that rounding error is large
+    X = np.random.default_rng(0).random((10, 1000)) * 1e6
+    D = songdkl.distance.sqeuclidean(X, X)
+    assert np.all(D >= 0)
+
+
+@pytest.mark.parametrize('start, stop', [(0, None), (0, 13), (13, None), (5, 40)])
+@pytest.mark.parametrize('chunk_rows', [7, 1024])
+def test_distances_to_basis(start, stop, chunk_rows):
+    rng = np.random.default_rng(0)
+    psds = rng.random((50, 20))
+    basis_set = psds[:5]
+    expected = scipy.spatial.distance.cdist(psds[start:stop], basis_set, 'sqeuclidean')
+    D = songdkl.distance.distances_to_basis(psds, basis_set, start, stop, chunk_rows)
+    np.testing.assert_allclose(D, expected, atol=1e-12)
+    D = songdkl.distance.distances_to_basis(zarr.array(psds, chunks=(8, 20)), basis_set, start, stop, chunk_rows,
+                                            basis_sq_norms=songdkl.distance.sq_norms(basis_set))
+    np.testing.assert_allclose(D, expected, atol=1e-12)
+
+
+def test_distances_to_basis_float32():
+    psds = np.random.default_rng(0).random((50, 20))
+    D = songdkl.distance.distances_to_basis(psds, psds[:5].astype(np.float32))
+    assert D.dtype == np.float32
+    np.testing.assert_allclose(D, scipy.spatial.distance.cdist(psds, psds[:5], 'sqeuclidean'), atol=1e-5)
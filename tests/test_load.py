@@ -1,5 +1,6 @@
 import numpy as np
 import pytest
+import zarr
 
 from .fixtures.data import SONG_DATA_SUBDIRS, SONG_DATA_ZARR_PATHS
 
@@ -44,3 +45,93 @@ def test_load_zarr(song_data_zarr_factory,
     zarr_path = song_data_zarr_factory(test_data_bird_id, dataset_size='small')
     out = songdkl.load.load(zarr_path)
     assert isinstance(out, np.ndarray)
+
+
+def test_load_group(tmp_path):
+    psds = np.random.default_rng(0).random((10, 5))
+    zarr_path = tmp_path / 'bird.songdkl.zarr'
+    root = zarr.open_group(str(zarr_path), mode='w')
+    root.create_dataset('psds', data=psds, chunks=(4, 5))
+    root.create_dataset('wav_index', data=np.zeros(10, dtype=int))
+    out = songdkl.load.load(zarr_path)
+    np.testing.assert_array_equal(out, psds)
+    assert songdkl.load.n_psds(zarr_path) == 10
+
+
+def test_load_legacy_array(tmp_path):
+    psds = np.random.default_rng(0).random((10, 5))
+    zarr_path = tmp_path / 'bird.songdkl.zarr'
+    zarr.save(str(zarr_path), psds)
+    out = songdkl.load.load(zarr_path)
+    np.testing.assert_array_equal(out, psds)
+    assert songdkl.load.n_psds(zarr_path) == 10
+
+
+@pytest.mark.parametrize(
+    'rows',
+    [
+        None,
+        slice(2, 7),
+        slice(None, None, 3),
+        np.array([0, 4, 5, 9]),
+        np.array([9, 1, 1]),
+    ]
+)
+@pytest.mark.parametrize('suffix', ['.zarr', '.npy'])
+def test_load_rows(rows, suffix, tmp_path):
+    psds = np.random.default_rng(0).random((10, 5))
+    if suffix == '.zarr':
+        zarr_path = tmp_path / 'bird.songdkl.zarr'
+        root = zarr.open_group(str(zarr_path), mode='w')
+        root.create_dataset('psds', data=psds, chunks=(4, 5))
+    else:
+        zarr_path = tmp_path / 'bird.npy'
+        np.save(zarr_path, psds)
+    out = songdkl.load.load(zarr_path, rows=rows)
+    assert isinstance(out, np.ndarray)
+    expected = psds if rows is None else psds[rows]
+    np.testing.assert_array_equal(out, expected)
+
+
+def test_load_lazy(tmp_path):
+    psds = np.random.default_rng(0).random((10, 5))
+    zarr_path = tmp_path / 'bird.songdkl.zarr'
+    root = zarr.open_group(str(zarr_path), mode='w')
+    root.create_dataset('psds', data=psds, chunks=(4, 5))
+    out = songdkl.load.load(zarr_path, lazy=True)
+    assert isinstance(out, zarr.Array)
+    np.testing.assert_array_equal(out[:], psds)
+
+    npy_path = tmp_path / 'bird.npy'
+    np.save(npy_path, psds)
+    out = songdkl.load.load_or_prep(npy_path, lazy=True)
+    assert isinstance(out, np.memmap)
+    np.testing.assert_array_equal(out, psds)
+
+
+@pytest.mark.parametrize('dtype', ['float64', 'float32'])
+def test_load_or_prep_dtype(dtype):
+    out = songdkl.load.load_or_prep(ZARR_PATH_TO_USE, dtype=dtype)
+    assert out.dtype == np.dtype(dtype)
+    out = songdkl.load.load_or_prep(SUBDIR_TO_USE, max_wavs=2, dtype=dtype)
+    assert out.dtype == np.dtype(dtype)
+
+
+def test_load_or_prep_rows():
+    out = songdkl.load.load_or_prep(SUBDIR_TO_USE, max_wavs=2, rows=slice(None, None, 2))
+    expected = songdkl.load.load_or_prep(SUBDIR_TO_USE, max_wavs=2)
+    np.testing.assert_array_equal(out, expected[::2])
+
+
+def test_select_rows_raises():
+    with pytest.raises(ValueError):
+        songdkl.load.select_rows(np.zeros((10, 5)), np.zeros((2, 2), dtype=int))
+
+
+def test_subsample_rows():
+    rows = songdkl.load.subsample_rows(100, 10, seed=0)
+    assert len(rows) == 10
+    assert np.all(np.diff(rows) > 0)
+    np.testing.assert_array_equal(rows, songdkl.load.subsample_rows(100, 10, seed=0))
+    with pytest.raises(ValueError):
+        songdkl.load.subsample_rows(10, 11)
@@ -1,6 +1,8 @@
+import shutil
 import unittest.mock
 
 import pytest
+from sklearn.mixture import GaussianMixture
 
 import songdkl.__main__
 
@@ -20,10 +22,88 @@ import songdkl.__main__
             'songdkl.__main__.calculate_from_path',
             (0.5, 0.5, 50, 50),
         ),
+        (
+            [
+                'calculate',
+                '--manifest',
+                './tests/data-for-tests/manifest.tsv',
+                '--jobs',
+                '2',
+            ],
+            'songdkl.__main__.calculate_batch',
+            [],
+        ),
+        (
+            [
+                'calculate',
+                './tests/data-for-tests/source/song_data/bk1bk3-all',
+                './tests/data-for-tests/source/song_data/bk1bk9-all',
+                '6',
+                '9',
+                '--dtype',
+                'float32',
+                '--scheduler',
+                'threads',
+                '--n-workers',
+                '2',
+            ],
+            'songdkl.__main__.calculate_from_path',
+            (0.5, 0.5, 50, 50),
+        ),
+        (
+            [
+                'calculate-many',
+                './tests/data-for-tests/source/song_data/bk1bk3-all',
+                './tests/data-for-tests/source/song_data/bk1bk9-all',
+                './tests/data-for-tests/source/song_data/bk1bk9-small',
+                '--k-ref',
+                '6',
+                '--k-compare',
+                '9',
+                '--normalize',
+                'ref',
+            ],
+            'songdkl.__main__.calculate_many_from_path',
+            ([0.1, 0.2], [0.1, 0.2], 3000, [3000, 3000]),
+        ),
+        (
+            [
+                'calculate-matrix',
+                './tests/data-for-tests/source/song_data/bk1bk3-all',
+                './tests/data-for-tests/source/song_data/bk1bk9-all',
+                '--k',
+                '6',
+                '9',
+            ],
+            'songdkl.__main__.calculate_matrix_from_path',
+            None,
+        ),
+        (
+            [
+                'numsyls',
+                './tests/data-for-tests/source/song_data/bk1bk3-all',
+                '--dtype',
+                'float32',
+            ],
+            'songdkl.__main__.numsyls_from_path',
+            6,
+        ),
+        (
+            [
+                'numsyls',
+                './tests/data-for-tests/source/song_data/bk1bk3-all',
+            ],
+            'songdkl.__main__.numsyls_from_path',
+            6,
+        ),
         (
             [
                 'numsyls',
                 './tests/data-for-tests/source/song_data/bk1bk3-all',
+                '--cache-dir',
+                './tests/data-for-tests/generated/cache',
+                '--cache-max-size',
+                '0.5',
             ],
             'songdkl.__main__.numsyls_from_path',
             6,
@@ -35,7 +115,44 @@ import songdkl.__main__
                 ],
                 'songdkl.__main__.prep_and_save',
                 None,
-        )
+        ),
+        (
+                [
+                    'prep',
+                    './tests/data-for-tests/source/song_data/bk1bk3-all',
+                    '--incremental',
+                    '--max-num-psds',
+                    '500',
+                    '--freq-range',
+                    '1000',
+                    '8000',
+                    '--dtype',
+                    'float32',
+                    '--jobs',
+                    '4',
+                    '--scheduler',
+                    'threads',
+                    '--partition-size',
+                    '2',
+                    '--threshold',
+                    'pooled-half-otsu',
+                ],
+                'songdkl.__main__.prep_and_save',
+                None,
+        ),
+        (
+            [
+                'calculate',
+                './tests/data-for-tests/source/song_data/bk1bk3-all',
+                './tests/data-for-tests/source/song_data/bk1bk9-all',
+                '6',
+                '9',
+                '--threshold',
+                '0.01',
+            ],
+            'songdkl.__main__.calculate_from_path',
+            (0.5, 0.5, 50, 50),
+        ),
     ]
 )
 def test_main(argv, expected_function_called, return_value):
@@ -44,3 +161,86 @@ def test_main(argv, expected_function_called, return_value):
                              return_value=return_value) as patched:
         songdkl.__main__.main(argv)
     assert patched.called
+
+
+@pytest.mark.parametrize(
+    'threshold, expected',
+    [
+        ('half-average', 'half-average'),
+        ('pooled-half-otsu', 'pooled-half-otsu'),
+        ('0.01', 0.01),
+    ]
+)
+def test_main_threshold(threshold, expected):
+    argv = ['numsyls', './tests/data-for-tests/source/song_data/bk1bk3-all', '--threshold', threshold]
+    with unittest.mock.patch('songdkl.__main__.numsyls_from_path', autospec=True, return_value=6) as patched:
+        songdkl.__main__.main(argv)
+    assert patched.call_args.kwargs['threshold'] == expected
+
+
+def test_main_threshold_raises():
+    argv = ['numsyls', './tests/data-for-tests/source/song_data/bk1bk3-all', '--threshold', 'otsu']
+    with pytest.raises(SystemExit):
+        songdkl.__main__.main(argv)
+
+
+def test_main_manifest_scheduler():
+    argv = ['calculate', '--manifest', './tests/data-for-tests/manifest.tsv', '--jobs', '2',
+            '--scheduler', 'threads', '--n-workers', '2']
+    # the scheduler is set inside each worker process by ``calculate_batch``, not around it
+    with unittest.mock.patch('songdkl.__main__.dask_scheduler', side_effect=AssertionError):
+        with unittest.mock.patch('songdkl.__main__.calculate_batch', autospec=True, return_value=[]) as patched:
+            songdkl.__main__.main(argv)
+    assert patched.call_args.kwargs['scheduler'] == 'threads'
+    assert patched.call_args.kwargs['n_workers'] == 2
+
+
+def test_main_manifest_distributed_raises():
+    argv = ['calculate', '--manifest', './tests/data-for-tests/manifest.tsv', '--jobs', '2',
+            '--scheduler', 'distributed']
+    with pytest.raises(SystemExit):
+        songdkl.__main__.main(argv)
+
+
+REF_PSDS_PATH = './tests/data-for-tests/generated/song_data/bk1bk3-small/bk1bk3-small.songdkl.zarr'
+COMPARE_PSDS_PATH = './tests/data-for-tests/generated/song_data/bk1bk9-small/bk1bk9-small.songdkl.zarr'
+
+
+def test_main_save_and_use_ref_model(tmp_path, capsys):
+    ref_path = str(shutil.copytree(REF_PSDS_PATH, tmp_path / 'bk1bk3-small.songdkl.zarr'))
+    with unittest.mock.patch.object(GaussianMixture, 'fit', autospec=True,
+                                    side_effect=GaussianMixture.fit) as fit:
+        songdkl.__main__.main(['calculate', ref_path, COMPARE_PSDS_PATH, '6', '9', '--save-ref-model', 'k6'])
+    # the model of the reference is fit once, and then used to score the bird compared with it
+    assert fit.call_count == 2
+    expected = capsys.readouterr().out
+    model = songdkl.model.load_model(ref_path, name='k6')
+    assert model.k == 6
+    DKL_PQ, DKL_QP, _, _ = songdkl.model.calculate_from_model(model, [songdkl.load.load(COMPARE_PSDS_PATH)], [9])
+    assert expected.split('\t')[5:7] == [str(DKL_PQ[0]), str(DKL_QP[0])]
+
+    # the model of the reference is never fit again, only the models of the birds compared with it
+    with unittest.mock.patch.object(GaussianMixture, 'fit', autospec=True,
+                                    side_effect=GaussianMixture.fit) as fit:
+        songdkl.__main__.main(['calculate-from-model', f'{ref_path}:k6', COMPARE_PSDS_PATH, COMPARE_PSDS_PATH,
+                               '--k-compare', '9'])
+    assert fit.call_count == 2
+    for call in fit.call_args_list:
+        assert call.args[0].n_components == 9
+    assert capsys.readouterr().out == expected * 2
+
+
+@pytest.mark.parametrize(
+    'argv',
+    [
+        ['calculate', './tests/data-for-tests/source/song_data/bk1bk3-all',
+         COMPARE_PSDS_PATH, '6', '9', '--save-ref-model', 'k6'],
+        ['calculate', '--manifest', './tests/data-for-tests/manifest.tsv', '--save-ref-model', 'k6'],
+        ['calculate-from-model', REF_PSDS_PATH, COMPARE_PSDS_PATH, '--k-compare', 'nine'],
+        ['calculate-from-model', REF_PSDS_PATH, COMPARE_PSDS_PATH],
+        ['calculate-from-model', REF_PSDS_PATH, COMPARE_PSDS_PATH, '--k-compare', '9', '--dtype', 'float32'],
+    ]
+)
+def test_main_ref_model_raises(argv):
+    with pytest.raises(SystemExit):
+        songdkl.__main__.main(argv)
@@ -0,0 +1,99 @@
+import shutil
+import unittest.mock
+
+import numpy as np
+import pytest
+from sklearn.mixture import GaussianMixture
+
+import songdkl
+
+
+REF_PSDS_PATH = './tests/data-for-tests/generated/song_data/bk1bk3-small/bk1bk3-small.songdkl.zarr'
+COMPARE_PSDS_PATH = './tests/data-for-tests/generated/song_data/bk1bk9-small/bk1bk9-small.songdkl.zarr'
+
+
+@pytest.mark.smoke
+def test_fit_model():
+    psds = songdkl.load.load(REF_PSDS_PATH)
+    model = songdkl.model.fit_model(psds, 6, source=REF_PSDS_PATH)
+    assert isinstance(model, songdkl.model.BirdModel)
+    assert model.gmm.n_components == model.k == 6
+    np.testing.assert_array_equal(model.basis_set, psds[:50])
+    assert model.distances.shape == (len(psds), 50)
+    assert model.mx == np.max(model.distances)
+    assert model.n_psds == len(psds)
+    assert model.source == REF_PSDS_PATH
+
+
+
+def test_fit_model_from_path():
+    expected = songdkl.model.fit_model(songdkl.load.load(REF_PSDS_PATH), 6, source=REF_PSDS_PATH)
+    model = songdkl.model.fit_model_from_path(REF_PSDS_PATH, 6, max_wavs=None, max_num_psds=None)
+    np.testing.assert_array_equal(model.basis_set, expected.basis_set)
+    np.testing.assert_array_equal(model.distances, expected.distances)
+    np.testing.assert_array_equal(model.gmm.means_, expected.gmm.means_)
+    assert model.source == REF_PSDS_PATH
+
+
+@pytest.mark.smoke
+def test_calculate_from_model():
+    psds_ref, psds_compare = songdkl.load.load(REF_PSDS_PATH), songdkl.load.load(COMPARE_PSDS_PATH)
+    psds_compares = [psds_compare, psds_compare[:60]]
+    expected = songdkl.songdkl.calculate_many(psds_ref, psds_compares, 6, [9, 9], normalize='ref')
+    model = songdkl.model.fit_model(psds_ref, 6)
+    with unittest.mock.patch.object(GaussianMixture, 'fit', autospec=True,
+                                    side_effect=GaussianMixture.fit) as fit:
+        out = songdkl.model.calculate_from_model(model, psds_compares, [9, 9])
+    # only the models of the birds compared with the reference are fit
+    assert fit.call_count == len(psds_compares)
+    for out_, expected_ in zip(out, expected):
+        np.testing.assert_array_equal(out_, expected_)
+
+
+@pytest.mark.parametrize('in_dataset', [True, False])
+def test_save_load_model(in_dataset, tmp_path):
+    psds_ref, psds_compare = songdkl.load.load(REF_PSDS_PATH), songdkl.load.load(COMPARE_PSDS_PATH)
+    model = songdkl.model.fit_model(psds_ref, 6, source=REF_PSDS_PATH)
+    if in_dataset:
+        zarr_path = shutil.copytree(REF_PSDS_PATH, tmp_path / 'bk1bk3-small.songdkl.zarr')
+    else:
+        zarr_path = tmp_path / 'bk1bk3-small.songdkl-model.zarr'
+    songdkl.model.save_model(model, zarr_path)
+    songdkl.model.save_model(songdkl.model.fit_model(psds_ref, 3, n_basis=10), zarr_path, name='k3')
+
+    loaded = songdkl.model.load_model(zarr_path)
+    for attr in ('weights_', 'means_', 'covariances_', 'precisions_cholesky_'):
+        np.testing.assert_array_equal(getattr(loaded.gmm, attr), getattr(model.gmm, attr))
+    np.testing.assert_array_equal(loaded.basis_set, model.basis_set)
+    np.testing.assert_array_equal(loaded.distances, model.distances)
+    assert loaded.mx == model.mx
+    assert (loaded.k, loaded.gmm_kwargs, loaded.basis, loaded.source) == (
+        model.k, model.gmm_kwargs, model.basis, model.source
+    )
+    assert songdkl.model.load_model(zarr_path, name='k3').k == 3
+    attrs = songdkl.model.load_model_attrs(zarr_path, name='k3')
+    assert (attrs['k'], attrs['n_basis']) == (3, 10)
+    if in_dataset:
+        np.testing.assert_array_equal(songdkl.load.load(zarr_path), psds_ref)
+
+    expected = songdkl.model.calculate_from_model(model, [psds_compare], [9])
+    out = songdkl.model.calculate_from_model_path(zarr_path, [COMPARE_PSDS_PATH], [9],
+                                                  max_wavs=None, max_num_psds=None)
+    for out_, expected_ in zip(out, expected):
+        np.testing.assert_array_equal(out_, expected_)
+
+
+def test_load_model_raises():
+    with pytest.raises(ValueError):
+        songdkl.model.load_model(REF_PSDS_PATH)
+    with pytest.raises(ValueError):
+        songdkl.model.load_model_attrs(REF_PSDS_PATH)
+
+
+def test_calculate_from_model_raises():
+    model = songdkl.model.fit_model(np.random.rand(100, 10), 2, n_basis=5)
+    psds = np.random.rand(100, 10)
+    with pytest.raises(ValueError):
+        songdkl.model.calculate_from_model(model, [psds], [2, 2])
+    with pytest.raises(ValueError):
+        songdkl.model.calculate_from_model(model, [psds], [2], normalize='max')
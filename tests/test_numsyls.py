@@ -1,5 +1,6 @@
+import numpy as np
 import pytest
-import zarr
+from sklearn.mixture import GaussianMixture
 
 from .fixtures.data import SONG_DATA_SUBDIRS, SONG_DATA_ZARR_PATHS
 
@@ -22,11 +23,144 @@ ZARR_PATH_TO_USE = ZARR_PATH_TO_USE[0]
 
 @pytest.mark.smoke
 def test_numsyls():
-    array = zarr.load(ZARR_PATH_TO_USE)
+    array = songdkl.load.load(ZARR_PATH_TO_USE)
     out = songdkl.numsyls.numsyls(array)
     assert isinstance(out, int)
 
 
+@pytest.mark.parametrize(
+    'n_splits, n_jobs, backend',
+    [
+        (1, 2, 'threads'),
+        (1, 2, 'processes'),
+        (3, 2, 'threads'),
+        (3, 2, 'processes'),
+    ]
+)
+def test_numsyls_parallel(n_splits, n_jobs, backend):
+    """Test that fitting in parallel gives the same result as fitting sequentially"""
+    array = songdkl.load.load(ZARR_PATH_TO_USE)
+    kwargs = dict(max_components=8, n_splits=n_splits, gmm_kwargs=dict(n_init=1, random_state=42))
+    expected = songdkl.numsyls.numsyls(array, **kwargs)
+    out = songdkl.numsyls.numsyls(array, n_jobs=n_jobs, backend=backend, **kwargs)
+    assert out == expected
+
+
+@pytest.mark.parametrize(
+    'n_jobs, patience',
+    [
+        (1, 3),
+        (4, 3),
+        (1, 5),
+    ]
+)
+def test_numsyls_early_stop(n_jobs, patience):
+    array = songdkl.load.load(ZARR_PATH_TO_USE)
+    kwargs = dict(max_components=16, gmm_kwargs=dict(n_init=1, random_state=42), return_bics=True)
+    n_syls_exhaustive, bics_exhaustive = songdkl.numsyls.numsyls(array, **kwargs)
+    n_syls, bics = songdkl.numsyls.numsyls(array, search='early-stop', patience=patience, n_jobs=n_jobs, **kwargs)
+    assert isinstance(n_syls, int)
+    assert n_syls in bics
+    assert bics[n_syls] == min(bics.values())
+    # evaluated numbers of components should be the first N in the exhaustive search
+    assert list(bics.keys()) == list(bics_exhaustive.keys())[:len(bics)]
+    for n_components, bic in bics.items():
+        assert bic == pytest.approx(bics_exhaustive[n_components])
+    if len(bics) < len(bics_exhaustive):
+        # if we stopped early, should be because BIC rose `patience` times in a row
+        assert np.all(np.diff(list(bics.values())[-(patience + 1):]) > 0)
+
+
+@pytest.mark.parametrize(
+    'bics, patience, expected',
+    [
+        ([5., 4., 3., 4., 5., 6., 2.], 3, 5),
+        ([5., 4., 3., 4., 3.5, 4., 5.], 3, None),
+        ([5., 4., 3., 4., 3.5, 4., 5.], 2, 6),
+        ([5., 4., 3.], 1, None),
+    ]
+)
+def test_find_early_stop(bics, patience, expected):
+    assert songdkl.numsyls._find_early_stop(bics, patience) == expected
+
+
+@pytest.mark.parametrize(
+    'covariance_type',
+    [
+        'full',
+        'tied',
+        'diag',
+        'spherical',
+    ]
+)
+@pytest.mark.parametrize(
+    'n_splits, n_jobs, search',
+    [
+        (1, 1, 'exhaustive'),
+        (3, 2, 'exhaustive'),
+        (1, 1, 'early-stop'),
+    ]
+)
+def test_numsyls_warm_start(covariance_type, n_splits, n_jobs, search):
+    array = songdkl.load.load(ZARR_PATH_TO_USE)
+    n_syls, bics = songdkl.numsyls.numsyls(array, max_components=8, n_splits=n_splits, n_jobs=n_jobs, search=search,
+                                           gmm_kwargs=dict(covariance_type=covariance_type, random_state=42),
+                                           return_bics=True, warm_start=True)
+    assert isinstance(n_syls, int)
+    assert bics[n_syls] == min(bics.values())
+    if search == 'exhaustive':
+        assert list(bics.keys()) == list(range(2, 8))
+    assert all(np.isfinite(bic) for bic in bics.values())
+
+
+@pytest.mark.parametrize(
+    'covariance_type',
+    [
+        'full',
+        'tied',
+        'diag',
+        'spherical',
+    ]
+)
+def test_split_component(covariance_type):
+    rng = np.random.default_rng(42)
+    X = np.concatenate(
+        [rng.normal(loc, 1., size=(100, 3)) for loc in (-5., 0., 5.)]
+    )
+    gmm = GaussianMixture(n_components=2, covariance_type=covariance_type, random_state=42).fit(X)
+    init_kwargs = songdkl.numsyls._split_component(gmm, X)
+    assert init_kwargs['weights_init'].shape == (3,)
+    assert init_kwargs['weights_init'].sum() == pytest.approx(1.)
+    assert init_kwargs['means_init'].shape == (3, 3)
+    # should be able to initialize a model with one more component from these parameters
+    GaussianMixture(n_components=3, covariance_type=covariance_type, **init_kwargs).fit(X)
+
+
+def test_numsyls_raises():
+    array = songdkl.load.load(ZARR_PATH_TO_USE)
+    with pytest.raises(ValueError):
+        songdkl.numsyls.numsyls(array, n_jobs=2, backend='not-a-backend')
+    with pytest.raises(ValueError):
+        songdkl.numsyls.numsyls(array, n_jobs=0)
+    with pytest.raises(ValueError):
+        songdkl.numsyls.numsyls(array, search='not-a-search')
+    with pytest.raises(ValueError):
+        songdkl.numsyls.numsyls(array, search='early-stop', patience=0)
+    with pytest.raises(ValueError):
+        songdkl.numsyls.numsyls(array, dtype='float16')
+    with pytest.raises(ValueError):
+        songdkl.numsyls.numsyls(array, gmm_kwargs={'n_components': 2})
+    with pytest.raises(TypeError):
+        songdkl.numsyls.numsyls(array, gmm_kwargs=['not', 'a', 'dict'])
+
+
+def test_numsyls_float32():
+    array = songdkl.load.load(ZARR_PATH_TO_USE)
+    expected = songdkl.numsyls.numsyls(array, max_components=10)
+    out = songdkl.numsyls.numsyls(array.astype(np.float32), max_components=10, dtype='float32')
+    assert out == expected
+
+
 @pytest.mark.smoke
 @pytest.mark.parametrize(
     'ref_path, max_wavs, max_num_psds',
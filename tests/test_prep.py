@@ -1,6 +1,8 @@
 import copy
 import pathlib
 
+import crowsetta
+
 import numpy as np
 import pytest
 import shutil
@@ -8,6 +10,9 @@ import zarr
 
 from .fixtures.data import SONG_DATA_SUBDIRS
 
+import songdkl.audio
+import songdkl.load
+import songdkl.model
 import songdkl.prep
 
 
@@ -38,6 +43,13 @@ def test_prep(dir_path, max_wavs, max_num_psds, kwargify):
         assert segedpsds.shape[0] <= max_num_psds
 
 
+def test_prep_dtype():
+    _, segedpsds = songdkl.prep.prep(SONG_DATA_SUBDIRS_SMALL[0], max_wavs=2, dtype='float32')
+    assert segedpsds.dtype == np.float32
+    with pytest.raises(ValueError):
+        songdkl.prep.prep(SONG_DATA_SUBDIRS_SMALL[0], max_wavs=2, dtype='float16')
+
+
 @pytest.mark.smoke
 @pytest.mark.parametrize(
     'dir_path, output_dir_path, max_wavs, max_num_psds',
@@ -97,7 +109,13 @@ def test_prep_and_save(dir_path, output_dir_path, max_wavs, max_num_psds, tmp_pa
         wav_paths = sorted(a_dir_path.glob('*.wav'))
         if max_wavs:
             wav_paths = wav_paths[:max_wavs]
-        for wav_path in wav_paths:
+        # files after the one where we reached ``max_num_psds`` are not used, so are not annotated
+        entries = zarr.open_group(str(an_output_dir_path / f'{a_dir_path.name}.songdkl.zarr'),
+                                  mode='r').attrs['wavs']
+        assert [entry['name'] for entry in entries] == [wav_path.name for wav_path in wav_paths[:len(entries)]]
+        if not max_num_psds:
+            assert len(entries) == len(wav_paths)
+        for wav_path in wav_paths[:len(entries)]:
             simple_seq_path = sorted(an_output_dir_path.glob(f'{wav_path.name}-threshold-*'))
             assert len(simple_seq_path) == 1
             simple_seq_path = simple_seq_path[0]
@@ -108,7 +126,266 @@ def test_prep_and_save(dir_path, output_dir_path, max_wavs, max_num_psds, tmp_pa
         # NOTE an_output_dir_path can be == dir_path here
         expected = an_output_dir_path / f'{a_dir_path.name}.songdkl.zarr'
         assert expected.exists()
-        saved = zarr.load(expected)
+        saved = songdkl.load.load(expected)
         assert isinstance(saved, np.ndarray)
         if max_num_psds:
             assert saved.shape[0] <= max_num_psds
+            # we only use files until we reach ``max_num_psds``
+            assert sum(entry['n_psds'] for entry in entries[:-1]) < max_num_psds
+
+
+@pytest.mark.parametrize('n_jobs', [1, 2, -1])
+def test_prep_and_save_n_jobs(n_jobs, tmp_path):
+    dir_path = [
+        shutil.copytree(dir_path_, tmp_path / dir_path_.name) for dir_path_ in SONG_DATA_SUBDIRS_SMALL
+    ]
+    results = songdkl.prep.prep_and_save(dir_path, max_wavs=None, max_num_psds=None, n_jobs=n_jobs)
+    assert [result.dir_path for result in results] == dir_path
+    for a_dir_path, result in zip(dir_path, results):
+        assert result.zarr_path == a_dir_path / f'{a_dir_path.name}.songdkl.zarr'
+        assert result.n_wavs == len(sorted(a_dir_path.glob('*.wav')))
+        assert result.n_psds == songdkl.load.load(result.zarr_path).shape[0]
+        _assert_matches_full_prep(a_dir_path, a_dir_path)
+
+
+@pytest.mark.parametrize(
+    'n_jobs, scheduler, partition_size',
+    [
+        (None, 'threads', 2),
+        (2, 'synchronous', None),
+    ]
+)
+def test_prep_and_save_scheduler(n_jobs, scheduler, partition_size, tmp_path):
+    dir_path = [
+        shutil.copytree(dir_path_, tmp_path / dir_path_.name) for dir_path_ in SONG_DATA_SUBDIRS_SMALL[:2]
+    ]
+    songdkl.prep.prep_and_save(dir_path, max_wavs=None, max_num_psds=None, n_jobs=n_jobs, scheduler=scheduler,
+                               partition_size=partition_size)
+    for a_dir_path in dir_path:
+        _assert_matches_full_prep(a_dir_path, a_dir_path)
+
+
+@pytest.mark.parametrize(
+    'kwargs',
+    [
+        dict(n_jobs=0),
+        dict(scheduler='foo'),
+    ]
+)
+def test_prep_and_save_raises(kwargs, tmp_path):
+    with pytest.raises(ValueError):
+        songdkl.prep.prep_and_save(SONG_DATA_SUBDIRS_SMALL[0], tmp_path, **kwargs)
+
+
+def _assert_matches_full_prep(dir_path, output_dir_path):
+    """assert that dataset updated incrementally has the same PSDs and annotations
+    as a dataset prepared from scratch from the .wav files listed in its manifest"""
+    root = zarr.open_group(str(output_dir_path / f'{dir_path.name}.songdkl.zarr'), mode='r')
+    entries = root.attrs['wavs']
+    wav_paths = [dir_path / entry['name'] for entry in entries]
+    syls_and_psds = list(songdkl.syllables.iter_syls_and_psds(wav_paths, freq_range=root.attrs['freq_range']))
+    expected = np.concatenate([psds for _, psds in syls_and_psds])
+    saved = root['psds'][:]
+    np.testing.assert_array_equal(saved, expected.astype(root.attrs['dtype']))
+    assert sum(entry['n_psds'] for entry in entries) == saved.shape[0]
+    np.testing.assert_array_equal(
+        root['wav_index'][:], np.repeat(np.arange(len(entries)), [entry['n_psds'] for entry in entries])
+    )
+    np.testing.assert_array_equal(
+        root['onset_sample'][:],
+        np.concatenate([[slice_.start for slice_ in syls.slices[:len(psds)]] for syls, psds in syls_and_psds])
+    )
+
+    annots = crowsetta.formats.seq.GenericSeq.from_file(output_dir_path / f'{dir_path.name}.annot.csv').annots
+    assert [pathlib.Path(annot.notated_path).name for annot in annots] == [entry['name'] for entry in entries]
+    for entry in entries:
+        assert (output_dir_path / entry['annot_path']).exists()
+
+
+@pytest.mark.smoke
+def test_prep_and_save_incremental(tmp_path, monkeypatch):
+    src_dir = SONG_DATA_SUBDIRS_SMALL[0]
+    src_wav_paths = sorted(src_dir.glob('*.wav'))
+    dir_path = tmp_path / src_dir.name
+    dir_path.mkdir()
+    for wav_path in src_wav_paths[:3]:
+        shutil.copy(wav_path, dir_path)
+    output_dir_path = tmp_path / 'output'
+    output_dir_path.mkdir()
+
+    # no dataset yet, so this prepares from scratch
+    songdkl.prep.prep_and_save(dir_path, output_dir_path, max_wavs=None, max_num_psds=None, incremental=True)
+    _assert_matches_full_prep(dir_path, output_dir_path)
+
+    prepared = []
+
+    def _iter_syls_and_psds(wav_paths, *args, **kwargs):
+        prepared.extend(path.name for path in wav_paths)
+        return songdkl.syllables.iter_syls_and_psds(wav_paths, *args, **kwargs)
+
+    monkeypatch.setattr(songdkl.prep, 'iter_syls_and_psds', _iter_syls_and_psds)
+
+    # nothing changed
+    songdkl.prep.prep_and_save(dir_path, output_dir_path, max_wavs=None, max_num_psds=None, incremental=True)
+    assert prepared == []
+
+    # add new files, only those should be prepared
+    for wav_path in src_wav_paths[3:]:
+        shutil.copy(wav_path, dir_path)
+    songdkl.prep.prep_and_save(dir_path, output_dir_path, max_wavs=None, max_num_psds=None, incremental=True)
+    assert prepared == [wav_path.name for wav_path in src_wav_paths[3:]]
+    _assert_matches_full_prep(dir_path, output_dir_path)
+
+    # delete one file and change another; only the changed one should be prepared
+    prepared.clear()
+    (dir_path / src_wav_paths[0].name).unlink()
+    shutil.copy(src_wav_paths[2], dir_path / src_wav_paths[1].name)
+    songdkl.prep.prep_and_save(dir_path, output_dir_path, max_wavs=None, max_num_psds=None, incremental=True)
+    assert prepared == [src_wav_paths[1].name]
+    _assert_matches_full_prep(dir_path, output_dir_path)
+    assert not sorted(output_dir_path.glob(f'{src_wav_paths[0].name}-threshold-*'))
+
+
+@pytest.mark.parametrize('chunk_rows', [1, 3, 256])
+def test_drop_rows(chunk_rows, tmp_path):
+    zarr_path = tmp_path / 'test.songdkl.zarr'
+    writer = songdkl.prep._DatasetWriter(zarr_path, chunk_rows=chunk_rows)
+    rng = np.random.default_rng(0)
+    n_psds_per_wav = [4, 0, 5, 3, 2]
+    for wav_index, n_psds in enumerate(n_psds_per_wav):
+        writer.append_rows(rng.normal(size=(n_psds, 7)),
+                           wav_index=np.full(n_psds, wav_index),
+                           onset_sample=np.arange(n_psds), offset_sample=np.arange(n_psds) + 10,
+                           rate=np.full(n_psds, 32000))
+    writer.close()
+    root = zarr.open_group(str(zarr_path), mode='r')
+    expected = {name: root[name][:] for name in ('psds',) + songdkl.prep.ROW_METADATA}
+
+    keep_wavs = np.array([True, True, False, True, False])
+    keep_rows = np.repeat(keep_wavs, n_psds_per_wav)
+    new_wav_index = np.cumsum(keep_wavs) - 1
+    songdkl.prep._drop_rows(zarr.open_group(str(zarr_path), mode='r+'), keep_rows, new_wav_index)
+
+    root = zarr.open_group(str(zarr_path), mode='r')
+    for name, arr in expected.items():
+        if name == 'wav_index':
+            np.testing.assert_array_equal(root[name][:], new_wav_index[arr[keep_rows]])
+        else:
+            np.testing.assert_array_equal(root[name][:], arr[keep_rows])
+
+
+def test_prep_and_save_incremental_limits(tmp_path):
+    src_dir = SONG_DATA_SUBDIRS_SMALL[0]
+    src_wav_paths = sorted(src_dir.glob('*.wav'))
+    dir_path = tmp_path / src_dir.name
+    dir_path.mkdir()
+    for wav_path in src_wav_paths[:2]:
+        shutil.copy(wav_path, dir_path)
+
+    songdkl.prep.prep_and_save(dir_path, max_wavs=3, max_num_psds=None, incremental=True)
+    for wav_path in src_wav_paths[2:]:
+        shutil.copy(wav_path, dir_path)
+    songdkl.prep.prep_and_save(dir_path, max_wavs=3, max_num_psds=None, incremental=True)
+    entries = zarr.open_group(str(dir_path / f'{dir_path.name}.songdkl.zarr'), mode='r').attrs['wavs']
+    assert [entry['name'] for entry in entries] == [wav_path.name for wav_path in src_wav_paths[:3]]
+    _assert_matches_full_prep(dir_path, dir_path)
+
+
+def test_prep_and_save_incremental_removes_models(tmp_path):
+    src_dir = SONG_DATA_SUBDIRS_SMALL[0]
+    src_wav_paths = sorted(src_dir.glob('*.wav'))
+    dir_path = tmp_path / src_dir.name
+    dir_path.mkdir()
+    for wav_path in src_wav_paths[:3]:
+        shutil.copy(wav_path, dir_path)
+    songdkl.prep.prep_and_save(dir_path, max_wavs=None, max_num_psds=None, incremental=True)
+    zarr_path = dir_path / f'{dir_path.name}.songdkl.zarr'
+    model = songdkl.model.fit_model(songdkl.load.load(zarr_path), 2, n_basis=5)
+    songdkl.model.save_model(model, zarr_path)
+
+    # nothing changed, so model is kept
+    songdkl.prep.prep_and_save(dir_path, max_wavs=None, max_num_psds=None, incremental=True)
+    songdkl.model.load_model(zarr_path)
+
+    # new files added, so model is no longer fit to the dataset
+    for wav_path in src_wav_paths[3:]:
+        shutil.copy(wav_path, dir_path)
+    songdkl.prep.prep_and_save(dir_path, max_wavs=None, max_num_psds=None, incremental=True)
+    with pytest.raises(ValueError):
+        songdkl.model.load_model(zarr_path)
+    _assert_matches_full_prep(dir_path, dir_path)
+
+
+def test_prep_and_save_incremental_freq_range(tmp_path):
+    dir_path = shutil.copytree(SONG_DATA_SUBDIRS_SMALL[0], tmp_path / SONG_DATA_SUBDIRS_SMALL[0].name)
+    songdkl.prep.prep_and_save(dir_path, max_wavs=None, max_num_psds=None, incremental=True)
+    n_cols = songdkl.load.load(dir_path / f'{dir_path.name}.songdkl.zarr').shape[1]
+    # different freq_range, so dataset is prepared again from scratch
+    songdkl.prep.prep_and_save(dir_path, max_wavs=None, max_num_psds=None, incremental=True,
+                               freq_range=(1000, 8000))
+    assert songdkl.load.load(dir_path / f'{dir_path.name}.songdkl.zarr').shape[1] < n_cols
+    _assert_matches_full_prep(dir_path, dir_path)
+
+
+@pytest.mark.parametrize('dtype', ['float64', 'float32'])
+def test_prep_and_save_format(dtype, tmp_path):
+    dir_path = shutil.copytree(SONG_DATA_SUBDIRS_SMALL[0], tmp_path / SONG_DATA_SUBDIRS_SMALL[0].name)
+    songdkl.prep.prep_and_save(dir_path, max_wavs=4, max_num_psds=None, dtype=dtype)
+    root = zarr.open_group(str(dir_path / f'{dir_path.name}.songdkl.zarr'), mode='r')
+    assert root['psds'].dtype == np.dtype(dtype)
+    assert root['psds'].chunks == (songdkl.prep.PSD_CHUNK_ROWS, root['psds'].shape[1])
+    assert root['psds'].compressor.cname == 'zstd'
+    for name in songdkl.prep.ROW_METADATA:
+        assert root[name].shape == (root['psds'].shape[0],)
+    assert np.all(root['rate'][:] == 32000)
+    assert np.all(root['offset_sample'][:] > root['onset_sample'][:])
+    assert root.attrs['songdkl_version'] == songdkl.__about__.__version__
+    assert root.attrs['format_version'] == songdkl.prep.DATASET_FORMAT_VERSION
+    assert root.attrs['freq_range'] == list(songdkl.constants.DEFAULT_FREQ_RANGE)
+    assert root.attrs['max_wavs'] == 4
+    assert root.attrs['max_num_psds'] is None
+    assert root.attrs['dtype'] == dtype
+    assert len(root.attrs['wavs']) == 4
+    _assert_matches_full_prep(dir_path, dir_path)
+
+
+
+@pytest.mark.parametrize('threshold', ['pooled-half-otsu', 'pooled-half-average'])
+def test_prep_and_save_pooled_threshold(threshold, tmp_path):
+    dir_path = shutil.copytree(SONG_DATA_SUBDIRS_SMALL[0], tmp_path / SONG_DATA_SUBDIRS_SMALL[0].name)
+    wav_paths = sorted(dir_path.glob('*.wav'))[:4]
+    songdkl.prep.prep_and_save(dir_path, max_wavs=4, max_num_psds=None, threshold=threshold)
+    root = zarr.open_group(str(dir_path / f'{dir_path.name}.songdkl.zarr'), mode='r')
+    expected_value = songdkl.audio.threshold_from_wavs(wav_paths, threshold[len('pooled-'):])
+    assert root.attrs['threshold'] == threshold
+    assert root.attrs['threshold_value'] == pytest.approx(expected_value)
+
+    syls_and_psds = songdkl.syllables.iter_syls_and_psds(wav_paths, threshold=expected_value)
+    expected = np.concatenate([psds for _, psds in syls_and_psds])
+    np.testing.assert_array_equal(root['psds'][:], expected)
+
+    # prepared with a different threshold, so dataset is prepared again from scratch
+    songdkl.prep.prep_and_save(dir_path, max_wavs=4, max_num_psds=None, incremental=True)
+    root = zarr.open_group(str(dir_path / f'{dir_path.name}.songdkl.zarr'), mode='r')
+    assert root.attrs['threshold'] == 'half-otsu'
+    assert root.attrs['threshold_value'] is None
+    _assert_matches_full_prep(dir_path, dir_path)
+
+
+def test_prep_threshold_raises():
+    with pytest.raises(ValueError):
+        songdkl.prep.prep(SONG_DATA_SUBDIRS_SMALL[0], threshold='otsu')
+
+
+def test_prep_and_save_dtype_raises(tmp_path):
+    with pytest.raises(ValueError):
+        songdkl.prep.prep_and_save(SONG_DATA_SUBDIRS_SMALL[0], tmp_path, dtype='int16')
+
+
+def test_prep_and_save_incremental_legacy(tmp_path):
+    dir_path = shutil.copytree(SONG_DATA_SUBDIRS_SMALL[0], tmp_path / SONG_DATA_SUBDIRS_SMALL[0].name)
+    zarr_path = dir_path / f'{dir_path.name}.songdkl.zarr'
+    # dataset saved by an earlier version as a single array, without a manifest
+    zarr.save(str(zarr_path), np.zeros((3, 10)))
+    songdkl.prep.prep_and_save(dir_path, max_wavs=None, max_num_psds=None, incremental=True)
+    _assert_matches_full_prep(dir_path, dir_path)
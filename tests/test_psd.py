@@ -0,0 +1,88 @@
+import matplotlib.mlab
+import numpy as np
+import pytest
+
+import songdkl.psd
+import songdkl.syllables
+
+
+@pytest.mark.parametrize(
+    'signal_len, nfft, expected',
+    [
+        (100, 256, 1),
+        (256, 256, 1),
+        (511, 256, 1),
+        (512, 256, 2),
+        (1000, 256, 3),
+    ]
+)
+def test_n_frames(signal_len, nfft, expected):
+    assert songdkl.psd.n_frames(signal_len, nfft) == expected
+
+
+@pytest.mark.parametrize('nfft', [256, 257, 16384])
+@pytest.mark.parametrize('max_frames_per_chunk', [1, 4, 256])
+def test_welch_psd(nfft, max_frames_per_chunk):
+    rng = np.random.default_rng(42)
+    signal_lens = rng.integers(10, 4 * nfft, size=20)
+    signals = [rng.standard_normal(signal_len) for signal_len in signal_lens]
+    fs = 32000
+
+    psds = songdkl.psd.welch_psd(signals, nfft=nfft, fs=fs, max_frames_per_chunk=max_frames_per_chunk)
+
+    assert psds.shape == (len(signals), nfft // 2 + 1)
+    expected = np.array([matplotlib.mlab.psd(signal, NFFT=nfft, Fs=fs)[0] for signal in signals])
+    np.testing.assert_allclose(psds, expected, rtol=1e-9, atol=1e-15)
+
+
+@pytest.mark.parametrize('dtype', [np.int16, np.float64])
+def test_welch_psd_normalize(dtype):
+    rng = np.random.default_rng(42)
+    audio = (rng.standard_normal(20000) * 1000).astype(dtype)
+    slices = [slice(0, 300), slice(1000, 5000), slice(6000, 6100), slice(8000, 20000)]
+    signals = [audio[slice_] for slice_ in slices]
+    nfft, fs = 1024, 32000
+
+    psds = songdkl.psd.welch_psd(signals, nfft=nfft, fs=fs, normalize=True)
+
+    expected = songdkl.psd.welch_psd([songdkl.syllables.norm(signal) for signal in signals], nfft=nfft, fs=fs)
+    np.testing.assert_array_equal(psds, expected)
+
+
+def test_welch_psd_empty():
+    psds = songdkl.psd.welch_psd([], nfft=256, fs=32000)
+    assert psds.shape == (0, 129)
+
+
+@pytest.mark.parametrize(
+    'freq_range, nfft, fs, expected',
+    [
+        ((600, 16000), 16384, 32000, slice(307, 8192)),
+        ((0, 16000), 16384, 32000, slice(0, 8192)),
+        ((1000, 8000), 22579, 44100, slice(512, 4096)),
+    ]
+)
+def test_band_bins(freq_range, nfft, fs, expected):
+    assert songdkl.psd.band_bins(freq_range, nfft, fs) == expected
+
+
+@pytest.mark.parametrize(
+    'freq_range',
+    [
+        (16000, 600),
+        (-1, 600),
+        (600, 20000),
+    ]
+)
+def test_band_bins_raises(freq_range):
+    with pytest.raises(ValueError):
+        songdkl.psd.band_bins(freq_range, 16384, 32000)
+
+
+def test_welch_psd_bins():
+    rng = np.random.default_rng(42)
+    signals = [rng.standard_normal(signal_len) for signal_len in rng.integers(10, 1000, size=20)]
+    bins = songdkl.psd.band_bins((600, 8000), nfft=256, fs=32000)
+    psds = songdkl.psd.welch_psd(signals, nfft=256, fs=32000, bins=bins)
+    expected = songdkl.psd.welch_psd(signals, nfft=256, fs=32000)[:, bins]
+    np.testing.assert_allclose(psds, expected)
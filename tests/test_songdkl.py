@@ -1,3 +1,4 @@
+import numpy as np
 import pytest
 import zarr
 
@@ -21,8 +22,8 @@ import songdkl
     ]
 )
 def test_calculate(ref_psds_path, compare_psds_path, k_ref, k_compare):
-    psds_ref = zarr.load(ref_psds_path)
-    psds_compare = zarr.load(compare_psds_path)
+    psds_ref = songdkl.load.load(ref_psds_path)
+    psds_compare = songdkl.load.load(compare_psds_path)
     out = songdkl.songdkl.calculate(psds_ref, psds_compare, k_ref, k_compare)
     assert len(out) == 4
     score1, score2, n_psds_ref, n_psds_compare = out
@@ -32,6 +33,34 @@ def test_calculate(ref_psds_path, compare_psds_path, k_ref, k_compare):
     assert isinstance(n_psds_compare, int)
 
 
+def test_calculate_lazy():
+    ref_psds_path = './tests/data-for-tests/generated/song_data/bk1bk3-small/bk1bk3-small.songdkl.zarr'
+    compare_psds_path = './tests/data-for-tests/generated/song_data/bk1bk9-small/bk1bk9-small.songdkl.zarr'
+    expected = songdkl.songdkl.calculate(
+        songdkl.load.load(ref_psds_path), songdkl.load.load(compare_psds_path), 6, 9
+    )
+    out = songdkl.songdkl.calculate(
+        songdkl.load.load(ref_psds_path, lazy=True), songdkl.load.load(compare_psds_path, lazy=True), 6, 9
+    )
+    assert out == expected
+
+
+def test_calculate_float32():
+    ref_psds_path = './tests/data-for-tests/generated/song_data/bk1bk3-small/bk1bk3-small.songdkl.zarr'
+    compare_psds_path = './tests/data-for-tests/generated/song_data/bk1bk9-small/bk1bk9-small.songdkl.zarr'
+    psds_ref, psds_compare = songdkl.load.load(ref_psds_path), songdkl.load.load(compare_psds_path)
+    expected = songdkl.songdkl.calculate(psds_ref, psds_compare, 6, 9)
+    out = songdkl.songdkl.calculate(psds_ref.astype(np.float32), psds_compare.astype(np.float32), 6, 9,
+                                    dtype='float32')
+    np.testing.assert_allclose(out[:2], expected[:2], rtol=1e-3)
+    assert out[2:] == expected[2:]
+    out = songdkl.songdkl.calculate_from_path(ref_psds_path, compare_psds_path, 6, 9,
+                                              max_wavs=None, max_num_psds=None, dtype='float32')
+    np.testing.assert_allclose(out[:2], expected[:2], rtol=1e-3)
+    with pytest.raises(ValueError):
+        songdkl.songdkl.calculate(psds_ref, psds_compare, 6, 9, dtype='float16')
+
+
 @pytest.mark.smoke
 @pytest.mark.parametrize(
     'ref_path, compare_path, k_ref, k_compare, max_wavs, max_num_psds',
@@ -68,3 +97,132 @@ def test_calculate_from_path(ref_path, compare_path, k_ref, k_compare, max_wavs,
     assert isinstance(score2, float)
     assert isinstance(n_psds_ref, int)
     assert isinstance(n_psds_compare, int)
+
+
+@pytest.mark.parametrize(
+    'rows',
+    [
+        slice(0, 40),
+        slice(None, None, 2),
+        np.array([0, 3, 5, 8, 13, 21, 34, 55, 60, 61, 62, 63, 64, 65, 66, 67, 68, 69, 70, 71]),
+    ]
+)
+def test_calculate_from_path_rows(rows):
+    ref_path = './tests/data-for-tests/generated/song_data/bk1bk3-small/bk1bk3-small.songdkl.zarr'
+    compare_path = './tests/data-for-tests/generated/song_data/bk1bk9-small/bk1bk9-small.songdkl.zarr'
+    out = songdkl.songdkl.calculate_from_path(ref_path, compare_path, 3, 3, max_wavs=None, max_num_psds=None,
+                                              n_basis=10, rows=rows)
+    expected = songdkl.songdkl.calculate(
+        songdkl.load.load(ref_path)[rows], songdkl.load.load(compare_path)[rows], 3, 3, n_basis=10
+    )
+    assert out == expected
+
+
+
+@pytest.mark.smoke
+@pytest.mark.parametrize(
+    'normalize',
+    [
+        'pair',
+        'ref',
+        'all',
+    ]
+)
+def test_calculate_many(normalize):
+    ref_psds_path = './tests/data-for-tests/generated/song_data/bk1bk3-small/bk1bk3-small.songdkl.zarr'
+    compare_psds_path = './tests/data-for-tests/generated/song_data/bk1bk9-small/bk1bk9-small.songdkl.zarr'
+    psds_ref, psds_compare = songdkl.load.load(ref_psds_path), songdkl.load.load(compare_psds_path)
+    psds_compares = [psds_compare, psds_compare[:60]]
+    DKL_PQ, DKL_QP, n_psds_ref, n_psds_compare = songdkl.songdkl.calculate_many(
+        psds_ref, psds_compares, 6, [9, 9], normalize=normalize
+    )
+    assert DKL_PQ.shape == DKL_QP.shape == (2,)
+    assert n_psds_ref == len(psds_ref)
+    assert n_psds_compare == [len(psds) for psds in psds_compares]
+    if normalize == 'pair':
+        # should be exactly the same as calling ``calculate`` for each bird
+        for compare_ind, psds in enumerate(psds_compares):
+            expected = songdkl.songdkl.calculate(psds_ref, psds, 6, 9)
+            assert (DKL_PQ[compare_ind], DKL_QP[compare_ind]) == expected[:2]
+    elif normalize == 'ref':
+        # result for each bird should not depend on other birds
+        out = songdkl.songdkl.calculate_many(psds_ref, psds_compares[1:], 6, [9], normalize=normalize)
+        assert out[0][0] == DKL_PQ[1]
+        assert out[1][0] == DKL_QP[1]
+
+
+def test_calculate_many_raises():
+    psds = [np.random.rand(100, 10), np.random.rand(100, 10)]
+    with pytest.raises(ValueError):
+        songdkl.songdkl.calculate_many(psds[0], psds[1:], 6, [6, 6])
+    with pytest.raises(ValueError):
+        songdkl.songdkl.calculate_many(psds[0], [], 6, [])
+    with pytest.raises(ValueError):
+        songdkl.songdkl.calculate_many(psds[0], psds[1:], 6, [6], normalize='max')
+
+
+@pytest.mark.smoke
+def test_calculate_many_from_path():
+    ref_path = './tests/data-for-tests/generated/song_data/bk1bk3-small/bk1bk3-small.songdkl.zarr'
+    compare_paths = [
+        './tests/data-for-tests/generated/song_data/bk1bk9-small/bk1bk9-small.songdkl.zarr',
+        './tests/data-for-tests/generated/song_data/bk1bk9-all/bk1bk9-all.songdkl.zarr',
+    ]
+    DKL_PQ, DKL_QP, n_psds_ref, n_psds_compare = songdkl.songdkl.calculate_many_from_path(
+        ref_path, compare_paths, 6, [9, 9], max_wavs=None, max_num_psds=None
+    )
+    for compare_ind, compare_path in enumerate(compare_paths):
+        expected = songdkl.songdkl.calculate_from_path(ref_path, compare_path, 6, 9,
+                                                       max_wavs=None, max_num_psds=None)
+        assert (DKL_PQ[compare_ind], DKL_QP[compare_ind], n_psds_ref, n_psds_compare[compare_ind]) == expected
+
+
+@pytest.mark.smoke
+@pytest.mark.parametrize(
+    'psds_paths, ks',
+    [
+        (
+            [
+                './tests/data-for-tests/generated/song_data/bk1bk3-small/bk1bk3-small.songdkl.zarr',
+                './tests/data-for-tests/generated/song_data/bk1bk9-small/bk1bk9-small.songdkl.zarr',
+            ],
+            [6, 9],
+        ),
+    ]
+)
+def test_calculate_matrix(psds_paths, ks):
+    psds = [songdkl.load.load(psds_path) for psds_path in psds_paths]
+    out = songdkl.songdkl.calculate_matrix(psds, ks)
+    assert len(out) == 3
+    DKL_PQ, DKL_QP, n_psds = out
+    for matrix in (DKL_PQ, DKL_QP):
+        assert isinstance(matrix, np.ndarray)
+        assert matrix.shape == (len(psds), len(psds))
+        np.testing.assert_array_equal(np.diag(matrix), 0.)
+    assert n_psds == [len(psds_) for psds_ in psds]
+
+
+def test_calculate_matrix_raises():
+    psds = [np.random.rand(100, 10), np.random.rand(100, 10)]
+    with pytest.raises(ValueError):
+        songdkl.songdkl.calculate_matrix(psds, [6])
+
+
+@pytest.mark.smoke
+def test_calculate_matrix_from_path(tmp_path):
+    paths = [
+        './tests/data-for-tests/generated/song_data/bk1bk3-small/bk1bk3-small.songdkl.zarr',
+        './tests/data-for-tests/generated/song_data/bk1bk9-small/bk1bk9-small.songdkl.zarr',
+    ]
+    ks = [6, 9]
+    output_path = tmp_path / 'matrix.zarr'
+    DKL_PQ, DKL_QP, n_psds = songdkl.songdkl.calculate_matrix_from_path(
+        paths, ks, output_path=output_path, max_wavs=None, max_num_psds=None
+    )
+    assert output_path.exists()
+    root = zarr.open_group(str(output_path), mode='r')
+    np.testing.assert_array_equal(root['DKL_PQ'][:], DKL_PQ)
+    np.testing.assert_array_equal(root['DKL_QP'][:], DKL_QP)
+    assert root.attrs['paths'] == paths
+    assert root.attrs['ks'] == ks
+    assert root.attrs['n_psds'] == n_psds
@@ -1,5 +1,7 @@
 import pathlib
 
+import dask
+import matplotlib.mlab
 import numpy as np
 import pytest
 
@@ -74,3 +76,206 @@ def test_convert_syl_to_psd(list_of_wav_paths):
     assert all(
         [isinstance(psd, np.ndarray) for psd in psds]
     )
+
+
+def test_convert_syl_to_psd_matches_mlab(list_of_wav_paths):
+    """test that PSDs computed with ``songdkl.psd.welch_psd`` are the same as
+    computing them one syllable at a time with ``matplotlib.mlab.psd``"""
+    syls_from_wavs = songdkl.syllables.get_all_syls(list_of_wav_paths)
+    psds = songdkl.syllables.convert_syl_to_psd(syls_from_wavs)
+
+    expected = []
+    for syls_from_wav in syls_from_wavs:
+        fs = syls_from_wav.rate
+        nfft = int(round(2 ** 14 / 32000.0 * fs))
+        segstart = int(round(600 / (fs / float(nfft))))
+        segend = int(round(16000 / (fs / float(nfft))))
+        for syl in syls_from_wav.syls:
+            Pxx, _ = matplotlib.mlab.psd(songdkl.syllables.norm(syl), NFFT=nfft, Fs=fs)
+            expected.append(songdkl.syllables.norm(Pxx[segstart:segend]))
+
+    assert len(psds) == len(expected)
+    np.testing.assert_allclose(np.array(psds), np.array(expected), rtol=1e-7, atol=1e-10)
+
+
+@pytest.mark.parametrize(
+    'freq_range',
+    [
+        (600, 16000),
+        (1000, 8000),
+    ]
+)
+def test_convert_syl_to_psd_freq_range(freq_range, list_of_wav_paths):
+    syls_from_wavs = songdkl.syllables.get_all_syls(list_of_wav_paths)
+    psds = songdkl.syllables.convert_syl_to_psd(syls_from_wavs, freq_range=freq_range)
+    fs = syls_from_wavs[0].rate
+    nfft = int(round(2 ** 14 / 32000.0 * fs))
+    bins = songdkl.psd.band_bins(freq_range, nfft, fs)
+    assert all(psd.shape == (bins.stop - bins.start,) for psd in psds)
+
+
+@pytest.mark.parametrize('max_num_psds', [None, 1, 20])
+@pytest.mark.parametrize('batch_size', [None, 1, 2])
+def test_iter_syls_and_psds(max_num_psds, batch_size, list_of_wav_paths, monkeypatch):
+    syls_from_wavs = songdkl.syllables.get_all_syls(list_of_wav_paths)
+    expected = songdkl.syllables.convert_syl_to_psd(syls_from_wavs, max_num_psds)
+
+    syllabified = []
+    original_syllabify_and_convert = songdkl.syllables._syllabify_and_convert
+
+    def _syllabify_and_convert(wav_path, *args, **kwargs):
+        syllabified.append(wav_path)
+        return original_syllabify_and_convert(wav_path, *args, **kwargs)
+
+    # use a scheduler that runs in this process, so that monkeypatching works
+    monkeypatch.setattr(songdkl.syllables, '_syllabify_and_convert', _syllabify_and_convert)
+    with dask.config.set(scheduler='synchronous'):
+        out = list(
+            songdkl.syllables.iter_syls_and_psds(list_of_wav_paths, max_num_psds, batch_size=batch_size)
+        )
+
+    assert all(isinstance(syls_from_wav, songdkl.syllables.SyllablesFromWav) for syls_from_wav, _ in out)
+    psds = np.concatenate([psds for _, psds in out])
+    np.testing.assert_array_equal(psds, np.array(expected))
+    if max_num_psds:
+        # should stop reading files once we have enough PSDs
+        n_syls = np.cumsum([len(syls_from_wav.syls) for syls_from_wav in syls_from_wavs])
+        n_wavs_needed = np.searchsorted(n_syls, max_num_psds) + 1
+        assert len(out) == n_wavs_needed
+        if batch_size:
+            assert len(syllabified) <= int(np.ceil(n_wavs_needed / batch_size)) * batch_size
+    else:
+        assert len(out) == len(list_of_wav_paths)
+
+
+@pytest.mark.parametrize(
+    'scheduler, n_workers, expected',
+    [
+        ('threads', 2, dict(scheduler='threads', num_workers=2)),
+        ('synchronous', None, dict(scheduler='synchronous')),
+        (None, 1, dict(scheduler='synchronous', num_workers=1)),
+        (None, 3, dict(num_workers=3)),
+    ]
+)
+def test_dask_scheduler(scheduler, n_workers, expected):
+    with dask.config.set(scheduler='processes'):
+        with songdkl.syllables.dask_scheduler(scheduler, n_workers):
+            for key, value in expected.items():
+                assert dask.config.get(key) == value
+        assert dask.config.get('scheduler') == 'processes'
+
+
+def test_dask_scheduler_none_does_not_change_config():
+    with dask.config.set(scheduler='threads', num_workers=2):
+        with songdkl.syllables.dask_scheduler():
+            assert dask.config.get('scheduler') == 'threads'
+            assert dask.config.get('num_workers') == 2
+
+
+@pytest.mark.parametrize(
+    'scheduler, n_workers',
+    [
+        ('foo', None),
+        ('threads', 0),
+        (None, -2),
+    ]
+)
+def test_dask_scheduler_raises(scheduler, n_workers):
+    with pytest.raises(ValueError):
+        with songdkl.syllables.dask_scheduler(scheduler, n_workers):
+            pass
+
+
+def test_dask_scheduler_distributed(list_of_wav_paths):
+    pytest.importorskip('distributed')
+    expected = songdkl.syllables.get_all_psds(list_of_wav_paths, scheduler='synchronous')
+    with songdkl.syllables.dask_scheduler('distributed', 1):
+        psds = songdkl.syllables.get_all_psds(list_of_wav_paths)
+    np.testing.assert_array_equal(np.array(psds), np.array(expected))
+
+
+@pytest.mark.parametrize('max_num_psds', [None, 20])
+@pytest.mark.parametrize(
+    'scheduler, n_workers, partition_size',
+    [
+        (None, None, None),
+        ('synchronous', None, 2),
+        ('threads', 2, 1),
+    ]
+)
+@pytest.mark.parametrize('threshold', ['half-otsu', 'pooled-half-otsu'])
+def test_get_all_psds(max_num_psds, scheduler, n_workers, partition_size, threshold, list_of_wav_paths):
+    if threshold == 'half-otsu':
+        syls_from_wavs = songdkl.syllables.get_all_syls(list_of_wav_paths, scheduler=scheduler, n_workers=n_workers,
+                                                        partition_size=partition_size)
+        expected = songdkl.syllables.convert_syl_to_psd(syls_from_wavs, max_num_psds, scheduler=scheduler,
+                                                        n_workers=n_workers, partition_size=partition_size)
+    else:
+        # every file is segmented with one threshold computed from all files
+        threshold_value = songdkl.audio.threshold_from_wavs(list_of_wav_paths)
+        expected = [
+            psd
+            for _, psds in songdkl.syllables.iter_syls_and_psds(list_of_wav_paths, max_num_psds,
+                                                                threshold=threshold_value)
+            for psd in psds
+        ]
+    psds = songdkl.syllables.get_all_psds(list_of_wav_paths, max_num_psds, scheduler=scheduler, n_workers=n_workers,
+                                          partition_size=partition_size, threshold=threshold)
+    assert isinstance(psds, list)
+    np.testing.assert_array_equal(np.array(psds), np.array(expected))
+
+
+def test_get_all_psds_partition_size_raises(list_of_wav_paths):
+    with pytest.raises(ValueError):
+        songdkl.syllables.get_all_psds(list_of_wav_paths, partition_size=0)
+
+
+def test_iter_syls_and_psds_keep_syls(list_of_wav_paths):
+    syls_from_wavs = songdkl.syllables.get_all_syls(list_of_wav_paths, scheduler='synchronous')
+    out = list(
+        songdkl.syllables.iter_syls_and_psds(list_of_wav_paths, keep_syls=False, n_workers=1)
+    )
+    expected = songdkl.syllables.convert_syl_to_psd(syls_from_wavs, scheduler='synchronous')
+    for (syls_from_wav, psds), expected_syls_from_wav in zip(out, syls_from_wavs):
+        assert syls_from_wav.syls is None
+        assert syls_from_wav.slices == expected_syls_from_wav.slices
+        assert syls_from_wav.threshold == expected_syls_from_wav.threshold
+        assert syls_from_wav.rate == expected_syls_from_wav.rate
+    np.testing.assert_array_equal(np.concatenate([psds for _, psds in out]), np.array(expected))
+
+
+def _raise_blocks(*args, **kwargs):
+    raise AssertionError('should not have segmented in blocks')
+
+
+@pytest.mark.parametrize('blocked', [False, True])
+def test_syllabify_and_convert_keep_syls(blocked, wav_path, monkeypatch):
+    if blocked:
+        # segment even short files in small blocks
+        monkeypatch.setattr(songdkl.audio, 'SEGMENT_BLOCKED_MIN_SAMPLES', 0)
+        monkeypatch.setattr(songdkl.audio, 'SEGMENT_BLOCK_SIZE', 5000)
+    else:
+        # files shorter than SEGMENT_BLOCKED_MIN_SAMPLES are filtered only once, not in blocks
+        monkeypatch.setattr(songdkl.audio, '_threshold_from_blocks', _raise_blocks)
+    syls_from_wav, _ = songdkl.syllables._syllabify_and_convert(wav_path, songdkl.syllables.DEFAULT_FREQ_RANGE)
+    expected = songdkl.syllables._syllabify(wav_path)
+    assert syls_from_wav.slices == expected.slices
+    for syl, expected_syl in zip(syls_from_wav.syls, expected.syls):
+        # copied out of the memory-mapped .wav file
+        assert not isinstance(syl, np.memmap)
+        np.testing.assert_array_equal(syl, expected_syl)
+
+
+def test_iter_syls_and_psds_threshold(list_of_wav_paths):
+    threshold_value = songdkl.audio.threshold_from_wavs(list_of_wav_paths)
+    out = list(
+        songdkl.syllables.iter_syls_and_psds(list_of_wav_paths, keep_syls=False, n_workers=1,
+                                             threshold=threshold_value)
+    )
+    for (syls_from_wav, psds), wav_path in zip(out, list_of_wav_paths):
+        # every file is segmented with the same threshold
+        assert syls_from_wav.threshold == threshold_value
+        rate, data = songdkl.audio.load_wav(wav_path)
+        expected_slices, _ = songdkl.audio.get_syllable_slices_from_audio(data, rate, threshold=threshold_value)
+        assert syls_from_wav.slices == expected_slices
+        assert len(psds) == len(expected_slices)